@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Benchmark the cold start of the command line: import time of
+iplocationchanger.__main__ as reported by `python -X importtime`, the
+slowest modules it imports, and the wall time of `--help`.
+Sample usage:
+  python benchmarks/bench_startup.py --runs 20
+  python benchmarks/bench_startup.py --max-import-ms 80
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+
+# imported only once they are needed, reported when they show up at start up
+LAZY_MODULES = ('requests', 'urllib3', 'asyncio', 'aiohttp', 'http.server')
+
+parser = argparse.ArgumentParser(
+  prog='bench_startup',
+  description='Benchmark the start up time of the iplocationchanger command line.',
+)
+parser.add_argument('-n', '--runs', type=int, default=10, help='Interpreter starts per measurement')
+parser.add_argument('--top', type=int, default=10, help='Slowest modules to list')
+parser.add_argument('--max-import-ms', type=float, default=0, help='Exit 1 if the median import time exceeds this')
+parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+def import_times() -> dict[str, tuple[int, int]]:
+  """module -> (self, cumulative) microseconds of one fresh interpreter."""
+  completed = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', 'import iplocationchanger.__main__'],
+    cwd=SRC_DIR,
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  times = {}
+  for line in completed.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    self_us, cumulative_us, module = line[len('import time:'):].split('|')
+    module = module.strip()
+    if module == 'site':
+      # the interpreter's own start up, before the package is imported
+      times = {}
+      continue
+    times[module] = (int(self_us), int(cumulative_us))
+  return times
+
+def help_seconds() -> float:
+  start = time.perf_counter()
+  subprocess.run([sys.executable, '-m', 'iplocationchanger', '--help'], cwd=SRC_DIR, capture_output=True, check=True)
+  return time.perf_counter() - start
+
+def run(args: argparse.Namespace) -> dict:
+  package_ms = []
+  cumulative: dict[str, list[int]] = {}
+  lazy_imported = set()
+  for _ in range(args.runs):
+    times = import_times()
+    package_ms.append(times['iplocationchanger.__main__'][1] / 1000)
+    for module, (_, cumulative_us) in times.items():
+      cumulative.setdefault(module, []).append(cumulative_us)
+    lazy_imported |= {m for m in LAZY_MODULES if m in times}
+  help_ms = [help_seconds() * 1000 for _ in range(args.runs)]
+
+  # modules of the package and what they pull in, by median cumulative time
+  slowest = sorted(
+    ((m, statistics.median(us) / 1000) for m, us in cumulative.items() if m != 'iplocationchanger.__main__'),
+    key=lambda m: -m[1],
+  )
+  return {
+    'runs': args.runs,
+    'import_ms_median': statistics.median(package_ms),
+    'import_ms_min': min(package_ms),
+    'help_ms_median': statistics.median(help_ms),
+    'help_ms_min': min(help_ms),
+    'slowest_modules': slowest[:args.top],
+    'lazy_modules_imported': sorted(lazy_imported),
+  }
+
+def print_report(report: dict) -> None:
+  print(f'runs:                  {report["runs"]}')
+  print(f'import time median:    {report["import_ms_median"]:.1f} ms (min {report["import_ms_min"]:.1f} ms)')
+  print(f'--help wall median:    {report["help_ms_median"]:.1f} ms (min {report["help_ms_min"]:.1f} ms)')
+  print(f'lazy modules imported: {", ".join(report["lazy_modules_imported"]) or "none"}')
+  print('slowest modules (cumulative):')
+  for module, elapsed in report['slowest_modules']:
+    print(f'  {module:<56} {elapsed:.1f} ms')
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  report = run(args)
+  if args.json:
+    print(json.dumps(report, indent=2))
+  else:
+    print_report(report)
+  if args.max_import_ms > 0 and report['import_ms_median'] > args.max_import_ms:
+    print(f'import time {report["import_ms_median"]:.1f} ms exceeds {args.max_import_ms} ms', file=sys.stderr)
+    exit(1)
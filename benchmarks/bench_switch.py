@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Benchmark region switches of LocationChangerService against a fake openvpn
+executable and a fake WhatIsMyIP server, and report switch latency
+percentiles, API calls and client CPU time per switch.
+Sample usage:
+  python benchmarks/bench_switch.py --switches 100 --failure-rate 0.1 --api-error-rate 0.05
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+import time
+
+from tempfile import TemporaryDirectory
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src'))
+
+from iplocationchanger.service.location_changer_service import LocationChangerService
+from iplocationchanger.service.whatismyip_service import VALIDATIONS
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+
+from fake_whatismyip import FakeWhatIsMyIP
+
+parser = argparse.ArgumentParser(
+  prog='bench_switch',
+  description='Benchmark LocationChangerService region switches without real VPNs.',
+)
+parser.add_argument('-n', '--switches', type=int, default=50, help='Region switches to run')
+parser.add_argument('--countries', type=str, default='DE,TR,AR,BR', help='Countries switched between, in turn')
+parser.add_argument('--configs-per-country', type=int, default=2, help='Fake configs per country')
+parser.add_argument('--strategy', type=str, default='round-robin', help='Config selection strategy')
+parser.add_argument('--startup-delay', type=float, default=0.05, help='Seconds before fake openvpn writes its pid')
+parser.add_argument('--handshake-delay', type=float, default=0.2, help='Seconds from WAIT to CONNECTED')
+parser.add_argument('--failure-rate', type=float, default=0, help='Probability a fake tunnel fails')
+parser.add_argument('--validation', type=str, choices=VALIDATIONS, default='single', help=f'Validation: {", ".join(VALIDATIONS)}')
+parser.add_argument('--api-error-rate', type=float, default=0, help='Probability of an API error code (0-6)')
+parser.add_argument('--api-latency', type=float, default=0, help='Seconds the fake API takes per request')
+parser.add_argument('--connect-timeout', type=float, default=10, help='Seconds to wait for a tunnel')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the fake API error injection')
+parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+parser.add_argument(
+  '-x', '--log_level',
+  type=str,
+  choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+  default='ERROR',
+  help='Log level',
+)
+
+def percentile(values: list[float], p: float) -> float:
+  """Nearest-rank percentile."""
+  if len(values) == 0:
+    return 0.0
+  ordered = sorted(values)
+  rank = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+  return ordered[min(rank, len(ordered) - 1)]
+
+def free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+def write_executable(path: str, content: str) -> None:
+  with open(path, 'w') as f_ptr:
+    f_ptr.write(content)
+  os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+def prepare(td: str, args: argparse.Namespace) -> tuple[dict, str]:
+  """Put a pass-through `sudo` on PATH, write the fake openvpn launcher and
+  the config map. Returns (config map, openvpn path).
+  """
+  bin_dir = os.path.join(td, 'bin')
+  os.mkdir(bin_dir)
+  write_executable(os.path.join(bin_dir, 'sudo'), '#!/bin/sh\nexec "$@"\n')
+  openvpn_path = os.path.join(bin_dir, 'openvpn')
+  write_executable(
+    openvpn_path,
+    f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCHMARKS_DIR, "fake_openvpn.py")}" "$@"\n',
+  )
+  os.environ['PATH'] = f'{bin_dir}{os.pathsep}{os.environ.get("PATH", "")}'
+  os.environ['FAKE_OPENVPN_STARTUP_DELAY'] = str(args.startup_delay)
+  os.environ['FAKE_OPENVPN_HANDSHAKE_DELAY'] = str(args.handshake_delay)
+  os.environ['FAKE_OPENVPN_FAILURE_RATE'] = str(args.failure_rate)
+
+  config_map = {}
+  for country in args.countries.split(','):
+    config_map[country] = []
+    for i in range(args.configs_per_country):
+      path = os.path.join(td, f'{country.lower()}{i}.ovpn')
+      with open(path, 'w') as f_ptr:
+        f_ptr.write(f'client\nproto udp\nremote 127.0.0.1 {1194 + i}\n')
+      config_map[country].append(path)
+  return config_map, openvpn_path
+
+def run(args: argparse.Namespace) -> dict:
+  countries = args.countries.split(',')
+  latencies = []
+  cpu_times = []
+  api_calls = []
+  failures = 0
+
+  with TemporaryDirectory() as td, FakeWhatIsMyIP(
+    error_rate=args.api_error_rate,
+    latency=args.api_latency,
+    seed=args.seed,
+  ) as api:
+    config_map, openvpn_path = prepare(td, args)
+    metrics = Metrics()
+    cache = TTLCache()
+    metrics.watch_cache(cache)
+    lcs = LocationChangerService(
+      'benchmark',
+      config_map,
+      openvpn_path,
+      openvpn_management_port=free_port(),
+      location_cache=cache,
+      config_strategy=args.strategy,
+      metrics=metrics,
+      validation=args.validation,
+    )
+    lcs.wms.base_url = api.base_url
+    lcs.wms.backoff_factor = 0.01
+
+    try:
+      for i in range(args.switches):
+        country = countries[i % len(countries)]
+        api.country = country
+        requests_before = api.requests
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        try:
+          lcs.connect_region(country, args.connect_timeout)
+        except LocationChangerServiceException:
+          failures += 1
+        latencies.append(time.perf_counter() - start)
+        cpu_times.append(time.thread_time() - cpu_start)
+        api_calls.append(api.requests - requests_before)
+    finally:
+      lcs.disconnect_region()
+
+  phases = {}
+  for (phase,), (counts, total) in metrics.phase_seconds.values.items():
+    phases[phase] = total / max(sum(counts), 1)
+  return {
+    'switches': args.switches,
+    'failures': failures,
+    'failures_by_exception': {k[0]: v for k, v in metrics.switch_failures.values.items()},
+    'latency_p50': percentile(latencies, 50),
+    'latency_p95': percentile(latencies, 95),
+    'latency_p99': percentile(latencies, 99),
+    'latency_mean': sum(latencies) / max(len(latencies), 1),
+    'api_calls_per_switch': sum(api_calls) / max(len(api_calls), 1),
+    'api_errors': dict(api.errors),
+    'cpu_per_switch': sum(cpu_times) / max(len(cpu_times), 1),
+    'phase_means': phases,
+  }
+
+def print_report(report: dict) -> None:
+  print(f'switches:              {report["switches"]} ({report["failures"]} failed)')
+  for exception, count in sorted(report['failures_by_exception'].items()):
+    print(f'  {exception}: {int(count)}')
+  print(f'switch latency p50:    {report["latency_p50"] * 1000:.1f} ms')
+  print(f'switch latency p95:    {report["latency_p95"] * 1000:.1f} ms')
+  print(f'switch latency p99:    {report["latency_p99"] * 1000:.1f} ms')
+  print(f'switch latency mean:   {report["latency_mean"] * 1000:.1f} ms')
+  print(f'API calls per switch:  {report["api_calls_per_switch"]:.2f}')
+  errors = ', '.join(f'{code}: {count}' for code, count in report['api_errors'].items() if count > 0)
+  print(f'API error codes:       {errors or "none"}')
+  print(f'client CPU per switch: {report["cpu_per_switch"] * 1000:.2f} ms')
+  print('mean phase durations:')
+  for phase, elapsed in sorted(report['phase_means'].items(), key=lambda p: -p[1]):
+    print(f'  {phase:<22} {elapsed * 1000:.1f} ms')
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  logging.basicConfig(
+    format='%(asctime)s %(levelname)s %(module)s %(message)s',
+    level=logging.getLevelName(args.log_level),
+  )
+  report = run(args)
+  if args.json:
+    print(json.dumps(report, indent=2))
+  else:
+    print_report(report)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Stand-in for the openvpn executable, for benchmarking without VPN servers.
+It accepts the options OpenVPNService passes, daemonizes like
+`openvpn --daemon`, writes its pid to --writepid and walks through the
+connection states on its --management interface.
+Environment:
+  FAKE_OPENVPN_STARTUP_DELAY    seconds before the pid file and management
+                                interface appear (default 0.05)
+  FAKE_OPENVPN_HANDSHAKE_DELAY  seconds from WAIT to CONNECTED (default 0.2)
+  FAKE_OPENVPN_FAILURE_RATE     probability the tunnel fails with >FATAL
+                                instead of connecting (default 0)
+"""
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+
+# fraction of the handshake delay spent before reaching each state
+STATES = (
+  ('WAIT', 0.0),
+  ('AUTH', 0.3),
+  ('GET_CONFIG', 0.7),
+  ('ASSIGN_IP', 0.8),
+  ('ADD_ROUTES', 0.9),
+  ('CONNECTED', 1.0),
+)
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(add_help=False)
+  parser.add_argument('--config', default='')
+  parser.add_argument('--daemon', nargs='?', const='openvpn')
+  parser.add_argument('--writepid', default='')
+  parser.add_argument('--management', nargs=2, default=('127.0.0.1', '7505'))
+  args, _ = parser.parse_known_args()
+  return args
+
+def env_float(name: str, default: float) -> float:
+  return float(os.environ.get(name, default))
+
+
+class FakeTunnel:
+  def __init__(
+    self,
+    handshake_delay: float,
+    fail: bool,
+  ) -> None:
+    self.handshake_delay = handshake_delay
+    self.fail = fail
+    self.lock = threading.Lock()
+    self.state = 'CONNECTING'
+    self.listeners: list = []
+    self.done = threading.Event()
+
+  def state_line(self, state: str) -> str:
+    return f'{int(time.time())},{state},SUCCESS,10.8.0.2,198.51.100.1,1194,,'
+
+  def broadcast(self, line: str) -> None:
+    for f_ptr in list(self.listeners):
+      try:
+        f_ptr.write(f'{line}\r\n')
+        f_ptr.flush()
+      except OSError:
+        self.listeners.remove(f_ptr)
+
+  def run(self) -> None:
+    start = time.monotonic()
+    for state, fraction in STATES:
+      time.sleep(max(start + fraction * self.handshake_delay - time.monotonic(), 0))
+      if self.fail and state == 'GET_CONFIG':
+        with self.lock:
+          self.broadcast('>FATAL:Cannot resolve host address')
+        time.sleep(0.05)
+        self.done.set()
+        return
+      with self.lock:
+        self.state = state
+        self.broadcast(f'>STATE:{self.state_line(state)}')
+
+  def serve_client(self, conn: socket.socket) -> None:
+    with conn:
+      f_ptr = conn.makefile('rw', encoding='utf-8', newline='')
+      try:
+        f_ptr.write(">INFO:OpenVPN Management Interface Version 3 -- type 'help' for more info\r\n")
+        f_ptr.flush()
+        for line in f_ptr:
+          command = line.strip()
+          with self.lock:
+            if command == 'state on':
+              f_ptr.write('SUCCESS: real-time state notification set to ON\r\n')
+              self.listeners.append(f_ptr)
+            elif command == 'state':
+              f_ptr.write(f'{self.state_line(self.state)}\r\nEND\r\n')
+            else:
+              f_ptr.write(f'ERROR: unknown command [{command}]\r\n')
+            f_ptr.flush()
+      except OSError:
+        pass
+      finally:
+        with self.lock:
+          if f_ptr in self.listeners:
+            self.listeners.remove(f_ptr)
+
+
+def main() -> None:
+  args = parse_args()
+  startup_delay = env_float('FAKE_OPENVPN_STARTUP_DELAY', 0.05)
+  tunnel = FakeTunnel(
+    env_float('FAKE_OPENVPN_HANDSHAKE_DELAY', 0.2),
+    random.random() < env_float('FAKE_OPENVPN_FAILURE_RATE', 0),
+  )
+
+  if args.daemon is not None:
+    if os.fork() > 0:
+      os._exit(0)
+    os.setsid()
+    # release the caller's pipes like a daemon does
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+      os.dup2(devnull, fd)
+
+  time.sleep(startup_delay)
+  host, port = args.management
+  listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  listener.bind((host, int(port)))
+  listener.listen(4)
+  if len(args.writepid) > 0:
+    with open(args.writepid, 'w') as f_ptr:
+      f_ptr.write(f'{os.getpid()}\n')
+
+  threading.Thread(target=tunnel.run, daemon=True).start()
+  def accept() -> None:
+    while True:
+      conn, _ = listener.accept()
+      threading.Thread(target=tunnel.serve_client, args=(conn,), daemon=True).start()
+  threading.Thread(target=accept, daemon=True).start()
+  # a failed tunnel exits like openvpn does; a connected one runs until SIGTERM
+  tunnel.done.wait()
+  os._exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+"""Local HTTP server emulating WhatIsMyIP's `ip.php` and
+`ip-address-lookup.php`, for benchmarking without API quota.
+"""
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+# error bodies the API answers with instead of JSON
+ERROR_CODES = ('0', '1', '2', '3', '4', '5', '6')
+
+
+class FakeWhatIsMyIP:
+  """Serves the exit IP of the country set in `country`, one documentation
+  range address per country, and answers a random error code 0-6 to
+  `error_rate` of the requests.
+  """
+  def __init__(
+    self,
+    error_rate: float = 0,
+    latency: float = 0,
+    seed: int = 0,
+  ) -> None:
+    self.country = ''
+    self.error_rate = error_rate
+    self.latency = latency
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.errors = dict.fromkeys(ERROR_CODES, 0)
+    self.ips: dict[str, str] = {}
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def log_message(self, *_) -> None:
+        pass
+
+      def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, body = server.respond(url.path, params)
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.httpd.daemon_threads = True
+    self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+    self.thread = threading.Thread(
+      target=self.httpd.serve_forever,
+      kwargs={'poll_interval': 0.05},
+      daemon=True,
+    )
+
+  def __enter__(self) -> 'FakeWhatIsMyIP':
+    self.thread.start()
+    return self
+
+  def __exit__(self, *_) -> None:
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+  def ip_of(self, country: str) -> str:
+    if country not in self.ips:
+      self.ips[country] = f'198.51.100.{len(self.ips) + 1}'
+    return self.ips[country]
+
+  def respond(
+    self,
+    path: str,
+    params: dict[str, str],
+  ) -> tuple[int, str]:
+    if self.latency > 0:
+      time.sleep(self.latency)
+    with self.lock:
+      self.requests += 1
+      if self.random.random() < self.error_rate:
+        code = self.random.choice(ERROR_CODES)
+        self.errors[code] += 1
+        return 200, code
+      if path == '/ip.php':
+        return 200, json.dumps({'ip_address': self.ip_of(self.country)})
+      if path == '/ip-address-lookup.php':
+        # without input the caller's own address is looked up
+        ip = params.get('input', self.ip_of(self.country))
+        countries = {ip: country for country, ip in self.ips.items()}
+        return 200, json.dumps({'ip_address_lookup': [{
+          'status': 'ok',
+          'ip': ip,
+          'country': countries.get(ip, 'ZZ'),
+        }]})
+    return 404, 'not found'
@@ -1,11 +1,33 @@
 import argparse
 import logging
-import json
 import atexit
+import json
+import os
+import signal
+import subprocess
+import sys
 
 from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
 from iplocationchanger.service.location_changer_service import LocationChangerService
+from iplocationchanger.service.whatismyip_service import VALIDATIONS
+from iplocationchanger.service.local_geoip_service import LocalGeoIPService
+from iplocationchanger.service.control_service import ControlServer
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
+from iplocationchanger.service.http_location_provider import HTTPLocationProvider
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.service.sweep_service import SweepService
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.utils.ttl_cache import SQLiteCacheStore
+from iplocationchanger.utils.exit_history import ExitHistory
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.utils.metrics import MetricsServer
+from iplocationchanger.utils.token_bucket import parse_rate
 from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+from iplocationchanger.exception.local_geoip_service_exception import LocalGeoIPServiceException
+from iplocationchanger.exception.control_service_exception import ControlServiceException
+from iplocationchanger.exception.config_catalogue_service_exception import ConfigCatalogueServiceException
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+from iplocationchanger.exception.sweep_service_exception import SweepServiceException
 
 parser = argparse.ArgumentParser(
   prog = 'iplocationchanger',
@@ -33,9 +55,8 @@ parser.add_argument(
 
 parser.add_argument(
   '-l', '--country',
-  required=True,
   type=str,
-  help='Location to assume',
+  help='Location to assume, optional with --control-socket',
 )
 
 parser.add_argument(
@@ -46,6 +67,12 @@ parser.add_argument(
   help='OpenVPN execution binary path',
 )
 
+parser.add_argument(
+  '--openvpn-foreground',
+  action='store_true',
+  help='Keep openvpn as a child process instead of a daemon and stream its log (at DEBUG level)',
+)
+
 parser.add_argument(
   '-c', '--config',
   required=True,
@@ -53,6 +80,117 @@ parser.add_argument(
   help='Config to country JSON mapping file path',
 )
 
+parser.add_argument(
+  '--watch-config',
+  action='store_true',
+  help='Reload the config map and configs when they change on disk, keeping the active tunnel',
+)
+
+parser.add_argument(
+  '-s', '--config-strategy',
+  type=str,
+  choices=['round-robin', 'latency', 'random', 'probe', 'history'],
+  default='round-robin',
+  help='Order in which the configs of a country are tried',
+)
+
+parser.add_argument(
+  '--history-file',
+  type=str,
+  help='SQLite file recording every exit location validation; configs whose exit IPs are often in the wrong country are tried last',
+)
+
+parser.add_argument(
+  '-t', '--connect-timeout',
+  type=float,
+  default=30,
+  help='Seconds to wait for the OpenVPN tunnel to come up',
+)
+
+parser.add_argument(
+  '--reuse-window',
+  type=float,
+  default=60,
+  help='Seconds a validated tunnel is reused when its country is asked for again; 0 always reconnects',
+)
+
+parser.add_argument(
+  '-m', '--management-port',
+  type=int,
+  default=7505,
+  help='Local port for the OpenVPN management interface',
+)
+
+parser.add_argument(
+  '--cache-file',
+  type=str,
+  help='SQLite file caching IP location lookups across runs',
+)
+
+parser.add_argument(
+  '--cache-ttl',
+  type=float,
+  default=86400,
+  help='Seconds an IP location lookup stays cached',
+)
+
+parser.add_argument(
+  '-g', '--geoip-db',
+  type=str,
+  help='Local IP range CSV database used instead of WhatIsMyIP for location lookups',
+)
+
+parser.add_argument(
+  '--validation',
+  type=str,
+  choices=VALIDATIONS,
+  default='single',
+  help='How the exit location is checked: get_ip then a lookup, one lookup, racing all providers, '
+    'or the fastest providers with budget left until --quorum agree',
+)
+
+parser.add_argument(
+  '--location-provider',
+  type=str,
+  action='append',
+  default=[],
+  help='Extra provider for --validation race or scheduled: ipinfo, ifconfig.co, ip-api or ipapi.co; repeatable',
+)
+
+parser.add_argument(
+  '--provider-limit',
+  type=str,
+  action='append',
+  default=[],
+  help='Rate limit of a provider as NAME=COUNT/PERIOD, PERIOD one of s, min, h, d, e.g. whatismyip=1000/d; repeatable',
+)
+
+parser.add_argument(
+  '--quorum',
+  type=int,
+  default=1,
+  help='Providers which must agree on the country with --validation scheduled',
+)
+
+parser.add_argument(
+  '--control-socket',
+  type=str,
+  help='Run as a daemon taking connect/disconnect/status commands on this Unix socket',
+)
+
+parser.add_argument(
+  '--monitor-interval',
+  type=float,
+  default=0,
+  help='Seconds between tunnel health checks, reconnecting when they fail; 0 disables',
+)
+
+parser.add_argument(
+  '--metrics-port',
+  type=int,
+  help='Serve Prometheus metrics on this local port',
+)
+
 parser.add_argument(
   '-x', '--log_level',
   type=str,
@@ -61,33 +199,126 @@ parser.add_argument(
   default='INFO',
 )
 
+subparsers = parser.add_subparsers(dest='command')
+
+sweep_parser = subparsers.add_parser(
+  'sweep',
+  help='Run a command connected to each of a list of countries in turn',
+)
+
+sweep_parser.add_argument(
+  'countries',
+  type=str,
+  help='Comma separated countries, e.g. TR,DE,AR',
+)
+
+sweep_parser.add_argument(
+  '--retries',
+  type=int,
+  default=1,
+  help='Times the countries which failed are retried at the end',
+)
+
+sweep_parser.add_argument(
+  'cmd',
+  nargs=argparse.REMAINDER,
+  help='Command to run in each country, after --; IPLOCATIONCHANGER_COUNTRY holds the country',
+)
+
 def main(args: argparse.Namespace):
   try:
-    with open(args.config) as f_ptr:
-      config_to_country_map = json.load(f_ptr)
-    assert type(config_to_country_map) == dict
-  except Exception as e:
-    logging.exception(e)
+    config_to_country_map = ConfigCatalogueService.from_file(args.config)
+  except ConfigCatalogueServiceException as e:
+    logging.error(e)
     exit(1)
+  # broken configs were logged and are left out
+  if len(config_to_country_map) == 0:
+    logging.error(f'No usable config in {args.config}')
+    exit(1)
+  if args.watch_config:
+    config_to_country_map.watch()
+    atexit.register(config_to_country_map.stop_watching)
   
-  ovnc_path = ''
+  ovnc = None
+  if args.user and args.password:
+    try:
+      ovnc = OpenVPNCredentials(args.user, args.password)
+    except ValueError as e:
+      logging.error(e)
+      exit(1)
+
+  location_backend = None
+  if args.geoip_db:
+    try:
+      location_backend = LocalGeoIPService(args.geoip_db)
+    except LocalGeoIPServiceException as e:
+      logging.exception(e)
+      exit(1)
+
+  location_cache = TTLCache(
+    ttl=args.cache_ttl,
+    store=SQLiteCacheStore(args.cache_file) if args.cache_file else None,
+  )
+
+  metrics = Metrics()
+  metrics.watch_cache(location_cache)
+  if args.metrics_port:
+    metrics_server = MetricsServer(metrics, args.metrics_port)
+    try:
+      metrics_server.start()
+    except OSError as e:
+      logging.exception(e)
+      exit(1)
+    atexit.register(metrics_server.close)
 
   try:
-    ovnc = OpenVPNCredentials(args.user, args.password)
-    ovnc_path = ovnc.file_path()
-  except AttributeError:
-    pass
-  
+    location_registry = LocationProviderRegistry(quorum=args.quorum)
+    for name in args.location_provider:
+      location_registry.register(HTTPLocationProvider.from_preset(name, metrics=metrics))
+    for limit in args.provider_limit:
+      name, _, rate = limit.partition('=')
+      location_registry.limit(name, *parse_rate(rate))
+  except (LocationProviderException, ValueError) as e:
+    logging.error(e)
+    exit(1)
+
+  history = ExitHistory(args.history_file) if args.history_file else None
+
   lcs = LocationChangerService(
     args.api_key,
     config_to_country_map,
     args.openvpn,
-    openvpn_credentials_path=ovnc_path,
+    openvpn_credentials=ovnc,
+    openvpn_management_port=args.management_port,
+    location_cache=location_cache,
+    location_backend=location_backend,
+    config_strategy=args.config_strategy,
+    metrics=metrics,
+    validation=args.validation,
+    location_registry=location_registry,
+    openvpn_foreground=args.openvpn_foreground,
+    reuse_window=args.reuse_window,
+    history=history,
   )
-  atexit.register(lcs.disconnect_region)
+  atexit.register(lcs.disconnect_region, force=True)
+  if args.monitor_interval > 0:
+    lcs.start_monitor(
+      check_interval=args.monitor_interval,
+      connect_timeout=args.connect_timeout,
+    )
+    # stop before the tunnel is taken down, atexit runs in reverse
+    atexit.register(lcs.stop_monitor)
+
+  if args.command == 'sweep':
+    sweep(lcs, args)
+    return
+
+  if args.control_socket:
+    serve(lcs, args)
+    return
 
   try:
-    lcs.connect_region(args.country)
+    lcs.connect_region(args.country, args.connect_timeout)
   except LocationChangerServiceException as e:
     logging.error(e)
     exit(1)
@@ -95,8 +326,54 @@ def main(args: argparse.Namespace):
   logging.info(f'connected to {args.country}')
   input('Press ENTER to disconnect\n')
 
+def sweep(lcs: LocationChangerService, args: argparse.Namespace):
+  cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+  if len(cmd) == 0:
+    logging.error('sweep: no command given')
+    exit(1)
+
+  def task(country: str) -> str:
+    env = dict(os.environ, IPLOCATIONCHANGER_COUNTRY=country)
+    completed = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+      raise SweepServiceException(f'exit status {completed.returncode}: {completed.stderr.strip()}')
+    return completed.stdout
+
+  countries = [country.strip() for country in args.countries.split(',') if country.strip()]
+  report = SweepService(lcs, args.connect_timeout, args.retries).run(countries, task)
+  # one JSON object per country on stdout
+  for result in report.results.values():
+    print(json.dumps(result._asdict()))
+  logging.info(f'{len(countries)} countries in {report.seconds:.3f}s')
+  if len(report.failed()) > 0:
+    logging.error(f'failed: {", ".join(report.failed())}')
+    exit(1)
+
+def serve(lcs: LocationChangerService, args: argparse.Namespace):
+  server = ControlServer(lcs, args.control_socket, args.connect_timeout)
+  try:
+    server.bind()
+  except ControlServiceException as e:
+    logging.error(e)
+    exit(1)
+  if args.country:
+    try:
+      server.handle({'command': 'connect', 'country': args.country})
+    except LocationChangerServiceException as e:
+      logging.error(e)
+  # unwind through atexit, which disconnects
+  signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
 if __name__ == '__main__':
   args = parser.parse_args()
+  if not args.country and not args.control_socket and args.command != 'sweep':
+    parser.error('-l/--country is required unless --control-socket or sweep is given')
+  if args.config_strategy == 'history' and not args.history_file:
+    parser.error('--config-strategy history requires --history-file')
 
   logging.basicConfig(
     format='%(asctime)s %(levelname)s %(module)s %(message)s',
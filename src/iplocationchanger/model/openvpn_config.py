@@ -0,0 +1,109 @@
+from __future__ import annotations
+from typing import NamedTuple, Optional
+
+import shlex
+
+DEFAULT_PORT = 1194
+DEFAULT_PROTO = 'udp'
+
+class OpenVPNRemote(NamedTuple):
+  host: str
+  port: int
+  proto: str
+
+  @property
+  def transport(self: OpenVPNRemote) -> str:
+    """'tcp' or 'udp', whatever the address family suffix (tcp4-client, udp6...)."""
+    return 'tcp' if self.proto.startswith('tcp') else 'udp'
+
+
+class OpenVPNConfig:
+  """Directives of an openvpn configuration file.
+  Inline blocks such as <ca>...</ca> are kept in `inline`, <connection>
+  blocks are flattened into the directive list.
+  """
+  def __init__(
+    self: OpenVPNConfig,
+    path: str,
+    directives: list[tuple[str, list[str]]],
+    inline: dict[str, str],
+  ) -> None:
+    self.path = path
+    self.directives = directives
+    self.inline = inline
+
+  @classmethod
+  def from_file(
+    cls: OpenVPNConfig,
+    path: str,
+  ) -> OpenVPNConfig:
+    with open(path) as f_ptr:
+      return cls.parse(f_ptr.read(), path)
+
+  @classmethod
+  def parse(
+    cls: OpenVPNConfig,
+    text: str,
+    path: str = '',
+  ) -> OpenVPNConfig:
+    directives = []
+    inline = {}
+    block = None
+    block_lines = []
+    for raw_line in text.splitlines():
+      line = raw_line.strip()
+      if block is not None:
+        if line == f'</{block}>':
+          inline[block] = '\n'.join(block_lines)
+          block = None
+        else:
+          block_lines.append(raw_line)
+        continue
+      if len(line) == 0 or line[0] in '#;':
+        continue
+      if line.startswith('<') and line.endswith('>'):
+        name = line[1:-1]
+        # <connection> only groups regular directives
+        if name not in ('connection', '/connection'):
+          block = name
+          block_lines = []
+        continue
+      try:
+        tokens = shlex.split(line, comments=True)
+      except ValueError:
+        tokens = line.split()
+      if len(tokens) > 0:
+        directives.append((tokens[0].lower(), tokens[1:]))
+    return cls(path, directives, inline)
+
+  def get(
+    self: OpenVPNConfig,
+    name: str,
+  ) -> Optional[list[str]]:
+    """Arguments of the last occurrence of directive `name`."""
+    for directive, args in reversed(self.directives):
+      if directive == name:
+        return args
+    return None
+
+  def proto(self: OpenVPNConfig) -> str:
+    args = self.get('proto')
+    return args[0].lower() if args else DEFAULT_PROTO
+
+  def port(self: OpenVPNConfig) -> int:
+    args = self.get('rport') or self.get('port')
+    return int(args[0]) if args else DEFAULT_PORT
+
+  def remotes(self: OpenVPNConfig) -> list[OpenVPNRemote]:
+    proto = self.proto()
+    port = self.port()
+    remotes = []
+    for directive, args in self.directives:
+      if directive != 'remote' or len(args) == 0:
+        continue
+      remotes.append(OpenVPNRemote(
+        args[0],
+        int(args[1]) if len(args) > 1 else port,
+        args[2].lower() if len(args) > 2 else proto,
+      ))
+    return remotes
@@ -1,24 +1,38 @@
 from __future__ import annotations
-from tempfile import TemporaryDirectory
+
+def quote(value: str) -> str:
+  """Quote `value` as an argument of a management interface command."""
+  escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+  return f'"{escaped}"'
+
 
 class OpenVPNCredentials:
+  """Username and password handed to openvpn on its management interface
+  when it asks for them (`--management-query-passwords`), so they are
+  never written to disk. One instance serves any number of connects.
+  Sample usage:
+    ovnc = OpenVPNCredentials('user', 'password')
+    ovs = OpenVPNService(config_to_country, 'openvpn', credentials=ovnc)
+  """
   def __init__(
     self: OpenVPNCredentials,
     user: str,
     password: str,
   ) -> None:
-    self.td = TemporaryDirectory()
-    self._file_path = f'{self.td.name}/openvpn_credentials'
-    with open(self._file_path, 'w') as f_ptr:
-      f_ptr.write(f'{user}\n')
-      f_ptr.write(f'{password}\n')
+    if '\n' in user or '\n' in password:
+      raise ValueError('Credentials must not contain line breaks')
+    self.user = user
+    self.password = password
 
-  def file_path(
-    self: OpenVPNCredentials,
-  ) -> str:
-    return self._file_path
+  def __repr__(self: OpenVPNCredentials) -> str:
+    return f'OpenVPNCredentials(user={self.user!r}, password=***)'
 
-  def __del__(
+  def commands(
     self: OpenVPNCredentials,
-  ) -> None:
-    self.td.cleanup()
+    kind: str = 'Auth',
+  ) -> list[str]:
+    """Management commands answering a `>PASSWORD:Need '<kind>'` request."""
+    return [
+      f'username {quote(kind)} {quote(self.user)}',
+      f'password {quote(kind)} {quote(self.password)}',
+    ]
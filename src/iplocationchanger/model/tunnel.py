@@ -0,0 +1,59 @@
+from __future__ import annotations
+from typing import Optional
+
+import getpass
+
+from iplocationchanger.utils.utils import Utils
+
+class Tunnel:
+  """An openvpn tunnel running inside its own network namespace.
+  Everything executed through `run` (or a command built with `netns_cmd`)
+  egresses through this tunnel's region.
+  """
+  def __init__(
+    self: Tunnel,
+    country: str,
+    index: int,
+    namespace: str,
+    config_path: str,
+    pid_path: str,
+  ) -> None:
+    self.country = country
+    self.index = index
+    self.namespace = namespace
+    self.config_path = config_path
+    self.pid_path = pid_path
+    self.pid: Optional[int] = None
+    # whether the namespace was added by us, a namespace of the same name
+    # owned by someone else is never torn down
+    self.namespace_created = False
+    # point to point veth link between the host and the namespace
+    self.host_veth = f'{namespace}-h'
+    self.ns_veth = f'{namespace}-n'
+    self.subnet = f'10.200.{index}.0/30'
+    self.host_ip = f'10.200.{index}.1'
+    self.ns_ip = f'10.200.{index}.2'
+
+  def __repr__(self: Tunnel) -> str:
+    return f'Tunnel({self.country}, {self.namespace}, pid={self.pid})'
+
+  def netns_cmd(
+    self: Tunnel,
+    cmd: list[str],
+    user: Optional[str] = None,
+  ) -> list[str]:
+    """Wrap `cmd` to run inside the tunnel's namespace as `user` (defaults to
+    the current user, pass 'root' to keep root privileges).
+    """
+    user = user or getpass.getuser()
+    netns_cmd = ['sudo', 'ip', 'netns', 'exec', self.namespace]
+    if user != 'root':
+      netns_cmd.extend(['sudo', '-u', user])
+    return netns_cmd + cmd
+
+  def run(
+    self: Tunnel,
+    cmd: list[str],
+    expect_error: bool = False,
+  ) -> tuple[bool, str, str]:
+    return Utils.run_proc(self.netns_cmd(cmd), expect_error=expect_error)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+from typing import Optional
+
+import logging
+import time
+
+from iplocationchanger.service.async_openvpn_service import AsyncOpenVPNService
+from iplocationchanger.service.async_whatismyip_service import AsyncWhatIsMyIPService
+from iplocationchanger.service.whatismyip_service import LocationBackend
+from iplocationchanger.service.whatismyip_service import LocationProvider
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.service.config_selector_service import ConfigSelectorService
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.service.latency_probe_service import LatencyProbeService
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+logger = logging.getLogger(__name__)
+
+class AsyncLocationChangerService:
+  def __init__(
+    self: AsyncLocationChangerService,
+    whatismyip_api_key: str,
+    openvpn_config_to_country_map: dict,
+    openvpn_executable_path: str,
+    openvpn_credentials_path: str = '',
+    openvpn_management_port: int = 7505,
+    location_cache: Optional[TTLCache] = None,
+    location_backend: Optional[LocationBackend] = None,
+    config_strategy: str = 'round-robin',
+    max_config_attempts: int = 3,
+    metrics: Optional[Metrics] = None,
+    validation: str = 'single',
+    location_providers: Optional[list[LocationProvider]] = None,
+    location_registry: Optional[LocationProviderRegistry] = None,
+    openvpn_credentials: Optional[OpenVPNCredentials] = None,
+  ) -> None:
+    """Initialize AsyncLocationChangerService, the asyncio counterpart of
+    LocationChangerService. It raises the same exceptions.
+    `openvpn_credentials` are answered on the management interface
+    instead of reading the auth file at `openvpn_credentials_path`.
+    Sample usage:
+    async with AsyncLocationChangerService(
+      'whatismyip_api_key',
+      'openvpn_config_to_country_map',
+      'openvpn_executable_path',
+      'openvpn_credentials_path',
+    ) as lcs:
+      await lcs.connect_region('TR')
+    """
+    self.metrics = metrics if metrics is not None else Metrics()
+    self.wms = AsyncWhatIsMyIPService(
+      whatismyip_api_key,
+      location_cache=location_cache,
+      location_backend=location_backend,
+      metrics=self.metrics,
+      validation=validation,
+      providers=location_providers,
+      registry=location_registry,
+    )
+    self.prober = None
+    if config_strategy == 'probe':
+      self.prober = LatencyProbeService(openvpn_config_to_country_map)
+    self.selector = ConfigSelectorService(
+      openvpn_config_to_country_map,
+      config_strategy,
+      ranker=self.prober,
+    )
+    self.max_config_attempts = max_config_attempts
+    self.ovs = AsyncOpenVPNService(
+      openvpn_config_to_country_map,
+      openvpn_executable_path,
+      credentials_path=openvpn_credentials_path,
+      credentials=openvpn_credentials,
+      management_port=openvpn_management_port,
+      metrics=self.metrics,
+    )
+
+  async def __aenter__(self: AsyncLocationChangerService) -> AsyncLocationChangerService:
+    return self
+
+  async def __aexit__(self: AsyncLocationChangerService, *_) -> None:
+    """Disconnect VPN connection and release pooled HTTP connections."""
+    try:
+      await self.disconnect_region()
+    finally:
+      await self.wms.close()
+
+  async def disconnect_region(
+    self: AsyncLocationChangerService,
+  ) -> float:
+    """Disconnect and return the tunnel teardown time in seconds."""
+    logger.debug('disconnecting...')
+    elapsed = await self.ovs.disconnect()
+    await self.wms.reset_session()
+    return elapsed
+
+  async def connect_region(
+    self: AsyncLocationChangerService,
+    country: str,
+    OPENVPN_TIMEOUT: float = 30,
+  ) -> None:
+    """Connect to `country`, failing over across its configs. The time
+    spent in each phase of the switch is left in `self.metrics.timings`.
+    """
+    self.metrics.start_switch()
+    self.metrics.switches.inc(country=country)
+    start = time.monotonic()
+    try:
+      await self.try_configs(country, OPENVPN_TIMEOUT)
+    except LocationChangerServiceException as e:
+      self.metrics.switch_failures.inc(exception=type(e.__cause__ or e).__name__)
+      raise
+    finally:
+      self.metrics.switch_seconds.observe(time.monotonic() - start)
+      logger.debug('switch timings: ' + ', '.join(
+        f'{phase}={elapsed:.3f}s' for phase, elapsed in self.metrics.timings.items()
+      ))
+
+  async def try_configs(
+    self: AsyncLocationChangerService,
+    country: str,
+    OPENVPN_TIMEOUT: float = 30,
+  ) -> None:
+    with self.metrics.phase('config_lookup'):
+      if self.prober is not None and len(config_paths(self.selector.config_to_country, country)) > 1:
+        await self.prober.probe_all([country])
+      candidates = self.selector.candidates(country)[:self.max_config_attempts]
+    if len(candidates) == 0:
+      raise LocationChangerServiceException(f'Could not find config for {country}')
+
+    for config_path in candidates:
+      try:
+        await self.connect_config(country, config_path, OPENVPN_TIMEOUT)
+        return
+      except LocationChangerServiceException as e:
+        logger.warning(f'{config_path} failed: {e.__cause__}')
+        error = e
+    raise error
+
+  async def connect_config(
+    self: AsyncLocationChangerService,
+    country: str,
+    config_path: str,
+    OPENVPN_TIMEOUT: float = 30,
+  ) -> None:
+    logger.debug(f'connecting to {country} using {config_path}...')
+    if self.ovs.pid is not None:
+      await self.ovs.disconnect()
+    start = time.monotonic()
+    try:
+      await self.ovs.connect(country, config_path)
+      await self.ovs.wait_until_connected(OPENVPN_TIMEOUT)
+    except OpenVPNServiceException as e:
+      self.selector.record(config_path, None)
+      await self.ovs.disconnect()
+      raise LocationChangerServiceException(f'Could not connect to {country}') from e
+    self.selector.record(config_path, time.monotonic() - start)
+
+    # pooled connections were opened over the previous route
+    await self.wms.reset_session()
+    try:
+      await self.wms.validate_connection(country)
+    except WhatIsMyIPServiceException as e:
+      await self.ovs.disconnect()
+      raise LocationChangerServiceException(f'Could not connect to {country}') from e
+    logger.debug(f'connected to {country}')
@@ -0,0 +1,166 @@
+from __future__ import annotations
+from collections import deque
+from typing import Optional
+
+import asyncio
+import logging
+
+from iplocationchanger.service.openvpn_management_client import check_state
+from iplocationchanger.service.openvpn_management_client import check_notification
+from iplocationchanger.service.openvpn_management_client import note_state
+from iplocationchanger.service.openvpn_management_client import state_fields
+from iplocationchanger.service.openvpn_management_client import password_request
+from iplocationchanger.service.openvpn_management_client import password_commands
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+logger = logging.getLogger(__name__)
+
+class AsyncOpenVPNManagementClient:
+  """asyncio counterpart of OpenVPNManagementClient.
+  Sample usage:
+    async with AsyncOpenVPNManagementClient('127.0.0.1', 7505) as omc:
+      await omc.wait_for_state('CONNECTED', timeout=30)
+  """
+  POLL_INTERVAL = 0.1
+
+  def __init__(
+    self: AsyncOpenVPNManagementClient,
+    host: str,
+    port: int,
+    credentials: Optional[OpenVPNCredentials] = None,
+  ) -> None:
+    self.host = host
+    self.port = port
+    self.credentials = credentials
+    self.reader = None
+    self.writer = None
+    self.notifications = deque()
+    self.state_times: dict[str, float] = {}
+
+  async def __aenter__(self: AsyncOpenVPNManagementClient) -> AsyncOpenVPNManagementClient:
+    return self
+
+  async def __aexit__(self: AsyncOpenVPNManagementClient, *_) -> None:
+    await self.close()
+
+  async def open(
+    self: AsyncOpenVPNManagementClient,
+    timeout: float,
+  ) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+      remaining = deadline - loop.time()
+      try:
+        self.reader, self.writer = await asyncio.wait_for(
+          asyncio.open_connection(self.host, self.port),
+          max(remaining, self.POLL_INTERVAL),
+        )
+        logger.debug(f'connected to management interface {self.host}:{self.port}')
+        return
+      except (OSError, asyncio.TimeoutError) as e:
+        if remaining <= 0:
+          raise OpenVPNServiceException(
+            f'Could not reach management interface {self.host}:{self.port}'
+          ) from e
+        await asyncio.sleep(min(self.POLL_INTERVAL, remaining))
+
+  async def close(self: AsyncOpenVPNManagementClient) -> None:
+    if self.writer is not None:
+      self.writer.close()
+      try:
+        await self.writer.wait_closed()
+      except OSError:
+        pass
+      self.reader = None
+      self.writer = None
+
+  async def read_line(self: AsyncOpenVPNManagementClient) -> str:
+    raw = await self.reader.readline()
+    if not raw:
+      raise OpenVPNServiceException('Management interface closed the connection')
+    line = raw.decode('utf-8').rstrip('\r\n')
+    logger.debug(f'MGMT: {line}')
+    return line
+
+  async def send_command(
+    self: AsyncOpenVPNManagementClient,
+    command: str,
+    multiline: bool = False,
+  ) -> list[str]:
+    if self.writer is None:
+      raise OpenVPNServiceException('Management interface is not connected')
+    self.writer.write(f'{command}\n'.encode('utf-8'))
+    await self.writer.drain()
+
+    lines = []
+    while True:
+      line = await self.read_line()
+      if line.startswith('>'):
+        self.notifications.append(line)
+        continue
+      if line.startswith('ERROR:'):
+        raise OpenVPNServiceException(f'Management command "{command}" failed: {line}')
+      if not multiline:
+        return [line]
+      if line == 'END':
+        return lines
+      lines.append(line)
+
+  async def answer_password(
+    self: AsyncOpenVPNManagementClient,
+    notification: str,
+  ) -> bool:
+    kind = password_request(notification)
+    if kind is None:
+      return False
+    for command in password_commands(kind, self.credentials):
+      try:
+        await self.send_command(command)
+      except OpenVPNServiceException:
+        # the command holds the password, keep it out of the message
+        raise OpenVPNServiceException(f"openvpn did not take the '{kind}' credentials") from None
+    logger.debug(f"answered the '{kind}' password request")
+    return True
+
+  async def next_notification(self: AsyncOpenVPNManagementClient) -> str:
+    if len(self.notifications) > 0:
+      return self.notifications.popleft()
+    while True:
+      line = await self.read_line()
+      if line.startswith('>'):
+        return line
+
+  async def wait_for_state(
+    self: AsyncOpenVPNManagementClient,
+    state: str = 'CONNECTED',
+    timeout: float = 30,
+  ) -> list[str]:
+    try:
+      return await asyncio.wait_for(self._wait_for_state(state, timeout), timeout)
+    except asyncio.TimeoutError as e:
+      raise OpenVPNServiceException('Timed out waiting for management interface') from e
+
+  async def _wait_for_state(
+    self: AsyncOpenVPNManagementClient,
+    state: str,
+    timeout: float,
+  ) -> list[str]:
+    if self.writer is None:
+      await self.open(timeout)
+    await self.send_command('state on')
+    for line in await self.send_command('state', multiline=True):
+      fields = line.split(',')
+      note_state(self.state_times, fields)
+      if check_state(fields, state):
+        return fields
+
+    while True:
+      notification = await self.next_notification()
+      if await self.answer_password(notification):
+        continue
+      note_state(self.state_times, state_fields(notification) or [])
+      fields = check_notification(notification, state)
+      if fields is not None:
+        return fields
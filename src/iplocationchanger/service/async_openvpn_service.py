@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import subprocess
+import time
+
+from iplocationchanger.utils.utils import Utils
+from iplocationchanger.service.openvpn_service import OpenVPNService
+from iplocationchanger.service.async_openvpn_management_client import AsyncOpenVPNManagementClient
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+logger = logging.getLogger(__name__)
+
+class AsyncOpenVPNService(OpenVPNService):
+  """asyncio counterpart of OpenVPNService: openvpn and kill are run with
+  `asyncio.create_subprocess_exec` and readiness is awaited on the management
+  interface, so the event loop is never blocked.
+  """
+  async def disconnect(
+    self: AsyncOpenVPNService,
+    timeout: float = 5,
+  ) -> float:
+    if self.pid is None:
+      logger.debug('no openvpn daemon to disconnect')
+      return 0.0
+    pid, self.pid = self.pid, None
+    self.remote_ip = ''
+    elapsed = await Utils.terminate_pid_async(pid, timeout)
+    self.metrics.observe_phase('disconnect', elapsed)
+    logger.debug(f'openvpn {pid} exited after {elapsed:.3f}s')
+    return elapsed
+
+  async def connect(
+    self: AsyncOpenVPNService,
+    country: str,
+    config_path: str = '',
+  ) -> None:
+    cmd = self.connect_cmd(country, config_path)
+    logger.debug(f'CMD: {" ".join(cmd)}')
+    self.clear_pid_file()
+    with self.metrics.phase('spawn'):
+      try:
+        success, stdout, stderr = await Utils.run_proc_async(cmd)
+      except (OSError, subprocess.CalledProcessError) as e:
+        raise OpenVPNServiceException(f'Could not connect to {country}') from e
+
+      logger.debug(f'STDOUT: {stdout}')
+      if not success:
+        logger.error(f'STDERR: {stderr}')
+        raise OpenVPNServiceException(f'Could not connect to {country}')
+      await self.read_pid_async(country)
+
+  async def read_pid_async(
+    self: AsyncOpenVPNService,
+    country: str,
+    timeout: float = 5,
+  ) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+      try:
+        self.pid = Utils.read_pid(self.pid_path)
+        logger.debug(f'openvpn pid: {self.pid}')
+        return
+      except (OSError, ValueError) as e:
+        if loop.time() > deadline:
+          raise OpenVPNServiceException(f'Could not connect to {country}: openvpn wrote no pid') from e
+        await asyncio.sleep(0.05)
+
+  async def wait_until_connected(
+    self: AsyncOpenVPNService,
+    timeout: float,
+  ) -> list[str]:
+    start = time.monotonic()
+    async with AsyncOpenVPNManagementClient(
+      self.management_host,
+      self.management_port,
+      credentials=self.credentials,
+    ) as omc:
+      try:
+        fields = await omc.wait_for_state('CONNECTED', timeout)
+      finally:
+        self.state_times = omc.state_times
+        self.observe_tunnel_phases(start)
+    logger.debug(f'openvpn state: {",".join(fields)}')
+    if len(fields) > 4:
+      self.remote_ip = fields[4]
+    return fields
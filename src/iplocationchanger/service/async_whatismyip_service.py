@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+from iplocationchanger.service.whatismyip_service import WhatIsMyIPService
+from iplocationchanger.service.whatismyip_service import UNSUPPORTED_LOOKUP_ERRORS
+from iplocationchanger.exception.iplocationchanger_exception import IPLocationChangerException
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+class AsyncWhatIsMyIPService(WhatIsMyIPService):
+  """asyncio counterpart of WhatIsMyIPService backed by a pooled aiohttp session.
+  Requires the `async` extra: pip install iplocationchanger[async]
+  """
+  def __init__(
+    self: AsyncWhatIsMyIPService,
+    *args,
+    **kwargs,
+  ) -> None:
+    if aiohttp is None:
+      raise WhatIsMyIPServiceException(
+        'aiohttp is required for AsyncWhatIsMyIPService, install iplocationchanger[async]'
+      )
+    super().__init__(*args, **kwargs)
+
+  def get_session(self: AsyncWhatIsMyIPService) -> aiohttp.ClientSession:
+    # aiohttp sessions must be created inside a running event loop
+    if self.session is None:
+      self.session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=self.pool_size),
+        timeout=aiohttp.ClientTimeout(total=self.timeout),
+      )
+    return self.session
+
+  async def reset_session(self: AsyncWhatIsMyIPService) -> None:
+    logger.debug('resetting HTTP session')
+    await self.close()
+    for provider in self.registry.providers.values():
+      if provider is not self and hasattr(provider, 'reset_session'):
+        provider.reset_session()
+
+  async def close(self: AsyncWhatIsMyIPService) -> None:
+    if self.session is not None:
+      await self.session.close()
+      self.session = None
+
+  async def get_ip(self: AsyncWhatIsMyIPService) -> str:
+    res_body = await self.request('ip')
+    return self.parse_ip(res_body)
+
+  async def get_location_from_ip(
+    self: AsyncWhatIsMyIPService,
+    ip: str,
+  ) -> str:
+    location = self.known_location(ip)
+    if location is not None:
+      return location
+
+    res_body = await self.request('ip-address-lookup', {'input': ip})
+    return self.parse_location(ip, res_body)
+
+  async def locate(self: AsyncWhatIsMyIPService) -> tuple[str, str]:
+    if self.use_single_lookup():
+      try:
+        return self.parse_lookup(await self.request('ip-address-lookup'))
+      except WhatIsMyIPServiceException as e:
+        if str(e) not in UNSUPPORTED_LOOKUP_ERRORS and not isinstance(e.__cause__, (LookupError, TypeError)):
+          raise
+        logger.info(f'Lookup without input not supported ({e}), using two requests')
+        self.single_lookup = False
+    ip = await self.get_ip()
+    return ip, await self.get_location_from_ip(ip)
+
+  async def call(
+    self: AsyncWhatIsMyIPService,
+    provider,
+  ) -> tuple[str, str]:
+    """LocationProviderRegistry.call for this service and blocking providers,
+    which run in the default executor.
+    """
+    start = self.registry.clock()
+    try:
+      if provider is self:
+        ip, country = await self.locate()
+      else:
+        ip, country = await asyncio.to_thread(provider.locate)
+    except IPLocationChangerException as e:
+      self.registry.fail(provider.name, e)
+      raise
+    self.registry.observe(provider.name, self.registry.clock() - start)
+    return ip, country
+
+  async def race(self: AsyncWhatIsMyIPService) -> tuple[str, str]:
+    providers = [p for p in self.registry.schedule() if self.registry.acquire(p.name)]
+    tasks = {asyncio.ensure_future(self.call(provider)): provider for provider in providers}
+    pending = set(tasks)
+    last_error = None
+    try:
+      while len(pending) > 0:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          try:
+            ip, location = task.result()
+          except IPLocationChangerException as e:
+            last_error = e
+            continue
+          logger.debug(f'{tasks[task].name} answered first')
+          return ip, location
+    finally:
+      for task in pending:
+        task.cancel()
+    raise self.registry.no_answer([]) from last_error
+
+  async def scheduled(self: AsyncWhatIsMyIPService) -> tuple[str, str]:
+    queue = self.registry.schedule()
+    answers = []
+    running = set()
+    last_error = None
+    try:
+      while True:
+        agreed = self.registry.agreed(answers)
+        if agreed is not None:
+          return agreed
+        while len(running) < self.registry.missing(answers) and len(queue) > 0:
+          provider = queue.pop(0)
+          if self.registry.acquire(provider.name):
+            running.add(asyncio.ensure_future(self.call(provider)))
+        if len(running) == 0:
+          raise self.registry.no_answer(answers) from last_error
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          try:
+            answers.append(task.result())
+          except IPLocationChangerException as e:
+            last_error = e
+    finally:
+      for task in running:
+        task.cancel()
+
+  async def current_location(self: AsyncWhatIsMyIPService) -> tuple[str, str]:
+    if self.validation == 'two-step':
+      with self.metrics.phase('get_ip'):
+        ip = await self.get_ip()
+      with self.metrics.phase('get_location_from_ip'):
+        return ip, await self.get_location_from_ip(ip)
+    with self.metrics.phase('locate'):
+      if self.validation == 'single':
+        return await self.locate()
+      try:
+        if self.validation == 'race':
+          return await self.race()
+        return await self.scheduled()
+      except LocationProviderException as e:
+        raise WhatIsMyIPServiceException(str(e)) from e
+
+  async def validate_connection(
+    self: AsyncWhatIsMyIPService,
+    country_code: str,
+  ) -> str:
+    ip, location = await self.current_location()
+    if (location.lower().strip() == country_code.lower().strip()):
+      return ip
+    raise WhatIsMyIPServiceException(f'{country_code} not {location}')
+
+  async def request(
+    self: AsyncWhatIsMyIPService,
+    path: str,
+    other_params: dict[str, str] = {},
+  ) -> dict:
+    url, params = self.request_args(path, other_params)
+
+    for attempt in range(self.max_retries + 1):
+      try:
+        async with self.get_session().get(url, params=params) as res:
+          status = res.status
+          res_body = (await res.read()).decode('utf-8')
+      except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        self.metrics.api_calls.inc(endpoint=path, outcome='connection_error')
+        raise WhatIsMyIPServiceException(f'Could not complete request "{path}".') from e
+
+      if status < 200 or status > 299:
+        self.metrics.api_calls.inc(endpoint=path, outcome='http_error')
+      if status in RETRY_STATUSES and attempt < self.max_retries:
+        await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+        continue
+      if status < 200 or status > 299:
+        logger.debug(f'Status code: {status}')
+        logger.debug(f'Response: {res_body}')
+        raise WhatIsMyIPServiceException(f'Could not complete request "{path}".')
+
+      logger.debug(f'Response raw: {res_body}')
+      self.count_api_call(path, res_body)
+      delay = self.rate_limit_delay(res_body, attempt)
+      if delay is None:
+        break
+      await asyncio.sleep(delay)
+    return self.parse_response(res_body)
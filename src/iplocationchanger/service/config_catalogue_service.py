@@ -0,0 +1,263 @@
+from __future__ import annotations
+from collections.abc import Mapping
+from typing import Iterator, NamedTuple, Optional
+
+import json
+import logging
+import os
+import threading
+
+from iplocationchanger.model.openvpn_config import OpenVPNConfig
+from iplocationchanger.utils.file_watcher import FileWatcher
+from iplocationchanger.exception.config_catalogue_service_exception import ConfigCatalogueServiceException
+
+logger = logging.getLogger(__name__)
+
+class CatalogueEntry(NamedTuple):
+  config: OpenVPNConfig
+  # os.stat() st_mtime_ns and st_size the config was parsed at
+  mtime_ns: int
+  size: int
+
+
+class CatalogueIndex(NamedTuple):
+  # country -> usable config paths, in map order
+  by_country: dict[str, tuple[str, ...]]
+  # 'tcp' or 'udp' -> config paths with a remote of that transport
+  by_proto: dict[str, frozenset[str]]
+  # remote host -> config paths
+  by_server: dict[str, frozenset[str]]
+  country_of: dict[str, str]
+
+
+def normalize_map(raw) -> dict[str, list[str]]:
+  """Check a country -> config path(s) mapping, lists of paths throughout."""
+  if not isinstance(raw, dict):
+    raise ConfigCatalogueServiceException('Invalid config map: expected a JSON object')
+  country_map = {}
+  for country, value in raw.items():
+    paths = [value] if isinstance(value, str) else value
+    if not isinstance(paths, (list, tuple)) or not all(isinstance(p, str) for p in paths):
+      raise ConfigCatalogueServiceException(f'Invalid config map entry for {country}')
+    country_map[country] = list(paths)
+  return country_map
+
+def parse_map(text: str) -> dict[str, list[str]]:
+  try:
+    raw = json.loads(text)
+  except ValueError as e:
+    raise ConfigCatalogueServiceException(f'Invalid config map: {e}') from e
+  return normalize_map(raw)
+
+
+def read_map(map_path: str) -> dict[str, list[str]]:
+  try:
+    with open(map_path) as f_ptr:
+      return parse_map(f_ptr.read())
+  except OSError as e:
+    raise ConfigCatalogueServiceException(f'Could not read {map_path}') from e
+
+
+class ConfigCatalogueService(Mapping):
+  """The country -> configs map with every config parsed and checked once.
+  It is a read-only mapping of country to config paths, so it can stand in
+  for the plain dict wherever one is taken. Configs which cannot be read or
+  have no `remote` are reported in `errors` and left out of the map.
+  Parsed configs are kept in memory and re-parsed when their mtime or size
+  changes. `watch` reloads the map file and the configs as they change on
+  disk, swapping the new map in at once; a tunnel already up is left alone.
+  Sample usage:
+    catalogue = ConfigCatalogueService.from_file('/assets/configmap.json')
+    catalogue['TR']                       # ('/assets/tr1.ovpn', '/assets/tr2.ovpn')
+    catalogue.config('/assets/tr1.ovpn').remotes()
+    catalogue.by_server('tr1.example.com') # frozenset({'/assets/tr1.ovpn'})
+    catalogue.watch()
+  """
+  def __init__(
+    self: ConfigCatalogueService,
+    config_to_country: dict,
+    map_path: str = '',
+  ) -> None:
+    self.map_path = map_path
+    self.lock = threading.RLock()
+    self.entries: dict[str, CatalogueEntry] = {}
+    self.errors: dict[str, str] = {}
+    self.country_map = normalize_map(config_to_country)
+    self.index = CatalogueIndex({}, {}, {}, {})
+    self.watcher: Optional[FileWatcher] = None
+    self.load()
+
+  @classmethod
+  def from_file(
+    cls: ConfigCatalogueService,
+    map_path: str,
+  ) -> ConfigCatalogueService:
+    return cls(read_map(map_path), map_path)
+
+  def __getitem__(self: ConfigCatalogueService, country: str) -> tuple[str, ...]:
+    return self.index.by_country[country]
+
+  def __iter__(self: ConfigCatalogueService) -> Iterator[str]:
+    return iter(self.index.by_country)
+
+  def __len__(self: ConfigCatalogueService) -> int:
+    return len(self.index.by_country)
+
+  def load(self: ConfigCatalogueService) -> list[str]:
+    """Parse the configs which are new or changed on disk and rebuild the
+    indexes. Returns the paths which were (re)parsed.
+    """
+    with self.lock:
+      paths = {path for paths in self.country_map.values() for path in paths}
+      parsed = [path for path in sorted(paths) if self.refresh(path)]
+      for path in set(self.entries) - paths:
+        del self.entries[path]
+      for path in set(self.errors) - paths:
+        del self.errors[path]
+      self.reindex()
+    return parsed
+
+  def refresh(
+    self: ConfigCatalogueService,
+    path: str,
+  ) -> bool:
+    """Re-parse `path` if it changed since it was parsed, True if it did."""
+    try:
+      st = os.stat(path)
+    except OSError as e:
+      self.fail(path, f'Could not read {path}: {e.strerror}')
+      return True
+    entry = self.entries.get(path)
+    if entry is not None and (entry.mtime_ns, entry.size) == (st.st_mtime_ns, st.st_size):
+      return False
+
+    try:
+      config = OpenVPNConfig.from_file(path)
+      if len(config.remotes()) == 0:
+        raise ValueError('no remote')
+    except (OSError, ValueError) as e:
+      self.fail(path, f'Invalid config {path}: {e}')
+      return True
+    self.entries[path] = CatalogueEntry(config, st.st_mtime_ns, st.st_size)
+    self.errors.pop(path, None)
+    return True
+
+  def fail(
+    self: ConfigCatalogueService,
+    path: str,
+    error: str,
+  ) -> None:
+    if self.errors.get(path) != error:
+      logger.error(error)
+    self.errors[path] = error
+    self.entries.pop(path, None)
+
+  def reindex(self: ConfigCatalogueService) -> None:
+    by_country = {}
+    by_proto: dict[str, set[str]] = {}
+    by_server: dict[str, set[str]] = {}
+    country_of = {}
+    for country, paths in self.country_map.items():
+      usable = tuple(path for path in paths if path in self.entries)
+      if len(usable) == 0:
+        logger.error(f'No usable config for {country}')
+        continue
+      by_country[country] = usable
+      for path in usable:
+        country_of.setdefault(path, country)
+        for remote in self.entries[path].config.remotes():
+          by_proto.setdefault(remote.transport, set()).add(path)
+          by_server.setdefault(remote.host, set()).add(path)
+    # swapped in one assignment, readers never see a half built index
+    self.index = CatalogueIndex(
+      by_country,
+      {k: frozenset(v) for k, v in by_proto.items()},
+      {k: frozenset(v) for k, v in by_server.items()},
+      country_of,
+    )
+
+  def config(
+    self: ConfigCatalogueService,
+    path: str,
+  ) -> OpenVPNConfig:
+    """Parsed config at `path`, re-parsed first if it changed on disk."""
+    with self.lock:
+      if self.refresh(path):
+        self.reindex()
+      entry = self.entries.get(path)
+    if entry is None:
+      raise ConfigCatalogueServiceException(self.errors.get(path, f'Unknown config {path}'))
+    return entry.config
+
+  def by_proto(
+    self: ConfigCatalogueService,
+    transport: str,
+  ) -> frozenset[str]:
+    return self.index.by_proto.get(transport, frozenset())
+
+  def by_server(
+    self: ConfigCatalogueService,
+    host: str,
+  ) -> frozenset[str]:
+    return self.index.by_server.get(host, frozenset())
+
+  def country_of(
+    self: ConfigCatalogueService,
+    path: str,
+  ) -> Optional[str]:
+    return self.index.country_of.get(path)
+
+  def reload(self: ConfigCatalogueService) -> list[str]:
+    """Re-read the map file and re-parse the configs which changed. An
+    invalid map file is logged and the current map kept.
+    Returns the paths which were (re)parsed.
+    """
+    with self.lock:
+      if len(self.map_path) > 0:
+        try:
+          self.country_map = read_map(self.map_path)
+        except ConfigCatalogueServiceException as e:
+          logger.error(f'Keeping the current config map: {e}')
+          return []
+      parsed = self.load()
+    logger.info(f'config map reloaded, {len(self)} countries, {len(parsed)} configs parsed')
+    return parsed
+
+  def watched_paths(self: ConfigCatalogueService) -> list[str]:
+    paths = {path for paths in self.country_map.values() for path in paths}
+    if len(self.map_path) > 0:
+      paths.add(self.map_path)
+    return sorted(paths)
+
+  def watch(
+    self: ConfigCatalogueService,
+    interval: float = 2,
+    use_inotify: bool = True,
+  ) -> FileWatcher:
+    """Reload whenever the map file or a config changes, from a background
+    thread; inotify on Linux, polling every `interval` seconds elsewhere.
+    """
+    if self.watcher is None:
+      self.watcher = FileWatcher(
+        self.watched_paths(),
+        self.on_change,
+        interval=interval,
+        use_inotify=use_inotify,
+      )
+      self.watcher.start()
+      logger.debug(f'watching {len(self.watched_paths())} files ({self.watcher.mode})')
+    return self.watcher
+
+  def stop_watching(self: ConfigCatalogueService) -> None:
+    if self.watcher is not None:
+      self.watcher.stop()
+      self.watcher = None
+
+  def on_change(
+    self: ConfigCatalogueService,
+    changed: set[str],
+  ) -> None:
+    self.reload()
+    if self.watcher is not None:
+      # configs may have been added to or dropped from the map
+      self.watcher.set_paths(self.watched_paths())
@@ -0,0 +1,115 @@
+from __future__ import annotations
+from typing import Optional, Protocol
+
+import logging
+import random
+import threading
+
+from iplocationchanger.utils.exit_history import ExitHistory
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('round-robin', 'latency', 'random', 'probe', 'history')
+
+class ConfigRanker(Protocol):
+  def rank(self, configs: list[str]) -> list[str]: ...
+
+def config_paths(
+  config_to_country: dict,
+  country: str,
+) -> list[str]:
+  """Configs for `country`; a country maps to a single path or a list of paths."""
+  value = config_to_country.get(country, [])
+  if isinstance(value, str):
+    return [value]
+  return list(value)
+
+class ConfigSelectorService:
+  """Order the configs of a country for connection attempts.
+  Strategies:
+    round-robin: rotate the starting config on every selection
+    latency:     lowest exponentially weighted connect latency first,
+                 configs without measurements are tried first
+    random:      random order
+    probe:       order given by `ranker`, e.g. a LatencyProbeService
+    history:     highest validation success rate in `history` first
+  With a `history` (an ExitHistory), configs flagged for exit IPs located
+  in the wrong country are tried last whatever the strategy.
+  Sample usage:
+    css = ConfigSelectorService({'TR': ['/assets/tr1.ovpn', '/assets/tr2.ovpn']}, 'latency')
+    for config_path in css.candidates('TR'):
+      ...
+      css.record(config_path, 1.2)
+  """
+  # latency charged to a config which failed to connect
+  FAILURE_PENALTY = 60.0
+
+  def __init__(
+    self: ConfigSelectorService,
+    config_to_country: dict,
+    strategy: str = 'round-robin',
+    alpha: float = 0.3,
+    ranker: Optional[ConfigRanker] = None,
+    history: Optional[ExitHistory] = None,
+  ) -> None:
+    if strategy not in STRATEGIES:
+      raise ValueError(f'Unknown strategy {strategy}, expected one of {", ".join(STRATEGIES)}')
+    if strategy == 'probe' and ranker is None:
+      raise ValueError('The probe strategy requires a ranker')
+    if strategy == 'history' and history is None:
+      raise ValueError('The history strategy requires a history')
+    self.config_to_country = config_to_country
+    self.strategy = strategy
+    self.alpha = alpha
+    self.ranker = ranker
+    self.history = history
+    self.lock = threading.Lock()
+    self.offsets: dict[str, int] = {}
+    self.latencies: dict[str, float] = {}
+
+  def candidates(
+    self: ConfigSelectorService,
+    country: str,
+  ) -> list[str]:
+    configs = config_paths(self.config_to_country, country)
+    if len(configs) <= 1:
+      return configs
+    if self.strategy == 'history':
+      return self.history.rank(configs)
+    ordered = self.order(country, configs)
+    if self.history is not None:
+      flagged = set(self.history.flagged(configs))
+      ordered.sort(key=lambda c: c in flagged)
+    return ordered
+
+  def order(
+    self: ConfigSelectorService,
+    country: str,
+    configs: list[str],
+  ) -> list[str]:
+    if self.strategy == 'probe':
+      return self.ranker.rank(configs)
+    with self.lock:
+      if self.strategy == 'round-robin':
+        offset = self.offsets.get(country, 0) % len(configs)
+        self.offsets[country] = offset + 1
+        return configs[offset:] + configs[:offset]
+      if self.strategy == 'latency':
+        return sorted(configs, key=lambda c: self.latencies.get(c, 0.0))
+    random.shuffle(configs)
+    return configs
+
+  def record(
+    self: ConfigSelectorService,
+    config_path: str,
+    latency: Optional[float],
+  ) -> None:
+    """Record a connect attempt taking `latency` seconds, None if it failed."""
+    sample = self.FAILURE_PENALTY if latency is None else latency
+    with self.lock:
+      previous = self.latencies.get(config_path)
+      if previous is None:
+        self.latencies[config_path] = sample
+      else:
+        self.latencies[config_path] = self.alpha * sample + (1 - self.alpha) * previous
+    logger.debug(f'{config_path}: {self.latencies[config_path]:.3f}s')
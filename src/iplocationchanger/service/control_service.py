@@ -0,0 +1,226 @@
+from __future__ import annotations
+from typing import Optional
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+from iplocationchanger.exception.control_service_exception import ControlServiceException
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ('connect', 'disconnect', 'status')
+
+class ControlServer:
+  """Keep a LocationChangerService resident and drive it over a Unix socket.
+  Requests and responses are JSON objects, one per line:
+    {"command": "connect", "country": "TR"}  -> {"ok": true, "country": "TR", "timings": {...}}
+    {"command": "disconnect"}                -> {"ok": true, "elapsed": 0.12}
+    {"command": "status"}                    -> {"ok": true, "connected": true, "country": "TR", ...}
+  Failures answer {"ok": false, "error": "..."}. Region switches are
+  serialized; status is answered while a switch is in progress.
+  Sample usage:
+    server = ControlServer(lcs, '/run/user/1000/iplocationchanger.sock')
+    server.serve_forever()
+  """
+  def __init__(
+    self: ControlServer,
+    lcs,
+    socket_path: str,
+    connect_timeout: float = 30,
+  ) -> None:
+    self.lcs = lcs
+    self.socket_path = socket_path
+    self.connect_timeout = connect_timeout
+    self.lock = threading.Lock()
+    self.server: Optional[socketserver.ThreadingUnixStreamServer] = None
+    self.thread: Optional[threading.Thread] = None
+
+  def bind(self: ControlServer) -> None:
+    control = self
+
+    class Handler(socketserver.StreamRequestHandler):
+      def handle(self) -> None:
+        for line in self.rfile:
+          if len(line.strip()) == 0:
+            continue
+          response = control.handle_line(line)
+          try:
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+          except OSError:
+            return
+
+    if os.path.exists(self.socket_path):
+      # a socket left behind by a daemon which did not shut down cleanly
+      with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+          sock.connect(self.socket_path)
+        except OSError:
+          os.remove(self.socket_path)
+        else:
+          raise ControlServiceException(f'{self.socket_path} is in use by another daemon')
+
+    previous_umask = os.umask(0o177)
+    try:
+      self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+    except OSError as e:
+      raise ControlServiceException(f'Could not bind {self.socket_path}') from e
+    finally:
+      os.umask(previous_umask)
+    self.server.daemon_threads = True
+    logger.info(f'listening on {self.socket_path}')
+
+  def serve_forever(self: ControlServer) -> None:
+    if self.server is None:
+      self.bind()
+    try:
+      self.server.serve_forever()
+    finally:
+      self.close()
+
+  def start(self: ControlServer) -> None:
+    """Serve from a daemon thread."""
+    self.bind()
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def close(self: ControlServer) -> None:
+    if self.server is None:
+      return
+    if self.thread is not None:
+      self.server.shutdown()
+      self.thread = None
+    self.server.server_close()
+    self.server = None
+    try:
+      os.remove(self.socket_path)
+    except FileNotFoundError:
+      pass
+
+  def handle_line(
+    self: ControlServer,
+    line: bytes,
+  ) -> dict:
+    try:
+      request = json.loads(line)
+      if not isinstance(request, dict):
+        raise ValueError('expected a JSON object')
+    except ValueError as e:
+      return {'ok': False, 'error': f'Invalid request: {e}'}
+    try:
+      return self.handle(request)
+    except (TypeError, ValueError) as e:
+      return {'ok': False, 'error': f'Invalid request: {e}'}
+    except (LocationChangerServiceException, ControlServiceException) as e:
+      logger.error(e)
+      return {'ok': False, 'error': str(e)}
+    except Exception as e:
+      # the client is owed an answer, and the daemon keeps serving
+      logger.exception(f'{request.get("command")} failed')
+      return {'ok': False, 'error': f'{request.get("command")} failed: {e!r}'}
+
+  def handle(
+    self: ControlServer,
+    request: dict,
+  ) -> dict:
+    command = request.get('command')
+    if command == 'connect':
+      country = request.get('country')
+      if not isinstance(country, str) or len(country) == 0:
+        raise ControlServiceException('connect requires a country')
+      timeout = float(request.get('timeout', self.connect_timeout))
+      with self.lock:
+        self.lcs.connect_region(country, timeout)
+        state = self.lcs.state()
+        return {'ok': True, 'country': state.country, 'timings': dict(self.lcs.metrics.timings)}
+
+    if command == 'disconnect':
+      with self.lock:
+        elapsed = self.lcs.disconnect_region()
+      return {'ok': True, 'elapsed': elapsed}
+
+    if command == 'status':
+      # the service's own view, which the health monitor and leases keep current
+      state = self.lcs.state()
+      return {
+        'ok': True,
+        'connected': state.pid is not None,
+        'country': state.country,
+        'exit_ip': state.exit_ip,
+        'leases': state.leases,
+        'remote_ip': self.lcs.ovs.remote_ip,
+        'busy': self.lock.locked(),
+      }
+
+    raise ControlServiceException(f'Unknown command {command}, expected one of {", ".join(COMMANDS)}')
+
+
+class ControlClient:
+  """Client of a ControlServer.
+  Sample usage:
+    with ControlClient('/run/user/1000/iplocationchanger.sock') as client:
+      client.request('connect', country='TR')
+  """
+  def __init__(
+    self: ControlClient,
+    socket_path: str,
+    timeout: Optional[float] = None,
+  ) -> None:
+    self.socket_path = socket_path
+    self.timeout = timeout
+    self.sock: Optional[socket.socket] = None
+    self.f_ptr = None
+
+  def __enter__(self: ControlClient) -> ControlClient:
+    return self
+
+  def __exit__(self: ControlClient, *_) -> None:
+    self.close()
+
+  def open(self: ControlClient) -> None:
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.settimeout(self.timeout)
+    try:
+      self.sock.connect(self.socket_path)
+    except OSError as e:
+      self.close()
+      raise ControlServiceException(f'Could not reach daemon at {self.socket_path}') from e
+    self.f_ptr = self.sock.makefile('rwb')
+
+  def close(self: ControlClient) -> None:
+    if self.f_ptr is not None:
+      self.f_ptr.close()
+      self.f_ptr = None
+    if self.sock is not None:
+      self.sock.close()
+      self.sock = None
+
+  def request(
+    self: ControlClient,
+    command: str,
+    **params,
+  ) -> dict:
+    """Send `command` and return the response; raises if the daemon
+    answered with an error.
+    """
+    if self.sock is None:
+      self.open()
+    try:
+      self.f_ptr.write(json.dumps({'command': command, **params}).encode('utf-8') + b'\n')
+      self.f_ptr.flush()
+      line = self.f_ptr.readline()
+    except OSError as e:
+      self.close()
+      raise ControlServiceException(f'Could not complete {command}') from e
+    if len(line) == 0:
+      self.close()
+      raise ControlServiceException(f'Daemon closed the connection during {command}')
+    response = json.loads(line)
+    if not response.get('ok'):
+      raise ControlServiceException(response.get('error', f'{command} failed'))
+    return response
@@ -0,0 +1,203 @@
+from __future__ import annotations
+from typing import Callable, NamedTuple, Optional
+
+import logging
+import threading
+import time
+
+from iplocationchanger.utils.utils import Utils
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+
+logger = logging.getLogger(__name__)
+
+class HealthEvent(NamedTuple):
+  # 'validated', 'unhealthy', 'reconnecting', 'reconnected' or 'reconnect_failed'
+  kind: str
+  country: str
+  detail: str = ''
+
+
+class HealthMonitorService:
+  """Watch the tunnel of a LocationChangerService from a background thread.
+  Every `check_interval` seconds it makes cheap liveness checks: openvpn
+  process alive, tun device up (when the device is known), CONNECTED state
+  and traffic received on the management interface. The exit location is
+  validated with the API at an adaptive interval, doubling from
+  `min_validate_interval` to `max_validate_interval` while it stays right.
+  On failure it reconnects, backing off from `min_backoff` to `max_backoff`
+  seconds between attempts.
+  Sample usage:
+    monitor = lcs.start_monitor(check_interval=5)
+    monitor.add_listener(lambda event: print(event.kind, event.detail))
+  """
+  def __init__(
+    self: HealthMonitorService,
+    lcs,
+    check_interval: float = 5,
+    min_validate_interval: float = 30,
+    max_validate_interval: float = 600,
+    min_backoff: float = 1,
+    max_backoff: float = 60,
+    stall_checks: int = 3,
+    connect_timeout: float = 30,
+  ) -> None:
+    self.lcs = lcs
+    self.check_interval = check_interval
+    self.min_validate_interval = min_validate_interval
+    self.max_validate_interval = max_validate_interval
+    self.min_backoff = min_backoff
+    self.max_backoff = max_backoff
+    self.stall_checks = stall_checks
+    self.connect_timeout = connect_timeout
+    self.listeners: list[Callable[[HealthEvent], None]] = []
+    self.stopped = threading.Event()
+    self.thread: Optional[threading.Thread] = None
+    self.reset()
+
+  def reset(self: HealthMonitorService) -> None:
+    """Forget what was learnt about the previous tunnel."""
+    self.validate_interval = self.min_validate_interval
+    self.next_validation = time.monotonic() + self.validate_interval
+    self.last_bytes: Optional[tuple[int, int]] = None
+    self.stalled = 0
+
+  def add_listener(
+    self: HealthMonitorService,
+    listener: Callable[[HealthEvent], None],
+  ) -> None:
+    self.listeners.append(listener)
+
+  def emit(
+    self: HealthMonitorService,
+    event: HealthEvent,
+  ) -> None:
+    logger.info(f'{event.kind} {event.country} {event.detail}'.strip())
+    for listener in list(self.listeners):
+      try:
+        listener(event)
+      except Exception as e:
+        logger.exception(e)
+
+  def start(self: HealthMonitorService) -> None:
+    self.stopped.clear()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(
+    self: HealthMonitorService,
+    timeout: float = 5,
+  ) -> None:
+    self.stopped.set()
+    if self.thread is not None:
+      self.thread.join(timeout)
+      self.thread = None
+
+  def run(self: HealthMonitorService) -> None:
+    while not self.stopped.wait(self.check_interval):
+      try:
+        self.check()
+      except Exception as e:
+        logger.exception(e)
+
+  def check(self: HealthMonitorService) -> None:
+    """One monitoring round; skipped while a switch is in progress."""
+    if not self.lcs.lock.acquire(blocking=False):
+      return
+    try:
+      country = self.lcs.country
+      if country is None:
+        return
+      switch_count = self.lcs.switch_count
+      reason = self.check_liveness()
+      if reason is None and time.monotonic() >= self.next_validation:
+        reason = self.check_location(country)
+    finally:
+      self.lcs.lock.release()
+
+    if reason is not None:
+      self.emit(HealthEvent('unhealthy', country, reason))
+      # the tunnel must not be reused as it is
+      self.lcs.invalidate()
+      self.reconnect(country, switch_count)
+
+  def check_liveness(self: HealthMonitorService) -> Optional[str]:
+    """Return why the tunnel is down, None if it looks alive."""
+    ovs = self.lcs.ovs
+    if ovs.pid is None or not Utils.pid_alive(ovs.pid):
+      return 'openvpn is not running'
+    if len(ovs.dev) > 0 and Utils.interface_up(ovs.dev) is False:
+      return f'{ovs.dev} is down'
+    try:
+      state, bytes_in, bytes_out = ovs.tunnel_stats()
+    except OpenVPNServiceException as e:
+      return str(e)
+    if state != 'CONNECTED':
+      return f'openvpn is {state}'
+
+    # sending without receiving anything, keepalive replies included
+    if self.last_bytes is not None:
+      last_in, last_out = self.last_bytes
+      if bytes_in <= last_in and bytes_out > last_out:
+        self.stalled += 1
+      else:
+        self.stalled = 0
+    self.last_bytes = (bytes_in, bytes_out)
+    if self.stalled >= self.stall_checks:
+      return f'no traffic received for {self.stalled} checks'
+    return None
+
+  def check_location(
+    self: HealthMonitorService,
+    country: str,
+  ) -> Optional[str]:
+    try:
+      ip, location = self.lcs.wms.current_location()
+    except WhatIsMyIPServiceException as e:
+      # failing lookups are no sign of a broken tunnel, retry sooner
+      logger.warning(f'Could not validate location: {e}')
+      self.next_validation = time.monotonic() + self.min_validate_interval
+      return None
+    ok = location.lower().strip() == country.lower().strip()
+    self.lcs.record_validation(country, self.lcs.config_path, ok, exit_location=(ip, location))
+    if not ok:
+      return f'exit location is {location}'
+    self.lcs.validated(ip)
+    self.validate_interval = min(self.validate_interval * 2, self.max_validate_interval)
+    self.next_validation = time.monotonic() + self.validate_interval
+    self.emit(HealthEvent('validated', country))
+    return None
+
+  def reconnect(
+    self: HealthMonitorService,
+    country: str,
+    switch_count: int,
+  ) -> bool:
+    """Reconnect to `country` until it succeeds or the monitor is stopped.
+    Gives up once the tunnel was switched or disconnected by someone else
+    (`lcs.switch_count` moved on from `switch_count`).
+    """
+    backoff = self.min_backoff
+    attempt = 0
+    while not self.stopped.is_set():
+      with self.lcs.lock:
+        if self.lcs.switch_count != switch_count:
+          logger.info(f'not reconnecting {country}, the tunnel was switched or disconnected meanwhile')
+          return False
+        attempt += 1
+        self.emit(HealthEvent('reconnecting', country, f'attempt {attempt}'))
+        try:
+          self.lcs.connect_region(country, self.connect_timeout)
+        except LocationChangerServiceException as e:
+          self.emit(HealthEvent('reconnect_failed', country, str(e)))
+        else:
+          self.reset()
+          self.emit(HealthEvent('reconnected', country, f'attempt {attempt}'))
+          return True
+        finally:
+          switch_count = self.lcs.switch_count
+      if self.stopped.wait(backoff):
+        break
+      backoff = min(backoff * 2, self.max_backoff)
+    return False
@@ -0,0 +1,111 @@
+from __future__ import annotations
+from typing import Optional
+
+import logging
+
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+
+logger = logging.getLogger(__name__)
+
+# name: (url, IP field, country field) of public endpoints answering both at once
+PRESETS = {
+  'ipinfo': ('https://ipinfo.io/json', 'ip', 'country'),
+  'ifconfig.co': ('https://ifconfig.co/json', 'ip', 'country_iso'),
+  'ip-api': ('http://ip-api.com/json', 'query', 'countryCode'),
+  'ipapi.co': ('https://ipapi.co/json', 'ip', 'country_code'),
+}
+
+def field(
+  body: dict,
+  path: str,
+) -> str:
+  """Value of the dotted `path` in `body`, e.g. 'location.country_code'."""
+  value = body
+  for key in path.split('.'):
+    value = value[key]
+  if not isinstance(value, str) or len(value) == 0:
+    raise ValueError(f'{path} is {value!r}')
+  return value
+
+
+class HTTPLocationProvider:
+  """Locate the caller with one request to a JSON endpoint which answers
+  with the caller's IP and country together.
+  Sample usage:
+    provider = HTTPLocationProvider('ipinfo', 'https://ipinfo.io/json')
+    provider.locate() # ('203.0.113.7', 'TR')
+    provider = HTTPLocationProvider.from_preset('ip-api')
+  """
+  def __init__(
+    self: HTTPLocationProvider,
+    name: str,
+    url: str,
+    ip_field: str = 'ip',
+    country_field: str = 'country',
+    params: Optional[dict[str, str]] = None,
+    timeout: float = 10,
+    metrics: Optional[Metrics] = None,
+  ) -> None:
+    self.name = name
+    self.url = url
+    self.ip_field = ip_field
+    self.country_field = country_field
+    self.params = params if params is not None else {}
+    self.timeout = timeout
+    self.metrics = metrics if metrics is not None else Metrics()
+    # built on the first request, see WhatIsMyIPService
+    self.session = None
+
+  @classmethod
+  def from_preset(
+    cls: HTTPLocationProvider,
+    name: str,
+    **kwargs,
+  ) -> HTTPLocationProvider:
+    try:
+      url, ip_field, country_field = PRESETS[name]
+    except KeyError as e:
+      raise LocationProviderException(
+        f'Unknown location provider {name}, expected one of {", ".join(PRESETS)}'
+      ) from e
+    return cls(name, url, ip_field, country_field, **kwargs)
+
+  def get_session(self: HTTPLocationProvider) -> requests.Session:
+    import requests
+
+    if self.session is None:
+      self.session = requests.Session()
+    return self.session
+
+  def reset_session(self: HTTPLocationProvider) -> None:
+    if self.session is not None:
+      self.session.close()
+      self.session = None
+
+  def locate(self: HTTPLocationProvider) -> tuple[str, str]:
+    """Return (IP, country) of the caller."""
+    import requests
+
+    session = self.get_session()
+    try:
+      res = session.get(self.url, params=self.params, timeout=self.timeout)
+    except requests.exceptions.RequestException as e:
+      self.metrics.api_calls.inc(endpoint=self.name, outcome='connection_error')
+      raise LocationProviderException(f'Could not reach {self.name}') from e
+    if res.status_code == 429:
+      self.metrics.api_calls.inc(endpoint=self.name, outcome='rate_limited')
+      raise LocationProviderException(f'{self.name} rate limited the request')
+    if res.status_code < 200 or res.status_code > 299:
+      self.metrics.api_calls.inc(endpoint=self.name, outcome='http_error')
+      raise LocationProviderException(f'{self.name} answered {res.status_code}')
+
+    try:
+      body = res.json()
+      ip, country = field(body, self.ip_field), field(body, self.country_field)
+    except (ValueError, KeyError, TypeError) as e:
+      self.metrics.api_calls.inc(endpoint=self.name, outcome='api_error')
+      raise LocationProviderException(f'Unexpected response from {self.name}') from e
+    self.metrics.api_calls.inc(endpoint=self.name, outcome='ok')
+    logger.debug(f'{self.name}: {ip} {country}')
+    return ip, country
@@ -0,0 +1,223 @@
+from __future__ import annotations
+from typing import Optional
+
+import asyncio
+import logging
+import os
+import struct
+import threading
+import time
+
+from iplocationchanger.model.openvpn_config import OpenVPNConfig
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
+from iplocationchanger.exception.config_catalogue_service_exception import ConfigCatalogueServiceException
+
+logger = logging.getLogger(__name__)
+
+# P_CONTROL_HARD_RESET_CLIENT_V2 (opcode 7, key id 0), random session id,
+# empty ack array and message packet id 0
+HARD_RESET_OPCODE = 7 << 3
+
+def hard_reset_packet() -> bytes:
+  return struct.pack('!B8sBI', HARD_RESET_OPCODE, os.urandom(8), 0, 0)
+
+
+class UDPProbeProtocol(asyncio.DatagramProtocol):
+  def __init__(self: UDPProbeProtocol) -> None:
+    self.answered = asyncio.get_running_loop().create_future()
+
+  def datagram_received(self: UDPProbeProtocol, data: bytes, addr) -> None:
+    if not self.answered.done():
+      self.answered.set_result(time.monotonic())
+
+  def error_received(self: UDPProbeProtocol, exc: Exception) -> None:
+    if not self.answered.done():
+      self.answered.set_exception(exc)
+
+
+class LatencyProbeService:
+  """Probe the `remote` servers of every config concurrently and keep an
+  exponentially weighted latency score per server.
+  TCP remotes are timed by connection setup, UDP remotes by the reply to an
+  openvpn hard reset packet. Servers using tls-auth/tls-crypt drop that
+  packet; for them the round trip of a TCP connection attempt on the same
+  port is taken instead, and a server answering neither is left unscored
+  rather than charged as unreachable.
+  Sample usage:
+    lps = LatencyProbeService({'TR': ['/assets/tr1.ovpn', '/assets/tr2.ovpn']})
+    lps.probe(['TR'])
+    lps.rank(['/assets/tr1.ovpn', '/assets/tr2.ovpn'])
+  """
+  def __init__(
+    self: LatencyProbeService,
+    config_to_country: dict,
+    timeout: float = 2,
+    alpha: float = 0.3,
+    concurrency: int = 64,
+  ) -> None:
+    self.config_to_country = config_to_country
+    self.timeout = timeout
+    self.alpha = alpha
+    self.concurrency = concurrency
+    self.lock = threading.Lock()
+    self.scores: dict[OpenVPNRemote, float] = {}
+    self.remotes: dict[str, list[OpenVPNRemote]] = {}
+
+  def config_remotes(
+    self: LatencyProbeService,
+    config_path: str,
+  ) -> list[OpenVPNRemote]:
+    if isinstance(self.config_to_country, ConfigCatalogueService):
+      # parsed once and kept current by the catalogue
+      try:
+        return self.config_to_country.config(config_path).remotes()
+      except ConfigCatalogueServiceException:
+        return []
+    if config_path not in self.remotes:
+      try:
+        self.remotes[config_path] = OpenVPNConfig.from_file(config_path).remotes()
+      except (OSError, ValueError) as e:
+        logger.error(f'Could not parse {config_path}: {e}')
+        self.remotes[config_path] = []
+    return self.remotes[config_path]
+
+  async def probe_tcp(
+    self: LatencyProbeService,
+    remote: OpenVPNRemote,
+  ) -> float:
+    start = time.monotonic()
+    _, writer = await asyncio.wait_for(
+      asyncio.open_connection(remote.host, remote.port),
+      self.timeout,
+    )
+    elapsed = time.monotonic() - start
+    writer.close()
+    try:
+      await writer.wait_closed()
+    except OSError:
+      pass
+    return elapsed
+
+  async def probe_rtt(
+    self: LatencyProbeService,
+    remote: OpenVPNRemote,
+  ) -> float:
+    """Round trip time to the host of `remote` by a TCP connection attempt
+    on its port: a refused connection answers as fast as an accepted one.
+    """
+    start = time.monotonic()
+    try:
+      return await self.probe_tcp(remote)
+    except ConnectionRefusedError:
+      return time.monotonic() - start
+
+  async def probe_udp(
+    self: LatencyProbeService,
+    remote: OpenVPNRemote,
+  ) -> float:
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+      UDPProbeProtocol,
+      remote_addr=(remote.host, remote.port),
+    )
+    try:
+      start = time.monotonic()
+      transport.sendto(hard_reset_packet())
+      answered = await asyncio.wait_for(protocol.answered, self.timeout)
+      return answered - start
+    finally:
+      transport.close()
+
+  async def probe_remote(
+    self: LatencyProbeService,
+    remote: OpenVPNRemote,
+  ) -> Optional[float]:
+    """Probe `remote` once and fold the result into its score.
+    Returns the measured latency, None if the server did not answer.
+    """
+    try:
+      if remote.transport == 'tcp':
+        latency = await self.probe_tcp(remote)
+      else:
+        try:
+          latency = await self.probe_udp(remote)
+        except asyncio.TimeoutError:
+          # dropped unauthenticated, as tls-auth/tls-crypt servers do
+          latency = await self.probe_rtt(remote)
+    except asyncio.TimeoutError:
+      if remote.transport == 'tcp':
+        logger.debug(f'{remote.host}:{remote.port}/{remote.proto} unreachable: timed out')
+        self.record(remote, None)
+      else:
+        # silence is no proof a UDP server is down
+        logger.debug(f'{remote.host}:{remote.port}/{remote.proto} did not answer, left unscored')
+      return None
+    except OSError as e:
+      logger.debug(f'{remote.host}:{remote.port}/{remote.proto} unreachable: {e!r}')
+      latency = None
+    self.record(remote, latency)
+    return latency
+
+  def record(
+    self: LatencyProbeService,
+    remote: OpenVPNRemote,
+    latency: Optional[float],
+  ) -> None:
+    # unreachable servers are charged the full probe timeout, twice over
+    sample = 2 * self.timeout if latency is None else latency
+    with self.lock:
+      previous = self.scores.get(remote)
+      if previous is None:
+        self.scores[remote] = sample
+      else:
+        self.scores[remote] = self.alpha * sample + (1 - self.alpha) * previous
+
+  async def probe_all(
+    self: LatencyProbeService,
+    countries: Optional[list[str]] = None,
+  ) -> dict[OpenVPNRemote, Optional[float]]:
+    """Probe every remote of the configs of `countries` (all by default)."""
+    if countries is None:
+      countries = list(self.config_to_country)
+    remotes = []
+    for country in countries:
+      for config_path in config_paths(self.config_to_country, country):
+        for remote in self.config_remotes(config_path):
+          if remote not in remotes:
+            remotes.append(remote)
+
+    semaphore = asyncio.Semaphore(self.concurrency)
+    async def bounded(remote: OpenVPNRemote) -> Optional[float]:
+      async with semaphore:
+        return await self.probe_remote(remote)
+    results = await asyncio.gather(*(bounded(r) for r in remotes))
+    return dict(zip(remotes, results))
+
+  def probe(
+    self: LatencyProbeService,
+    countries: Optional[list[str]] = None,
+  ) -> dict[OpenVPNRemote, Optional[float]]:
+    return asyncio.run(self.probe_all(countries))
+
+  def config_score(
+    self: LatencyProbeService,
+    config_path: str,
+  ) -> Optional[float]:
+    """Score of the best scored remote of `config_path`, None if none was probed."""
+    with self.lock:
+      scores = [
+        self.scores[r] for r in self.config_remotes(config_path) if r in self.scores
+      ]
+    return min(scores) if len(scores) > 0 else None
+
+  def rank(
+    self: LatencyProbeService,
+    configs: list[str],
+  ) -> list[str]:
+    """Order `configs` fastest first; configs which were never probed go last."""
+    def key(config_path: str) -> tuple[bool, float]:
+      score = self.config_score(config_path)
+      return (score is None, score or 0.0)
+    return sorted(configs, key=key)
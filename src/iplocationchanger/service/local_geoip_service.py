@@ -0,0 +1,124 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+
+import csv
+import ipaddress
+import logging
+
+from iplocationchanger.exception.local_geoip_service_exception import LocalGeoIPServiceException
+
+logger = logging.getLogger(__name__)
+
+class IPRangeTable:
+  """Sorted, non-overlapping IP ranges mapped to country codes.
+  Range bounds live in compact arrays and countries are stored as indices into
+  a small table of distinct codes, so lookups are a single binary search.
+  """
+  def __init__(
+    self: IPRangeTable,
+    starts: array | list,
+    ends: array | list,
+  ) -> None:
+    self.starts = starts
+    self.ends = ends
+    self.country_idx = array('H')
+
+  def __len__(self: IPRangeTable) -> int:
+    return len(self.starts)
+
+  def find(
+    self: IPRangeTable,
+    ip: int,
+  ) -> int:
+    i = bisect_right(self.starts, ip) - 1
+    if i < 0 or ip > self.ends[i]:
+      return -1
+    return self.country_idx[i]
+
+
+class LocalGeoIPService:
+  """Resolve countries from a local IP range database.
+  The database is a CSV file whose rows are either
+  `start_ip,end_ip,country` or `network_cidr,country`; blank lines and lines
+  starting with '#' are ignored.
+  Sample usage:
+    lgs = LocalGeoIPService('/assets/geoip.csv')
+    lgs.get_location_from_ip('95.223.119.45') # 'DE'
+  """
+  def __init__(
+    self: LocalGeoIPService,
+    db_path: str,
+  ) -> None:
+    self.db_path = db_path
+    self.countries = []
+    self.v4 = IPRangeTable(array('L'), array('L'))
+    # 128 bit bounds do not fit in an array type code
+    self.v6 = IPRangeTable([], [])
+    self.load()
+
+  def load(self: LocalGeoIPService) -> None:
+    rows = {4: [], 6: []}
+    try:
+      with open(self.db_path, newline='') as f_ptr:
+        for line_no, row in enumerate(csv.reader(f_ptr), start=1):
+          if len(row) == 0 or row[0].strip().startswith('#'):
+            continue
+          try:
+            start, end, country = self.parse_row(row)
+          except ValueError as e:
+            raise LocalGeoIPServiceException(
+              f'Invalid row {line_no} in {self.db_path}: {",".join(row)}'
+            ) from e
+          rows[start.version].append((int(start), int(end), country))
+    except OSError as e:
+      raise LocalGeoIPServiceException(f'Could not read {self.db_path}') from e
+
+    country_index = {}
+    for version, table in ((4, self.v4), (6, self.v6)):
+      rows[version].sort()
+      for start, end, country in rows[version]:
+        if len(table) > 0 and start <= table.ends[-1]:
+          raise LocalGeoIPServiceException(
+            f'Overlapping ranges in {self.db_path} at {ipaddress.ip_address(start)}'
+          )
+        if country not in country_index:
+          country_index[country] = len(self.countries)
+          self.countries.append(country)
+        table.starts.append(start)
+        table.ends.append(end)
+        table.country_idx.append(country_index[country])
+    logger.debug(f'loaded {len(self.v4)} IPv4 and {len(self.v6)} IPv6 ranges from {self.db_path}')
+
+  def parse_row(
+    self: LocalGeoIPService,
+    row: list[str],
+  ) -> tuple[ipaddress.IPv4Address | ipaddress.IPv6Address, ipaddress.IPv4Address | ipaddress.IPv6Address, str]:
+    row = [field.strip() for field in row]
+    if len(row) == 2:
+      network = ipaddress.ip_network(row[0], strict=False)
+      return network.network_address, network.broadcast_address, row[1].upper()
+    if len(row) == 3:
+      start = ipaddress.ip_address(row[0])
+      end = ipaddress.ip_address(row[1])
+      if start.version != end.version or start > end:
+        raise ValueError('invalid range')
+      return start, end, row[2].upper()
+    raise ValueError('unexpected column count')
+
+  def get_location_from_ip(
+    self: LocalGeoIPService,
+    ip: str,
+  ) -> str:
+    try:
+      address = ipaddress.ip_address(ip.strip())
+    except ValueError as e:
+      raise LocalGeoIPServiceException(f'Invalid IP {ip}') from e
+
+    table = self.v4 if address.version == 4 else self.v6
+    idx = table.find(int(address))
+    if idx < 0:
+      raise LocalGeoIPServiceException(f'No location for {ip}')
+    location = self.countries[idx]
+    logger.debug(f'Location: {location}')
+    return location
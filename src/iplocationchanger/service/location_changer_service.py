@@ -1,25 +1,94 @@
 from __future__ import annotations
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple, Optional
 
 import logging
+import socket
+import sqlite3
+import threading
 import time
 
 from iplocationchanger.service.openvpn_service import OpenVPNService
 from iplocationchanger.service.whatismyip_service import WhatIsMyIPService
+from iplocationchanger.service.whatismyip_service import LocationBackend
+from iplocationchanger.service.whatismyip_service import LocationProvider
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.service.route_service import RouteService
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
+from iplocationchanger.service.config_selector_service import ConfigSelectorService
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.service.health_monitor_service import HealthMonitorService
+from iplocationchanger.utils.utils import Utils
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.utils.exit_history import ExitHistory
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.model.openvpn_config import OpenVPNConfig
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
 from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
 from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
 from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+from iplocationchanger.exception.route_service_exception import RouteServiceException
+from iplocationchanger.exception.config_catalogue_service_exception import ConfigCatalogueServiceException
 
 logger = logging.getLogger(__name__)
 
+class TunnelState(NamedTuple):
+  country: Optional[str]
+  config_path: Optional[str]
+  pid: Optional[int]
+  exit_ip: str
+  # monotonic time the exit location was last confirmed, None if never
+  validated_at: Optional[float]
+  # callers holding a lease on `country`
+  leases: int
+
+
 class LocationChangerService:
+  # tun devices alternated between in make-before-break mode
+  MAKE_BEFORE_BREAK_DEVS = ('tun20', 'tun21')
+
   def __init__(
     self: LocationChangerService,
     whatismyip_api_key: str,
     openvpn_config_to_country_map: dict,
     openvpn_executable_path: str,
     openvpn_credentials_path: str = '',
+    openvpn_management_port: int = 7505,
+    location_cache: Optional[TTLCache] = None,
+    location_backend: Optional[LocationBackend] = None,
+    make_before_break: bool = False,
+    config_strategy: str = 'round-robin',
+    max_config_attempts: int = 3,
+    metrics: Optional[Metrics] = None,
+    validation: str = 'single',
+    location_providers: Optional[list[LocationProvider]] = None,
+    location_registry: Optional[LocationProviderRegistry] = None,
+    openvpn_foreground: bool = False,
+    reuse_window: float = 60,
+    history: Optional[ExitHistory] = None,
+    openvpn_credentials: Optional[OpenVPNCredentials] = None,
   ) -> None:
     """Initialize LocationChangerService.
+    With `make_before_break`, region switches bring the next tunnel up on a
+    second tun device and move the default route onto it before the previous
+    tunnel is torn down (Linux only, requires sudo for `ip`).
+    A country may map to a list of configs: they are tried in the order given
+    by `config_strategy` ('round-robin', 'latency', 'random' or 'probe'), at
+    most `max_config_attempts` per switch. With 'probe' the `remote` servers
+    of the country's configs are probed before each switch, fastest first.
+    `validation`, `location_providers` and `location_registry` are passed
+    to WhatIsMyIPService as `validation`, `providers` and `registry`.
+    With `openvpn_foreground`, openvpn runs as a child process instead of a
+    daemon and its log is streamed to the debug log as it is written.
+    Connecting to the country already connected is skipped while its exit
+    location was validated less than `reuse_window` seconds ago and openvpn
+    is alive; 0 always reconnects. Callers sharing a region use `lease`.
+    Every validation is appended to `history` when given, which the
+    'history' strategy ranks configs by.
+    `openvpn_credentials` are given to openvpn on its management interface
+    when it asks for them, so nothing is written to disk; an auth file at
+    `openvpn_credentials_path` is used otherwise.
     Sample usage: 
     try:
       lcs = LocationChangerService(
@@ -32,33 +101,478 @@ class LocationChangerService:
       # Disconnect VPN connection
       lcs.disconnect_region()
     """
-    self.wms = WhatIsMyIPService(whatismyip_api_key)
+    self.metrics = metrics if metrics is not None else Metrics()
+    self.wms = WhatIsMyIPService(
+      whatismyip_api_key,
+      location_cache=location_cache,
+      location_backend=location_backend,
+      metrics=self.metrics,
+      validation=validation,
+      providers=location_providers,
+      registry=location_registry,
+    )
+    self.make_before_break = make_before_break
+    # country of the tunnel carrying traffic, None when disconnected
+    self.country: Optional[str] = None
+    self.config_path: Optional[str] = None
+    self.exit_ip = ''
+    self.validated_at: Optional[float] = None
+    self.reuse_window = reuse_window
+    # serializes switches with the health monitor
+    self.lock = threading.RLock()
+    # bumped by every switch and disconnect, so the health monitor can tell
+    # whether the tunnel it saw fail was replaced meanwhile
+    self.switch_count = 0
+    # callers sharing the tunnel to `leased_country`
+    self.leases = 0
+    self.leased_country: Optional[str] = None
+    # country the first lease is connecting to, outside lease_condition
+    self.lease_connecting: Optional[str] = None
+    self.lease_condition = threading.Condition()
+    self.monitor: Optional[HealthMonitorService] = None
+    self.prober = None
+    if config_strategy == 'probe':
+      # asyncio is only imported by the prober
+      from iplocationchanger.service.latency_probe_service import LatencyProbeService
+      self.prober = LatencyProbeService(openvpn_config_to_country_map)
+    self.history = history
+    self.selector = ConfigSelectorService(
+      openvpn_config_to_country_map,
+      config_strategy,
+      ranker=self.prober,
+      history=history,
+    )
+    self.max_config_attempts = max_config_attempts
     self.ovs = OpenVPNService(
       openvpn_config_to_country_map,
       openvpn_executable_path,
       credentials_path=openvpn_credentials_path,
+      credentials=openvpn_credentials,
+      management_port=openvpn_management_port,
+      metrics=self.metrics,
+      dev=self.MAKE_BEFORE_BREAK_DEVS[0] if make_before_break else '',
+      route_noexec=make_before_break,
+      foreground=openvpn_foreground,
     )
+    if make_before_break:
+      self.standby_ovs = OpenVPNService(
+        openvpn_config_to_country_map,
+        openvpn_executable_path,
+        credentials_path=openvpn_credentials_path,
+        credentials=openvpn_credentials,
+        management_port=openvpn_management_port + 1,
+        metrics=self.metrics,
+        dev=self.MAKE_BEFORE_BREAK_DEVS[1],
+        route_noexec=True,
+        foreground=openvpn_foreground,
+      )
+      self.routes = RouteService()
+      # server addresses pinned to the physical gateway for the standby
+      self.standby_pins: list[str] = []
 
   def disconnect_region(
     self: LocationChangerService,
-  ) -> None:
+    force: bool = False,
+  ) -> float:
+    """Disconnect and return the tunnel teardown time in seconds.
+    Raises while the tunnel is leased; with `force` the leases are dropped,
+    and their holders' `release` raises.
+    """
     logger.debug('disconnecting...')
-    self.ovs.disconnect()
+    with self.lock:
+      with self.lease_condition:
+        if self.leases > 0:
+          if not force:
+            raise LocationChangerServiceException(
+              f'Could not disconnect: {self.leased_country} is leased by {self.leases} callers'
+            )
+          logger.warning(f'dropping {self.leases} leases of {self.leased_country}')
+          self.leases = 0
+          self.leased_country = None
+          self.lease_condition.notify_all()
+      self.switch_count += 1
+      self.country = None
+      self.invalidate()
+      remote_ip = self.ovs.remote_ip
+      elapsed = self.ovs.disconnect()
+      if self.make_before_break:
+        self.routes.clear()
+        if len(remote_ip) > 0:
+          self.routes.unpin(remote_ip)
+      self.wms.reset_session()
+    return elapsed
 
   def connect_region(
     self: LocationChangerService,
     country: str,
-    OPENVPN_DELAY: int = 5,
+    OPENVPN_TIMEOUT: float = 30,
+    probe: bool = True,
   ) -> None:
-    logger.debug(f'connecting to {country}...')
+    """Connect to `country`, failing over across its configs. The time
+    spent in each phase of the switch is left in `self.metrics.timings`.
+    `probe=False` skips probing the servers with the 'probe' strategy, for
+    callers which have just probed them.
+    Returns at once if `country` is connected and was recently validated.
+    """
+    with self.lock:
+      if self.leases > 0 and self.leased_country != country:
+        raise LocationChangerServiceException(
+          f'Could not connect to {country}: {self.leased_country} is leased by {self.leases} callers'
+        )
+      if self.reusable(country):
+        logger.debug(f'already connected to {country}, validated {time.monotonic() - self.validated_at:.1f}s ago')
+        self.metrics.switches_reused.inc(country=country)
+        return
+      self.switch_count += 1
+      self.metrics.start_switch()
+      self.metrics.switches.inc(country=country)
+      start = time.monotonic()
+      try:
+        self.try_configs(country, OPENVPN_TIMEOUT, probe)
+        self.country = country
+      except LocationChangerServiceException as e:
+        self.metrics.switch_failures.inc(exception=type(e.__cause__ or e).__name__)
+        # only make-before-break keeps the previous tunnel up on failure
+        if self.ovs.pid is None:
+          self.country = None
+          self.invalidate()
+        raise
+      finally:
+        self.metrics.switch_seconds.observe(time.monotonic() - start)
+        logger.debug('switch timings: ' + ', '.join(
+          f'{phase}={elapsed:.3f}s' for phase, elapsed in self.metrics.timings.items()
+        ))
+
+  def reusable(
+    self: LocationChangerService,
+    country: str,
+  ) -> bool:
+    """Whether the tunnel up is to `country`, alive and validated within
+    `reuse_window` seconds.
+    """
+    if self.country != country or self.validated_at is None:
+      return False
+    if time.monotonic() - self.validated_at > self.reuse_window:
+      return False
+    return self.ovs.pid is not None and Utils.pid_alive(self.ovs.pid)
+
+  def validated(
+    self: LocationChangerService,
+    exit_ip: str,
+  ) -> None:
+    """Record that the exit location was just confirmed."""
+    self.exit_ip = exit_ip
+    self.validated_at = time.monotonic()
+
+  def record_validation(
+    self: LocationChangerService,
+    country: str,
+    config_path: Optional[str],
+    ok: bool,
+    latency: Optional[float] = None,
+    exit_location: Optional[tuple[str, str]] = None,
+  ) -> None:
+    """Append a validation of `config_path` to the history, if kept.
+    `exit_location` is the (ip, country) found, by default the one of the
+    last `validate_connection`.
+    """
+    if self.history is None or config_path is None:
+      return
+    ip, location = exit_location if exit_location is not None else self.wms.last_location
     try:
-      self.ovs.connect(country)
+      self.history.record(config_path, country, ip, location, ok, latency)
+    except sqlite3.Error as e:
+      logger.error(f'Could not record the validation of {config_path}: {e}')
+
+  def invalidate(self: LocationChangerService) -> None:
+    """Make the next `connect_region` reconnect even to the same country."""
+    self.validated_at = None
+
+  def state(self: LocationChangerService) -> TunnelState:
+    with self.lock:
+      return TunnelState(
+        self.country,
+        self.config_path if self.country is not None else None,
+        self.ovs.pid,
+        self.exit_ip if self.country is not None else '',
+        self.validated_at,
+        self.leases,
+      )
+
+  @contextmanager
+  def lease(
+    self: LocationChangerService,
+    country: str,
+    OPENVPN_TIMEOUT: float = 30,
+    wait: Optional[float] = None,
+  ) -> Iterator[LocationChangerService]:
+    """Hold the tunnel to `country` for the duration of the block.
+    Callers leasing the country already leased share its tunnel; callers
+    wanting another country wait up to `wait` seconds (forever if None)
+    for the last lease to be released, then switch.
+    Sample usage:
+      with lcs.lease('TR'):
+        requests.get('https://example.com')
+    """
+    self.acquire(country, OPENVPN_TIMEOUT, wait)
+    try:
+      yield self
+    finally:
+      self.release(country)
+
+  def acquire(
+    self: LocationChangerService,
+    country: str,
+    OPENVPN_TIMEOUT: float = 30,
+    wait: Optional[float] = None,
+  ) -> None:
+    with self.lease_condition:
+      # callers for the same country wait for the first one's connect
+      # rather than connect again
+      leased = self.lease_condition.wait_for(
+        lambda: self.lease_connecting is None and (self.leases == 0 or self.leased_country == country),
+        wait,
+      )
+      if not leased:
+        raise LocationChangerServiceException(
+          f'Could not connect to {country}: {self.leased_country or self.lease_connecting} still leased after {wait}s'
+        )
+      if self.leases > 0:
+        self.leases += 1
+        logger.debug(f'{country} leased, {self.leases} leases')
+        return
+      self.lease_connecting = country
+
+    # connected without holding lease_condition, so waiting callers keep
+    # their timeout and releases are not held up
+    try:
+      with self.lock:
+        self.connect_region(country, OPENVPN_TIMEOUT)
+        with self.lease_condition:
+          self.leased_country = country
+          self.leases += 1
+          logger.debug(f'{country} leased, {self.leases} leases')
+    finally:
+      with self.lease_condition:
+        self.lease_connecting = None
+        self.lease_condition.notify_all()
+
+  def release(
+    self: LocationChangerService,
+    country: str,
+  ) -> None:
+    with self.lease_condition:
+      if self.leases == 0 or self.leased_country != country:
+        raise LocationChangerServiceException(f'{country} is not leased')
+      self.leases -= 1
+      if self.leases == 0:
+        self.leased_country = None
+        self.lease_condition.notify_all()
+      logger.debug(f'{country} released, {self.leases} leases')
+
+  def start_monitor(
+    self: LocationChangerService,
+    **kwargs,
+  ) -> HealthMonitorService:
+    """Start checking the tunnel in the background, reconnecting when it
+    fails. `kwargs` are passed to HealthMonitorService.
+    """
+    if self.monitor is None:
+      self.monitor = HealthMonitorService(self, **kwargs)
+      self.monitor.start()
+    return self.monitor
+
+  def stop_monitor(self: LocationChangerService) -> None:
+    if self.monitor is not None:
+      self.monitor.stop()
+      self.monitor = None
+
+  def try_configs(
+    self: LocationChangerService,
+    country: str,
+    OPENVPN_TIMEOUT: float = 30,
+    probe: bool = True,
+  ) -> None:
+    with self.metrics.phase('config_lookup'):
+      if probe and self.prober is not None and len(config_paths(self.selector.config_to_country, country)) > 1:
+        self.prober.probe([country])
+      candidates = self.selector.candidates(country)[:self.max_config_attempts]
+    if len(candidates) == 0:
+      raise LocationChangerServiceException(f'Could not find config for {country}')
+
+    attempt = self.switch_config if self.make_before_break else self.connect_config
+    for config_path in candidates:
+      try:
+        attempt(country, config_path, OPENVPN_TIMEOUT)
+        return
+      except LocationChangerServiceException as e:
+        logger.warning(f'{config_path} failed: {e.__cause__}')
+        error = e
+    raise error
+
+  def connect_config(
+    self: LocationChangerService,
+    country: str,
+    config_path: str,
+    OPENVPN_TIMEOUT: float = 30,
+  ) -> None:
+    logger.debug(f'connecting to {country} using {config_path}...')
+    if self.ovs.pid is not None:
+      self.ovs.disconnect()
+    start = time.monotonic()
+    try:
+      self.ovs.connect(country, config_path)
+      # block until the tunnel is up rather than for a fixed delay
+      self.ovs.wait_until_connected(OPENVPN_TIMEOUT)
     except OpenVPNServiceException as e:
+      self.selector.record(config_path, None)
+      self.ovs.disconnect()
       raise LocationChangerServiceException(f'Could not connect to {country}') from e
-    # buy openvpn some time
-    time.sleep(OPENVPN_DELAY)
+    latency = time.monotonic() - start
+    self.selector.record(config_path, latency)
+
+    # pooled connections were opened over the previous route
+    self.wms.reset_session()
     try:
-      self.wms.validate_connection(country)
+      exit_ip = self.wms.validate_connection(country)
     except WhatIsMyIPServiceException as e:
+      self.record_validation(country, config_path, False, latency)
+      self.ovs.disconnect()
       raise LocationChangerServiceException(f'Could not connect to {country}') from e
+    self.record_validation(country, config_path, True, latency)
+    self.config_path = config_path
+    self.validated(exit_ip)
     logger.debug(f'connected to {country}')
+
+  def switch_config(
+    self: LocationChangerService,
+    country: str,
+    config_path: str,
+    OPENVPN_TIMEOUT: float = 30,
+  ) -> None:
+    """Make-before-break switch: connect `country` on the standby tun device,
+    move the default route onto it and validate, then tear the previous tunnel
+    down. If anything fails the previous tunnel keeps carrying traffic.
+    """
+    logger.debug(f'switching to {country} using {config_path}...')
+    standby = self.standby_ovs
+    # the standby's handshake must not run through the active tunnel, only
+    # to be moved onto another path once the routes flip: its servers are
+    # pinned to the physical gateway and handed to openvpn as resolved
+    remotes = self.resolve_remotes(config_path)
+    try:
+      for remote in remotes:
+        if remote.host not in self.standby_pins:
+          self.routes.pin(remote.host)
+          self.standby_pins.append(remote.host)
+    except RouteServiceException as e:
+      self.abort_switch()
+      raise LocationChangerServiceException(f'Could not connect to {country}') from e
+
+    start = time.monotonic()
+    try:
+      standby.connect(country, config_path, remotes=remotes)
+      standby.wait_until_connected(OPENVPN_TIMEOUT)
+    except OpenVPNServiceException as e:
+      self.selector.record(config_path, None)
+      self.abort_switch()
+      raise LocationChangerServiceException(f'Could not connect to {country}') from e
+    latency = time.monotonic() - start
+    self.selector.record(config_path, latency)
+    # only the server the standby ended up with stays pinned
+    self.unpin_standby(keep=standby.remote_ip)
+
+    try:
+      self.routes.route_through(standby.dev, standby.remote_ip)
+    except RouteServiceException as e:
+      self.abort_switch()
+      raise LocationChangerServiceException(f'Could not connect to {country}') from e
+
+    self.wms.reset_session()
+    try:
+      exit_ip = self.wms.validate_connection(country)
+    except WhatIsMyIPServiceException as e:
+      self.record_validation(country, config_path, False, latency)
+      self.abort_switch()
+      raise LocationChangerServiceException(f'Could not connect to {country}') from e
+    self.record_validation(country, config_path, True, latency)
+    self.config_path = config_path
+    self.validated(exit_ip)
+
+    previous = self.ovs
+    previous_remote_ip = previous.remote_ip
+    self.ovs, self.standby_ovs = standby, previous
+    elapsed = previous.disconnect()
+    if len(previous_remote_ip) > 0 and previous_remote_ip != standby.remote_ip:
+      self.routes.unpin(previous_remote_ip)
+    logger.debug(f'connected to {country}, previous tunnel closed after {elapsed:.3f}s')
+
+  def abort_switch(self: LocationChangerService) -> None:
+    """Hand traffic back to the active tunnel and drop the standby one."""
+    standby_remote_ip = self.standby_ovs.remote_ip
+    try:
+      if self.ovs.pid is not None:
+        self.routes.route_through(self.ovs.dev, self.ovs.remote_ip)
+      else:
+        self.routes.clear()
+    except RouteServiceException as e:
+      logger.error(f'Could not restore routes: {e}')
+    self.standby_ovs.disconnect()
+    if len(standby_remote_ip) > 0 and standby_remote_ip not in self.standby_pins:
+      self.standby_pins.append(standby_remote_ip)
+    self.unpin_standby()
+    self.wms.reset_session()
+
+  def unpin_standby(
+    self: LocationChangerService,
+    keep: str = '',
+  ) -> None:
+    """Drop the routes pinned for the standby's servers but `keep` and the
+    server of the active tunnel.
+    """
+    for ip in self.standby_pins:
+      if ip != keep and ip != self.ovs.remote_ip:
+        self.routes.unpin(ip)
+    self.standby_pins = []
+
+  def config_remotes(
+    self: LocationChangerService,
+    config_path: str,
+  ) -> list[OpenVPNRemote]:
+    config_to_country = self.selector.config_to_country
+    if isinstance(config_to_country, ConfigCatalogueService):
+      try:
+        return config_to_country.config(config_path).remotes()
+      except ConfigCatalogueServiceException:
+        return []
+    try:
+      return OpenVPNConfig.from_file(config_path).remotes()
+    except (OSError, ValueError) as e:
+      logger.error(f'Could not parse {config_path}: {e}')
+      return []
+
+  def resolve_remotes(
+    self: LocationChangerService,
+    config_path: str,
+  ) -> list[OpenVPNRemote]:
+    """The servers of `config_path` with their hosts resolved to IPv4
+    addresses, in config order. Hosts which do not resolve are left to
+    openvpn.
+    """
+    resolved = []
+    for remote in self.config_remotes(config_path):
+      try:
+        infos = socket.getaddrinfo(
+          remote.host,
+          remote.port,
+          socket.AF_INET,
+          socket.SOCK_STREAM if remote.transport == 'tcp' else socket.SOCK_DGRAM,
+        )
+      except (OSError, UnicodeError) as e:
+        logger.warning(f'Could not resolve {remote.host}: {e}')
+        continue
+      for info in infos:
+        address = remote._replace(host=info[4][0])
+        if address not in resolved:
+          resolved.append(address)
+    return resolved
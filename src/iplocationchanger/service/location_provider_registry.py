@@ -0,0 +1,227 @@
+from __future__ import annotations
+from collections import Counter
+from typing import Callable, Optional
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+from iplocationchanger.utils.token_bucket import TokenBucket
+from iplocationchanger.exception.iplocationchanger_exception import IPLocationChangerException
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+
+logger = logging.getLogger(__name__)
+
+class LocationProviderRegistry:
+  """Geolocation providers with per-provider rate limits and latency scores.
+  Providers have a `name` and a `locate()` returning (IP, country). Requests
+  go to the providers with budget left in their token bucket, lowest
+  exponentially weighted latency first; providers never asked yet go first.
+  A failing provider is skipped for a cooldown doubling from `min_cooldown`
+  to `max_cooldown` seconds with every consecutive failure, which also
+  covers providers answering that their quota is exhausted.
+  `locate` returns once `quorum` providers agree on the country.
+  Sample usage:
+    registry = LocationProviderRegistry(quorum=2)
+    registry.register(HTTPLocationProvider.from_preset('ipinfo'), *parse_rate('50000/d'))
+    registry.register(HTTPLocationProvider.from_preset('ip-api'), *parse_rate('45/min'))
+    registry.limit('whatismyip', *parse_rate('1000/d'))
+    registry.locate() # ('203.0.113.7', 'TR')
+  """
+  def __init__(
+    self: LocationProviderRegistry,
+    quorum: int = 1,
+    alpha: float = 0.3,
+    min_cooldown: float = 1,
+    max_cooldown: float = 300,
+    clock: Callable[[], float] = time.monotonic,
+  ) -> None:
+    if quorum < 1:
+      raise ValueError('quorum must be at least 1')
+    self.quorum = quorum
+    self.alpha = alpha
+    self.min_cooldown = min_cooldown
+    self.max_cooldown = max_cooldown
+    self.clock = clock
+    self.providers: dict = {}
+    self.buckets: dict[str, TokenBucket] = {}
+    self.latency: dict[str, float] = {}
+    self.failures: dict[str, int] = {}
+    self.cooldown_until: dict[str, float] = {}
+    self.lock = threading.Lock()
+
+  def __contains__(self: LocationProviderRegistry, name: str) -> bool:
+    return name in self.providers
+
+  def __len__(self: LocationProviderRegistry) -> int:
+    return len(self.providers)
+
+  def limit(
+    self: LocationProviderRegistry,
+    name: str,
+    rate: float,
+    burst: float = 1,
+  ) -> None:
+    """Allow provider `name`, registered or not yet, `rate` requests per
+    second in bursts of `burst`.
+    """
+    self.buckets[name] = TokenBucket(rate, burst, clock=self.clock)
+
+  def register(
+    self: LocationProviderRegistry,
+    provider,
+    rate: Optional[float] = None,
+    burst: float = 1,
+  ) -> None:
+    """Add `provider`, without rate limit unless `rate` is given."""
+    self.providers[provider.name] = provider
+    if rate is not None:
+      self.limit(provider.name, rate, burst)
+
+  def available(
+    self: LocationProviderRegistry,
+    name: str,
+  ) -> bool:
+    if self.cooldown_until.get(name, 0) > self.clock():
+      return False
+    bucket = self.buckets.get(name)
+    return bucket is None or bucket.available() >= 1
+
+  def schedule(self: LocationProviderRegistry) -> list:
+    """Providers with budget left, most promising first."""
+    with self.lock:
+      names = [name for name in self.providers if self.available(name)]
+      names.sort(key=lambda name: self.latency.get(name, 0))
+      return [self.providers[name] for name in names]
+
+  def acquire(
+    self: LocationProviderRegistry,
+    name: str,
+  ) -> bool:
+    bucket = self.buckets.get(name)
+    return bucket is None or bucket.try_acquire()
+
+  def observe(
+    self: LocationProviderRegistry,
+    name: str,
+    elapsed: float,
+  ) -> None:
+    with self.lock:
+      previous = self.latency.get(name)
+      if previous is None:
+        self.latency[name] = elapsed
+      else:
+        self.latency[name] = self.alpha * elapsed + (1 - self.alpha) * previous
+      self.failures[name] = 0
+      self.cooldown_until.pop(name, None)
+
+  def fail(
+    self: LocationProviderRegistry,
+    name: str,
+    error: Exception,
+  ) -> None:
+    with self.lock:
+      failures = self.failures.get(name, 0) + 1
+      self.failures[name] = failures
+      cooldown = min(self.min_cooldown * 2 ** (failures - 1), self.max_cooldown)
+      self.cooldown_until[name] = self.clock() + cooldown
+    logger.debug(f'{name} failed ({error}), skipped for {cooldown}s')
+
+  def call(
+    self: LocationProviderRegistry,
+    provider,
+  ) -> tuple[str, str]:
+    """Locate with `provider`, recording its latency or failure."""
+    start = self.clock()
+    try:
+      ip, country = provider.locate()
+    except IPLocationChangerException as e:
+      self.fail(provider.name, e)
+      raise
+    self.observe(provider.name, self.clock() - start)
+    return ip, country
+
+  def agreed(
+    self: LocationProviderRegistry,
+    answers: list[tuple[str, str]],
+  ) -> Optional[tuple[str, str]]:
+    """The answer of the country named by at least `quorum` of `answers`."""
+    countries = Counter(country.upper().strip() for _, country in answers)
+    for ip, country in answers:
+      if countries[country.upper().strip()] >= self.quorum:
+        return ip, country
+    return None
+
+  def missing(
+    self: LocationProviderRegistry,
+    answers: list[tuple[str, str]],
+  ) -> int:
+    """How many more answers a quorum needs at least."""
+    countries = Counter(country.upper().strip() for _, country in answers)
+    return self.quorum - max(countries.values(), default=0)
+
+  def no_answer(
+    self: LocationProviderRegistry,
+    answers: list[tuple[str, str]],
+  ) -> LocationProviderException:
+    if len(answers) == 0:
+      return LocationProviderException('No location provider answered')
+    seen = ', '.join(sorted(set(country for _, country in answers)))
+    return LocationProviderException(f'No {self.quorum} location providers agreed, got {seen}')
+
+  def locate(self: LocationProviderRegistry) -> tuple[str, str]:
+    """Ask providers in schedule order, as many at a time as are still
+    missing for a quorum, until `quorum` of them agree on the country.
+    """
+    queue = self.schedule()
+    answers = []
+    last_error = None
+    with ThreadPoolExecutor(max_workers=self.quorum) as executor:
+      running = set()
+      while True:
+        agreed = self.agreed(answers)
+        if agreed is not None:
+          return agreed
+        while len(running) < self.missing(answers) and len(queue) > 0:
+          provider = queue.pop(0)
+          if self.acquire(provider.name):
+            running.add(executor.submit(self.call, provider))
+        if len(running) == 0:
+          raise self.no_answer(answers) from last_error
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          try:
+            answers.append(future.result())
+          except IPLocationChangerException as e:
+            last_error = e
+
+  def race(self: LocationProviderRegistry) -> tuple[str, str]:
+    """Ask every provider with budget left at once and return the first
+    successful answer.
+    """
+    providers = [p for p in self.schedule() if self.acquire(p.name)]
+    if len(providers) == 0:
+      raise self.no_answer([])
+    executor = ThreadPoolExecutor(max_workers=len(providers))
+    futures = {executor.submit(self.call, provider): provider for provider in providers}
+    last_error = None
+    try:
+      pending = set(futures)
+      while len(pending) > 0:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          try:
+            ip, country = future.result()
+          except IPLocationChangerException as e:
+            last_error = e
+            continue
+          logger.debug(f'{futures[future].name} answered first')
+          return ip, country
+    finally:
+      # slower providers finish in the background
+      executor.shutdown(wait=False, cancel_futures=True)
+    raise self.no_answer([]) from last_error
@@ -0,0 +1,286 @@
+from __future__ import annotations
+from collections import deque
+from typing import Optional
+
+import logging
+import socket
+import time
+
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+logger = logging.getLogger(__name__)
+
+# States reported by openvpn which mean the tunnel will never come up
+TERMINAL_STATES = ('EXITING',)
+# states reached once the TLS handshake and authentication are done
+AUTHENTICATED_STATES = ('GET_CONFIG', 'ASSIGN_IP', 'ADD_ROUTES', 'CONNECTED')
+
+def check_state(
+  fields: list[str],
+  state: str,
+) -> bool:
+  """Whether the state `fields` reported by openvpn match `state`.
+  Raises if openvpn reached a state it will not recover from.
+  """
+  if len(fields) < 2:
+    return False
+  if fields[1] == state:
+    return True
+  if fields[1] in TERMINAL_STATES:
+    raise OpenVPNServiceException(f'openvpn is {fields[1]}: {",".join(fields[2:])}')
+  return False
+
+def note_state(
+  state_times: dict[str, float],
+  fields: list[str],
+) -> None:
+  """Record when the state in `fields` was first seen."""
+  if len(fields) > 1:
+    state_times.setdefault(fields[1], time.monotonic())
+
+def state_fields(notification: str) -> Optional[list[str]]:
+  if notification.startswith('>STATE:'):
+    return notification[len('>STATE:'):].split(',')
+  return None
+
+def check_notification(
+  notification: str,
+  state: str,
+) -> Optional[list[str]]:
+  """Return the state fields if `notification` reports `state`, None otherwise.
+  Raises on notifications meaning the tunnel will not come up.
+  """
+  fields = state_fields(notification)
+  if fields is not None:
+    if check_state(fields, state):
+      return fields
+  elif notification.startswith('>FATAL:'):
+    raise OpenVPNServiceException(f'openvpn failed: {notification[len(">FATAL:"):]}')
+  elif notification.startswith('>PASSWORD:Verification Failed'):
+    raise OpenVPNServiceException('openvpn authentication failed')
+  return None
+
+def password_request(notification: str) -> Optional[str]:
+  """The kind of password `notification` asks for, e.g. 'Auth', None if
+  it is no password request.
+  """
+  # >PASSWORD:Need 'Auth' username/password
+  prefix = ">PASSWORD:Need '"
+  if not notification.startswith(prefix):
+    return None
+  return notification[len(prefix):].split("'", 1)[0]
+
+def password_commands(
+  kind: str,
+  credentials: Optional[OpenVPNCredentials],
+) -> list[str]:
+  if kind != 'Auth' or credentials is None:
+    raise OpenVPNServiceException(f"openvpn asks for the '{kind}' password, which was not given")
+  return credentials.commands(kind)
+
+class OpenVPNManagementClient:
+  """Minimal client for the openvpn management interface
+  (https://openvpn.net/community-resources/management-interface/).
+  `credentials` answer the password requests of an openvpn started with
+  `--management-query-passwords` while waiting for a state.
+  Sample usage:
+    with OpenVPNManagementClient('127.0.0.1', 7505) as omc:
+      omc.open(timeout=10)
+      omc.wait_for_state('CONNECTED', timeout=30)
+  """
+  POLL_INTERVAL = 0.1
+
+  def __init__(
+    self: OpenVPNManagementClient,
+    host: str,
+    port: int,
+    credentials: Optional[OpenVPNCredentials] = None,
+  ) -> None:
+    self.host = host
+    self.port = port
+    self.credentials = credentials
+    self.sock = None
+    self.buffer = b''
+    self.notifications = deque()
+    # state -> monotonic time it was first seen
+    self.state_times: dict[str, float] = {}
+
+  def __enter__(self: OpenVPNManagementClient) -> OpenVPNManagementClient:
+    return self
+
+  def __exit__(self: OpenVPNManagementClient, *_) -> None:
+    self.close()
+
+  def open(
+    self: OpenVPNManagementClient,
+    timeout: float,
+  ) -> None:
+    """Connect to the management interface, retrying until `timeout` elapses
+    since openvpn only starts listening some time after it is spawned.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+      remaining = deadline - time.monotonic()
+      try:
+        self.sock = socket.create_connection(
+          (self.host, self.port),
+          timeout=max(remaining, self.POLL_INTERVAL),
+        )
+        logger.debug(f'connected to management interface {self.host}:{self.port}')
+        return
+      except OSError as e:
+        if remaining <= 0:
+          raise OpenVPNServiceException(
+            f'Could not reach management interface {self.host}:{self.port}'
+          ) from e
+        time.sleep(min(self.POLL_INTERVAL, remaining))
+
+  def close(self: OpenVPNManagementClient) -> None:
+    if self.sock is not None:
+      self.sock.close()
+      self.sock = None
+    self.buffer = b''
+
+  def read_line(
+    self: OpenVPNManagementClient,
+    deadline: float,
+  ) -> str:
+    while b'\n' not in self.buffer:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        raise OpenVPNServiceException('Timed out waiting for management interface')
+      self.sock.settimeout(remaining)
+      try:
+        chunk = self.sock.recv(4096)
+      except socket.timeout as e:
+        raise OpenVPNServiceException('Timed out waiting for management interface') from e
+      except OSError as e:
+        # openvpn exited or reset the connection
+        raise OpenVPNServiceException('Lost the connection to the management interface') from e
+      if not chunk:
+        raise OpenVPNServiceException('Management interface closed the connection')
+      self.buffer += chunk
+
+    line, self.buffer = self.buffer.split(b'\n', 1)
+    line = line.decode('utf-8').rstrip('\r')
+    logger.debug(f'MGMT: {line}')
+    return line
+
+  def send_command(
+    self: OpenVPNManagementClient,
+    command: str,
+    multiline: bool = False,
+    timeout: float = 5,
+  ) -> list[str]:
+    """Send `command` and return its response lines.
+    Real-time notifications (lines starting with '>') received meanwhile are
+    queued in `self.notifications`.
+    """
+    if self.sock is None:
+      raise OpenVPNServiceException('Management interface is not connected')
+    deadline = time.monotonic() + timeout
+    try:
+      self.sock.sendall(f'{command}\n'.encode('utf-8'))
+    except OSError as e:
+      raise OpenVPNServiceException('Lost the connection to the management interface') from e
+
+    lines = []
+    while True:
+      line = self.read_line(deadline)
+      if line.startswith('>'):
+        self.notifications.append(line)
+        continue
+      if line.startswith('ERROR:'):
+        raise OpenVPNServiceException(f'Management command "{command}" failed: {line}')
+      if not multiline:
+        return [line]
+      if line == 'END':
+        return lines
+      lines.append(line)
+
+  def current_state(
+    self: OpenVPNManagementClient,
+    timeout: float = 5,
+  ) -> list[str]:
+    """The state fields openvpn currently reports."""
+    lines = self.send_command('state', multiline=True, timeout=timeout)
+    if len(lines) == 0:
+      raise OpenVPNServiceException('openvpn reported no state')
+    return lines[-1].split(',')
+
+  def load_stats(
+    self: OpenVPNManagementClient,
+    timeout: float = 5,
+  ) -> tuple[int, int]:
+    """Return (bytes in, bytes out) of the tunnel."""
+    # SUCCESS: nclients=0,bytesin=1234,bytesout=5678
+    line = self.send_command('load-stats', timeout=timeout)[0]
+    stats = dict(
+      pair.split('=', 1) for pair in line.split(':', 1)[-1].strip().split(',') if '=' in pair
+    )
+    try:
+      return int(stats['bytesin']), int(stats['bytesout'])
+    except (KeyError, ValueError) as e:
+      raise OpenVPNServiceException(f'Unexpected load-stats response: {line}') from e
+
+  def answer_password(
+    self: OpenVPNManagementClient,
+    notification: str,
+    deadline: float,
+  ) -> bool:
+    """Send the credentials if `notification` asks for them."""
+    kind = password_request(notification)
+    if kind is None:
+      return False
+    for command in password_commands(kind, self.credentials):
+      try:
+        self.send_command(command, timeout=max(deadline - time.monotonic(), 0))
+      except OpenVPNServiceException:
+        # the command holds the password, keep it out of the message
+        raise OpenVPNServiceException(f"openvpn did not take the '{kind}' credentials") from None
+    logger.debug(f"answered the '{kind}' password request")
+    return True
+
+  def next_notification(
+    self: OpenVPNManagementClient,
+    deadline: float,
+  ) -> str:
+    if len(self.notifications) > 0:
+      return self.notifications.popleft()
+    while True:
+      line = self.read_line(deadline)
+      if line.startswith('>'):
+        return line
+
+  def wait_for_state(
+    self: OpenVPNManagementClient,
+    state: str = 'CONNECTED',
+    timeout: float = 30,
+  ) -> list[str]:
+    """Block until openvpn reports `state` and return the state fields
+    (timestamp, state, description, local ip, remote ip, ...).
+    """
+    deadline = time.monotonic() + timeout
+    if self.sock is None:
+      self.open(timeout)
+    # enable notifications first so a transition is not missed between commands
+    self.send_command('state on', timeout=max(deadline - time.monotonic(), 0))
+    for line in self.send_command(
+      'state',
+      multiline=True,
+      timeout=max(deadline - time.monotonic(), 0),
+    ):
+      fields = line.split(',')
+      note_state(self.state_times, fields)
+      if check_state(fields, state):
+        return fields
+
+    while True:
+      notification = self.next_notification(deadline)
+      if self.answer_password(notification, deadline):
+        continue
+      note_state(self.state_times, state_fields(notification) or [])
+      fields = check_notification(notification, state)
+      if fields is not None:
+        return fields
@@ -1,10 +1,21 @@
 from __future__ import annotations
 from tempfile import TemporaryDirectory
+from typing import Callable, Optional
 
 import logging
 import os
+import time
 
 from iplocationchanger.utils.utils import Utils
+from iplocationchanger.utils.process_runner import ProcessRunner
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.service.openvpn_management_client import OpenVPNManagementClient
+from iplocationchanger.service.openvpn_management_client import AUTHENTICATED_STATES
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
+from iplocationchanger.exception.config_catalogue_service_exception import ConfigCatalogueServiceException
 from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
 
 logger = logging.getLogger(__name__)
@@ -18,46 +29,277 @@ class OpenVPNService:
     config_to_country: dict,
     openvpn_executable_path: str,
     credentials_path: str='',
+    management_host: str='127.0.0.1',
+    management_port: int=7505,
+    dev: str='',
+    route_noexec: bool=False,
+    metrics: Optional[Metrics]=None,
+    foreground: bool=False,
+    credentials: Optional[OpenVPNCredentials]=None,
   ):
+    """With `foreground`, openvpn is not daemonized but kept as a child
+    process whose log is read as it is written: logged at debug level and
+    passed to the callbacks added with `add_log_listener`.
+    `credentials` are given to openvpn on the management interface when it
+    asks for them, instead of reading an auth file at `credentials_path`.
+    """
     self.config_to_country = config_to_country
 
     self.has_credentials = False
     if len(credentials_path) > 0:
       self.credentials_path = credentials_path
       self.has_credentials = True
+    self.credentials = credentials
 
     self.openvpn_executable_path = openvpn_executable_path
     self.daemon_name = 'openvpn_iplocationchanger'
+    self.management_host = management_host
+    self.management_port = management_port
+    self.td = TemporaryDirectory()
+    self.pid_path = f'{self.td.name}/openvpn.pid'
+    self.pid = None
+    # tun device and whether openvpn leaves routing to the caller
+    self.dev = dev
+    self.route_noexec = route_noexec
+    self.remote_ip = ''
+    # state -> monotonic time it was first seen while waiting for the tunnel
+    self.state_times: dict[str, float] = {}
+    self.metrics = metrics if metrics is not None else Metrics()
+    self.foreground = foreground
+    self.process: Optional[ProcessRunner] = None
+    self.log_listeners: list[Callable[[str], None]] = []
 
-  def disconnect(self: OpenVPNService) -> None:
-    cmd = ['sudo', 'killall', 'openvpn']
-    _, stdout, stderr = Utils.run_proc(cmd, expect_error=True)
-    logger.debug(f'STDOUT: {stdout}')
-    if stderr != '':
-      logger.error(f'STDERR: {stderr}')
+  def __del__(self: OpenVPNService) -> None:
+    self.td.cleanup()
 
-  def connect(self: OpenVPNService, country: str) -> None:
-    try:
-      config_path = self.config_to_country[country]
-    except KeyError as e:
-      logger.debug(e)
-      raise OpenVPNServiceException(f'Could not find config for {country}')
+  def disconnect(
+    self: OpenVPNService,
+    timeout: float = 5,
+  ) -> float:
+    """Terminate the openvpn daemon started by `connect` (SIGTERM, then
+    SIGKILL after `timeout` seconds) and return the teardown time in seconds.
+    Other openvpn processes on the host are left alone.
+    """
+    if self.pid is None and self.process is None:
+      logger.debug('no openvpn daemon to disconnect')
+      return 0.0
+    pid, self.pid = self.pid, None
+    process, self.process = self.process, None
+    self.remote_ip = ''
+    elapsed = Utils.terminate_pid(pid, timeout) if pid is not None else 0.0
+    if process is not None:
+      start = time.monotonic()
+      # sudo exits with openvpn; without a pid openvpn is stopped through sudo
+      result = process.wait(timeout) if pid is not None else process.cancel(timeout)
+      elapsed += time.monotonic() - start
+      logger.debug(f'openvpn {result.describe()}')
+    self.metrics.observe_phase('disconnect', elapsed)
+    logger.debug(f'openvpn {pid} exited after {elapsed:.3f}s')
+    return elapsed
+
+  def connect_cmd(
+    self: OpenVPNService,
+    country: str,
+    config_path: str = '',
+    remotes: Optional[list[OpenVPNRemote]] = None,
+  ) -> list[str]:
+    """Build the openvpn command for `config_path`, or for the first config
+    of `country` if no path is given. `remotes` are tried before the ones
+    of the config.
+    """
+    if len(config_path) == 0:
+      configs = config_paths(self.config_to_country, country)
+      if len(configs) == 0:
+        raise OpenVPNServiceException(f'Could not find config for {country}')
+      config_path = configs[0]
+    if isinstance(self.config_to_country, ConfigCatalogueService):
+      # fail before spawning if the config broke since it was loaded
+      try:
+        self.config_to_country.config(config_path)
+      except ConfigCatalogueServiceException as e:
+        raise OpenVPNServiceException(str(e)) from e
 
     cmd = [
       'sudo', self.openvpn_executable_path,
       '--auth-retry', 'nointeract',
+    ]
+    # the connection list is built in order, ahead of the config's remotes
+    for remote in remotes or []:
+      cmd.extend(['--remote', remote.host, str(remote.port), remote.proto])
+    cmd.extend([
       '--config', config_path,
       '--script-security', '2',
-      '--daemon', self.daemon_name,
-    ]
-    if self.has_credentials:
+    ])
+    if not self.foreground:
+      cmd.extend(['--daemon', self.daemon_name])
+    cmd.extend([
+      '--writepid', self.pid_path,
+      '--management', self.management_host, str(self.management_port),
+    ])
+    if len(self.dev) > 0:
+      cmd.extend(['--dev', self.dev])
+    if self.route_noexec:
+      cmd.append('--route-noexec')
+    if self.credentials is not None:
+      # answered in wait_until_connected
+      cmd.extend(['--management-query-passwords', '--auth-user-pass'])
+    elif self.has_credentials:
       cmd.extend(['--auth-user-pass', self.credentials_path])
+    return cmd
 
+  def connect(
+    self: OpenVPNService,
+    country: str,
+    config_path: str = '',
+    remotes: Optional[list[OpenVPNRemote]] = None,
+  ) -> None:
+    cmd = self.connect_cmd(country, config_path, remotes)
     logger.debug(f'CMD: {" ".join(cmd)}')
-    success, stdout, stderr =  Utils.run_proc(cmd)
+    self.clear_pid_file()
+    if self.foreground:
+      self.spawn_foreground(country, cmd)
+      return
+    with self.metrics.phase('spawn'):
+      success, stdout, stderr =  Utils.run_proc(cmd)
+
+      logger.debug(f'STDOUT: {stdout}')
+      if not success:
+        logger.error(f'STDERR: {stderr}')
+        raise OpenVPNServiceException(f'Could not connect to {country}')
+      self.read_pid(country)
+
+  def spawn_foreground(
+    self: OpenVPNService,
+    country: str,
+    cmd: list[str],
+    timeout: float = 5,
+  ) -> None:
+    with self.metrics.phase('spawn'):
+      try:
+        self.process = ProcessRunner(cmd, on_line=self.on_log_line).start()
+      except OSError as e:
+        raise OpenVPNServiceException(f'Could not connect to {country}') from e
+      deadline = time.monotonic() + timeout
+      while self.pid is None:
+        try:
+          self.pid = Utils.read_pid(self.pid_path)
+        except (OSError, ValueError):
+          pass
+        if self.pid is not None:
+          break
+        if not self.process.running():
+          # e.g. an invalid option or config, its last words say which
+          result = self.process.wait()
+          self.process = None
+          last_line = (result.stderr or result.stdout).strip().rsplit('\n', 1)[-1]
+          raise OpenVPNServiceException(f'Could not connect to {country}: openvpn {result.describe()}: {last_line}')
+        if time.monotonic() > deadline:
+          self.disconnect()
+          raise OpenVPNServiceException(f'Could not connect to {country}: openvpn wrote no pid')
+        time.sleep(0.05)
+    logger.debug(f'openvpn pid: {self.pid}')
+
+  def add_log_listener(
+    self: OpenVPNService,
+    listener: Callable[[str], None],
+  ) -> None:
+    """Call `listener(line)` for each log line of a foreground openvpn."""
+    self.log_listeners.append(listener)
 
-    logger.debug(f'STDOUT: {stdout}')
-    if not success:
-      logger.error(f'STDERR: {stderr}')
-      raise OpenVPNServiceException(f'Could not connect to {country}')
-  
\ No newline at end of file
+  def on_log_line(
+    self: OpenVPNService,
+    stream: str,
+    line: str,
+  ) -> None:
+    if 'AUTH_FAILED' in line:
+      logger.error(f'openvpn: {line}')
+    else:
+      logger.debug(f'openvpn: {line}')
+    for listener in self.log_listeners:
+      try:
+        listener(line)
+      except Exception as e:
+        logger.exception(e)
+
+  def clear_pid_file(self: OpenVPNService) -> None:
+    # openvpn leaves its pid file behind, which must not be mistaken for
+    # the pid of the next daemon
+    try:
+      os.remove(self.pid_path)
+    except FileNotFoundError:
+      pass
+
+  def read_pid(
+    self: OpenVPNService,
+    country: str,
+    timeout: float = 5,
+  ) -> None:
+    # openvpn writes its pid file right after daemonizing
+    self.pid = Utils.wait_for_pid_file(self.pid_path, timeout)
+    if self.pid is None:
+      raise OpenVPNServiceException(f'Could not connect to {country}: openvpn wrote no pid')
+    logger.debug(f'openvpn pid: {self.pid}')
+
+  def wait_until_connected(
+    self: OpenVPNService,
+    timeout: float,
+  ) -> list[str]:
+    """Block until openvpn reports the CONNECTED state on its management
+    interface (i.e. "Initialization Sequence Completed") or `timeout` elapses,
+    answering its request for the credentials on the way.
+    Returns the reported state fields.
+    """
+    start = time.monotonic()
+    with OpenVPNManagementClient(
+      self.management_host,
+      self.management_port,
+      credentials=self.credentials,
+    ) as omc:
+      try:
+        fields = omc.wait_for_state('CONNECTED', timeout)
+      finally:
+        self.state_times = omc.state_times
+        self.observe_tunnel_phases(start)
+    logger.debug(f'openvpn state: {",".join(fields)}')
+    if len(fields) > 4:
+      self.remote_ip = fields[4]
+    return fields
+
+  def tunnel_stats(
+    self: OpenVPNService,
+    timeout: float = 2,
+  ) -> tuple[str, int, int]:
+    """Return (state, bytes in, bytes out) as reported on the management
+    interface, e.g. ('CONNECTED', 1234, 5678).
+    """
+    with OpenVPNManagementClient(
+      self.management_host,
+      self.management_port,
+    ) as omc:
+      omc.open(timeout)
+      fields = omc.current_state(timeout)
+      bytes_in, bytes_out = omc.load_stats(timeout)
+    return fields[1] if len(fields) > 1 else '', bytes_in, bytes_out
+
+  def authenticated_at(self: OpenVPNService) -> Optional[float]:
+    """Monotonic time openvpn was first seen past the TLS handshake and
+    authentication during the last `wait_until_connected`, None if never.
+    """
+    times = [self.state_times[s] for s in AUTHENTICATED_STATES if s in self.state_times]
+    return min(times) if len(times) > 0 else None
+
+  def observe_tunnel_phases(
+    self: OpenVPNService,
+    start: float,
+  ) -> None:
+    """Split the wait for the tunnel which began at `start` into the
+    handshake (TLS and authentication) and tunnel_up phases.
+    """
+    end = time.monotonic()
+    authenticated = self.authenticated_at()
+    if authenticated is None:
+      self.metrics.observe_phase('handshake', end - start)
+      return
+    authenticated = max(authenticated, start)
+    self.metrics.observe_phase('handshake', authenticated - start)
+    self.metrics.observe_phase('tunnel_up', end - authenticated)
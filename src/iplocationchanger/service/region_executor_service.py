@@ -0,0 +1,276 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, NamedTuple, Optional
+
+import logging
+import pickle
+import subprocess
+import sys
+import threading
+import time
+
+from iplocationchanger.exception.region_executor_service_exception import RegionExecutorServiceException
+from iplocationchanger.exception.tunnel_pool_service_exception import TunnelPoolServiceException
+
+logger = logging.getLogger(__name__)
+
+def worker_main() -> None:
+  """Loop of a worker process: unpickle (fn, args, kwargs) from stdin, run
+  it and pickle ('ok', result) or ('error', exception) to stdout.
+  """
+  jobs = sys.stdin.buffer
+  results = sys.stdout.buffer
+  # output of the jobs must not end up in the result stream
+  sys.stdout = sys.stderr
+  while True:
+    try:
+      fn, args, kwargs = pickle.load(jobs)
+    except EOFError:
+      return
+    try:
+      outcome = ('ok', fn(*args, **kwargs))
+    except Exception as e:
+      outcome = ('error', e)
+    try:
+      data = pickle.dumps(outcome)
+    except Exception as e:
+      data = pickle.dumps(('error', RegionExecutorServiceException(f'Could not pickle {outcome[1]!r}: {e}')))
+    results.write(data)
+    results.flush()
+
+
+class Job(NamedTuple):
+  future: Future
+  fn: Callable
+  args: tuple
+  kwargs: dict
+
+
+class RegionWorker:
+  """A python process inside a tunnel's network namespace running the jobs
+  sent to it one at a time.
+  """
+  def __init__(
+    self: RegionWorker,
+    tunnel,
+  ) -> None:
+    self.tunnel = tunnel
+    self.broken = False
+    bootstrap = (
+      f'import sys; sys.path[:0] = {[p for p in sys.path if p]!r}; '
+      'from iplocationchanger.service.region_executor_service import worker_main; worker_main()'
+    )
+    self.proc = subprocess.Popen(
+      tunnel.netns_cmd([sys.executable, '-c', bootstrap]),
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+    )
+
+  def alive(self: RegionWorker) -> bool:
+    return not self.broken and self.proc.poll() is None
+
+  def call(
+    self: RegionWorker,
+    fn: Callable,
+    args: tuple,
+    kwargs: dict,
+  ) -> Any:
+    try:
+      self.proc.stdin.write(pickle.dumps((fn, args, kwargs)))
+      self.proc.stdin.flush()
+      status, value = pickle.load(self.proc.stdout)
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+      self.broken = True
+      raise RegionExecutorServiceException(f'Worker in {self.tunnel.country} died') from e
+    if status == 'error':
+      raise value
+    return value
+
+  def stop(
+    self: RegionWorker,
+    timeout: float = 5,
+  ) -> None:
+    try:
+      self.proc.stdin.close()
+    except OSError:
+      pass
+    try:
+      self.proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+      self.proc.kill()
+      self.proc.wait()
+    self.proc.stdout.close()
+
+
+class RegionExecutorService:
+  """Executor running each job in a worker process inside the network
+  namespace of a tunnel to the job's country, so jobs for different
+  countries run in parallel. Up to `max_workers` countries have a tunnel
+  and a worker at a time; a worker keeps its tunnel across consecutive jobs
+  of its country and only moves on to a waiting country once its own
+  queue is empty, or after `batch` jobs in a row while others wait.
+  Tunnels idle for `idle_timeout` seconds are closed.
+  Jobs and their results are pickled, so `fn` must be importable (module
+  level). Uses TunnelPoolService; Linux only.
+  Sample usage:
+    with RegionExecutorService(TunnelPoolService(config_to_country, 'openvpn'), max_workers=4) as executor:
+      futures = [executor.submit(country, fetch_prices, url) for country in countries]
+      prices = [future.result() for future in futures]
+  """
+  def __init__(
+    self: RegionExecutorService,
+    pool,
+    max_workers: int = 4,
+    connect_timeout: float = 30,
+    batch: int = 16,
+    idle_timeout: float = 300,
+  ) -> None:
+    self.pool = pool
+    self.max_workers = max_workers
+    self.connect_timeout = connect_timeout
+    self.batch = batch
+    self.idle_timeout = idle_timeout
+    self.condition = threading.Condition()
+    # country -> jobs waiting for it, countries in order of their first job
+    self.queues: dict[str, deque[Job]] = {}
+    # country -> thread serving it
+    self.lanes: dict[str, threading.Thread] = {}
+    self.closed = False
+
+  def __enter__(self: RegionExecutorService) -> RegionExecutorService:
+    return self
+
+  def __exit__(self: RegionExecutorService, exc_type, exc, tb) -> None:
+    self.shutdown()
+
+  def submit(
+    self: RegionExecutorService,
+    country: str,
+    fn: Callable,
+    *args,
+    **kwargs,
+  ) -> Future:
+    """Run `fn(*args, **kwargs)` from `country`; returns its Future."""
+    future = Future()
+    with self.condition:
+      if self.closed:
+        raise RegionExecutorServiceException('Cannot submit after shutdown')
+      self.queues.setdefault(country, deque()).append(Job(future, fn, args, kwargs))
+      self.fill()
+      self.condition.notify_all()
+    return future
+
+  def shutdown(
+    self: RegionExecutorService,
+    wait: bool = True,
+    cancel_futures: bool = False,
+  ) -> None:
+    """Stop taking jobs and close every tunnel once the queued jobs ran."""
+    with self.condition:
+      self.closed = True
+      if cancel_futures:
+        for queue in self.queues.values():
+          for job in queue:
+            job.future.cancel()
+        self.queues = {}
+      self.condition.notify_all()
+      lanes = list(self.lanes.values())
+    if wait:
+      for lane in lanes:
+        lane.join()
+
+  def waiting(self: RegionExecutorService) -> list[str]:
+    """Countries with queued jobs and no worker, most jobs first."""
+    countries = [c for c, queue in self.queues.items() if len(queue) > 0 and c not in self.lanes]
+    return sorted(countries, key=lambda c: len(self.queues[c]), reverse=True)
+
+  def fill(
+    self: RegionExecutorService,
+    released: str = '',
+  ) -> None:
+    """Start workers for waiting countries while there are free slots;
+    `released` just gave its slot up and goes after the others.
+    """
+    # called with the condition held
+    waiting = sorted(self.waiting(), key=lambda c: c == released)
+    for country in waiting[:self.max_workers - len(self.lanes)]:
+      lane = threading.Thread(target=self.run_lane, args=(country,), daemon=True)
+      self.lanes[country] = lane
+      lane.start()
+
+  def next_job(
+    self: RegionExecutorService,
+    country: str,
+    streak: int,
+  ) -> Optional[Job]:
+    """Next job of `country`, None once the lane should give up its slot."""
+    idle_since = time.monotonic()
+    with self.condition:
+      while True:
+        queue = self.queues.get(country)
+        others_waiting = len(self.waiting()) > 0
+        if queue and not (others_waiting and streak >= self.batch):
+          return queue.popleft()
+        if self.closed or others_waiting:
+          return None
+        remaining = self.idle_timeout - (time.monotonic() - idle_since)
+        if remaining <= 0:
+          logger.debug(f'{country} idle for {self.idle_timeout}s')
+          return None
+        self.condition.wait(remaining)
+
+  def run_lane(
+    self: RegionExecutorService,
+    country: str,
+  ) -> None:
+    worker = None
+    streak = 0
+    try:
+      while True:
+        job = self.next_job(country, streak)
+        if job is None:
+          break
+        if not job.future.set_running_or_notify_cancel():
+          continue
+        streak += 1
+        if worker is None or not worker.alive():
+          if worker is not None:
+            worker.stop()
+          try:
+            worker = self.start_worker(country)
+          except RegionExecutorServiceException as e:
+            # the slot goes to the other countries before trying again
+            job.future.set_exception(e)
+            break
+        try:
+          result = worker.call(job.fn, job.args, job.kwargs)
+        except Exception as e:
+          job.future.set_exception(e)
+        else:
+          job.future.set_result(result)
+    finally:
+      if worker is not None:
+        worker.stop()
+      self.pool.close(country)
+      with self.condition:
+        del self.lanes[country]
+        if len(self.queues.get(country, ())) == 0:
+          self.queues.pop(country, None)
+        self.fill(released=country)
+        self.condition.notify_all()
+      logger.debug(f'released the worker of {country} after {streak} jobs')
+
+  def start_worker(
+    self: RegionExecutorService,
+    country: str,
+  ) -> RegionWorker:
+    try:
+      tunnel = self.pool.open(country, self.connect_timeout)
+    except TunnelPoolServiceException as e:
+      raise RegionExecutorServiceException(f'Could not connect to {country}') from e
+    logger.debug(f'starting a worker in {tunnel.namespace} for {country}')
+    try:
+      return RegionWorker(tunnel)
+    except OSError as e:
+      raise RegionExecutorServiceException(f'Could not start a worker for {country}') from e
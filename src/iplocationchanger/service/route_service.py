@@ -0,0 +1,80 @@
+from __future__ import annotations
+from typing import Optional
+
+import logging
+import subprocess
+
+from iplocationchanger.utils.utils import Utils
+from iplocationchanger.exception.route_service_exception import RouteServiceException
+
+logger = logging.getLogger(__name__)
+
+# two halves of the address space: more specific than, and so preferred over,
+# the physical default route which stays in place for the tunnel endpoints
+SPLIT_DEFAULT_ROUTES = ('0.0.0.0/1', '128.0.0.0/1')
+
+class RouteService:
+  """Point the host's default route at a tun device (Linux only).
+  Used with openvpn's --route-noexec so that switching between tunnels is a
+  route replacement rather than a teardown and reconnect.
+  """
+  def __init__(self: RouteService) -> None:
+    self.gateway: Optional[tuple[str, str]] = None
+
+  def run(
+    self: RouteService,
+    cmd: list[str],
+  ) -> str:
+    try:
+      _, stdout, _ = Utils.run_proc(cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
+      raise RouteServiceException(f'Could not run {" ".join(cmd)}') from e
+    return stdout
+
+  def default_gateway(self: RouteService) -> tuple[str, str]:
+    """Return (gateway ip, device) of the physical default route."""
+    if self.gateway is None:
+      fields = self.run(['ip', 'route', 'show', 'default']).split()
+      try:
+        self.gateway = (
+          fields[fields.index('via') + 1],
+          fields[fields.index('dev') + 1],
+        )
+      except (ValueError, IndexError) as e:
+        raise RouteServiceException('Could not find the default gateway') from e
+      logger.debug(f'default gateway: {self.gateway}')
+    return self.gateway
+
+  def route_through(
+    self: RouteService,
+    dev: str,
+    remote_ip: str,
+  ) -> None:
+    """Send all traffic through `dev`, keeping the tunnel endpoint `remote_ip`
+    reachable over the physical gateway. Each replacement is atomic, so
+    traffic moves from the previous device without a gap.
+    """
+    self.pin(remote_ip)
+    for prefix in SPLIT_DEFAULT_ROUTES:
+      self.run(['sudo', 'ip', 'route', 'replace', prefix, 'dev', dev])
+    logger.debug(f'routing through {dev}')
+
+  def pin(
+    self: RouteService,
+    remote_ip: str,
+  ) -> None:
+    """Route `remote_ip` over the physical gateway, whichever device
+    carries the default route.
+    """
+    gateway, gateway_dev = self.default_gateway()
+    self.run(['sudo', 'ip', 'route', 'replace', f'{remote_ip}/32', 'via', gateway, 'dev', gateway_dev])
+
+  def unpin(
+    self: RouteService,
+    remote_ip: str,
+  ) -> None:
+    Utils.run_proc(['sudo', 'ip', 'route', 'del', f'{remote_ip}/32'], expect_error=True)
+
+  def clear(self: RouteService) -> None:
+    for prefix in SPLIT_DEFAULT_ROUTES:
+      Utils.run_proc(['sudo', 'ip', 'route', 'del', prefix], expect_error=True)
@@ -0,0 +1,167 @@
+from __future__ import annotations
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional
+
+import logging
+import time
+
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+
+logger = logging.getLogger(__name__)
+
+class SweepResult(NamedTuple):
+  country: str
+  ok: bool
+  # what the task returned, None if it did not run to completion
+  result: Any
+  # '' if ok
+  error: str
+  attempts: int
+  # seconds spent in the last attempt; preparation overlaps the previous task
+  prepare_seconds: float
+  connect_seconds: float
+  task_seconds: float
+
+
+class SweepReport(NamedTuple):
+  # country -> result of its last attempt, in the order given
+  results: dict[str, SweepResult]
+  seconds: float
+
+  def failed(self: SweepReport) -> list[str]:
+    return [country for country, result in self.results.items() if not result.ok]
+
+
+class SweepService:
+  """Connect to each of a list of countries in turn and run a task there.
+  With the 'probe' strategy, the servers of the next country are probed in
+  the background while the task of the current one runs, so the switch
+  does not wait for them. Countries which failed to connect or whose task
+  raised are retried once every country had its turn.
+  Probes made while a tunnel is up go through that tunnel.
+  Sample usage:
+    sweep = SweepService(lcs)
+    report = sweep.run(['TR', 'DE', 'AR'], lambda country: requests.get('https://example.com').status_code)
+    report.results['TR'].result
+  """
+  def __init__(
+    self: SweepService,
+    lcs,
+    connect_timeout: float = 30,
+    retries: int = 1,
+  ) -> None:
+    self.lcs = lcs
+    self.connect_timeout = connect_timeout
+    self.retries = retries
+
+  @property
+  def config_to_country(self: SweepService) -> dict:
+    return self.lcs.selector.config_to_country
+
+  def prepare(
+    self: SweepService,
+    country: str,
+  ) -> bool:
+    """Probe the servers of `country` ahead of the switch, if there is a
+    choice of configs to rank. Returns whether they were probed. Failures
+    are only logged, the switch probes again.
+    """
+    if self.lcs.prober is None or len(config_paths(self.config_to_country, country)) < 2:
+      return False
+    try:
+      self.lcs.prober.probe([country])
+    except Exception as e:
+      logger.warning(f'Could not probe the servers of {country}: {e!r}')
+      return False
+    return True
+
+  def run(
+    self: SweepService,
+    countries: list[str],
+    task: Callable[[str], Any],
+  ) -> SweepReport:
+    """Run `task(country)` connected to each of `countries` and disconnect
+    at the end. Never raises for a single country; see `SweepReport.failed`.
+    """
+    start = time.monotonic()
+    results: dict[str, SweepResult] = {country: None for country in countries}
+    attempts = {country: 0 for country in countries}
+    pending = list(results)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='sweep-prepare') as executor:
+      try:
+        for sweep_round in range(self.retries + 1):
+          if len(pending) == 0:
+            break
+          if sweep_round > 0:
+            logger.info(f'retrying {", ".join(pending)}')
+          for country, result in self.sweep(executor, pending, task, attempts):
+            results[country] = result
+          pending = [country for country in pending if not results[country].ok]
+      finally:
+        try:
+          self.lcs.disconnect_region()
+        except LocationChangerServiceException as e:
+          # leased by other callers, who still use it
+          logger.warning(f'Leaving the tunnel up: {e}')
+    report = SweepReport(results, time.monotonic() - start)
+    logger.info(
+      f'sweep of {len(countries)} countries done in {report.seconds:.3f}s, '
+      f'{len(report.failed())} failed'
+    )
+    return report
+
+  def sweep(
+    self: SweepService,
+    executor: ThreadPoolExecutor,
+    countries: list[str],
+    task: Callable[[str], Any],
+    attempts: dict[str, int],
+  ):
+    def timed_prepare(country: str) -> tuple[bool, float]:
+      prepare_start = time.monotonic()
+      probed = self.prepare(country)
+      return probed, time.monotonic() - prepare_start
+
+    upcoming: Optional[Future] = executor.submit(timed_prepare, countries[0]) if len(countries) > 0 else None
+    for i, country in enumerate(countries):
+      attempts[country] += 1
+      try:
+        probed, prepare_seconds = upcoming.result()
+      except Exception as e:
+        logger.warning(f'Could not prepare {country}: {e!r}')
+        probed, prepare_seconds = False, 0.0
+
+      connect_start = time.monotonic()
+      try:
+        self.lcs.connect_region(country, self.connect_timeout, probe=not probed)
+      except Exception as e:
+        # like a failing task, whatever breaks the switch only fails this country
+        connect_seconds = time.monotonic() - connect_start
+        logger.error(f'{country}: {e!r}')
+        if isinstance(e, LocationChangerServiceException):
+          error = f'{e}: {e.__cause__}' if e.__cause__ is not None else str(e)
+        else:
+          error = repr(e)
+        upcoming = executor.submit(timed_prepare, countries[i + 1]) if i + 1 < len(countries) else None
+        yield country, SweepResult(country, False, None, error, attempts[country], prepare_seconds, connect_seconds, 0.0)
+        continue
+      connect_seconds = time.monotonic() - connect_start
+
+      # the next country is prepared while the task runs
+      upcoming = executor.submit(timed_prepare, countries[i + 1]) if i + 1 < len(countries) else None
+      task_start = time.monotonic()
+      try:
+        result = task(country)
+      except Exception as e:
+        logger.error(f'{country}: task failed: {e!r}')
+        yield country, SweepResult(
+          country, False, None, repr(e), attempts[country],
+          prepare_seconds, connect_seconds, time.monotonic() - task_start,
+        )
+        continue
+      yield country, SweepResult(
+        country, True, result, '', attempts[country],
+        prepare_seconds, connect_seconds, time.monotonic() - task_start,
+      )
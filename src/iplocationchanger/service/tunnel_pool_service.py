@@ -0,0 +1,263 @@
+from __future__ import annotations
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from typing import Optional
+
+import logging
+import os
+import subprocess
+import threading
+
+from iplocationchanger.model.tunnel import Tunnel
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.utils.utils import Utils
+from iplocationchanger.service.openvpn_management_client import OpenVPNManagementClient
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.exception.tunnel_pool_service_exception import TunnelPoolServiceException
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+logger = logging.getLogger(__name__)
+
+class TunnelPoolService:
+  """Run one openvpn per region, each inside its own network namespace, so
+  several regions can be used at the same time from a single host.
+  Linux only; requires passwordless sudo for `ip`, `iptables`, `sysctl`,
+  `kill` and `openvpn`.
+  Sample usage:
+    tps = TunnelPoolService({'TR': '/assets/tr.ovpn', 'AR': '/assets/ar.ovpn'}, 'openvpn')
+    try:
+      tunnels = tps.open_many(['TR', 'AR'])
+      tunnels['TR'].run(['curl', 'https://example.com'])
+    finally:
+      tps.close_all()
+  """
+  MAX_TUNNELS = 255
+
+  def __init__(
+    self: TunnelPoolService,
+    config_to_country: dict,
+    openvpn_executable_path: str,
+    credentials_path: str = '',
+    management_port: int = 7505,
+    namespace_prefix: str = 'ilc',
+    credentials: Optional[OpenVPNCredentials] = None,
+  ) -> None:
+    self.config_to_country = config_to_country
+    self.openvpn_executable_path = openvpn_executable_path
+    self.credentials_path = credentials_path
+    self.credentials = credentials
+    self.management_port = management_port
+    self.namespace_prefix = namespace_prefix
+    self.td = TemporaryDirectory()
+    self.lock = threading.Lock()
+    # connected tunnels, and tunnels still being set up which concurrent
+    # callers of `open` wait for
+    self.tunnels: dict[str, Tunnel] = {}
+    self.opening: dict[str, Future] = {}
+    self.free_indices = list(range(self.MAX_TUNNELS))
+
+  def __del__(self: TunnelPoolService) -> None:
+    self.td.cleanup()
+
+  def get(
+    self: TunnelPoolService,
+    country: str,
+  ) -> Tunnel:
+    try:
+      return self.tunnels[country]
+    except KeyError:
+      raise TunnelPoolServiceException(f'No open tunnel for {country}')
+
+  def open(
+    self: TunnelPoolService,
+    country: str,
+    timeout: float = 30,
+  ) -> Tunnel:
+    """Bring up a tunnel to `country` in a fresh namespace and block until
+    openvpn reports CONNECTED. Returns the already open tunnel if there is
+    one, and waits for it if another caller is opening it.
+    """
+    with self.lock:
+      if country in self.tunnels:
+        return self.tunnels[country]
+      opening = self.opening.get(country)
+      if opening is None:
+        tunnel = self.reserve(country)
+        opening = self.opening[country] = Future()
+      else:
+        tunnel = None
+    if tunnel is None:
+      # raises the connection error of the caller setting it up
+      return opening.result()
+
+    try:
+      self.connect(tunnel, timeout)
+    except BaseException as e:
+      # whatever went wrong, callers waiting for the tunnel must not hang
+      with self.lock:
+        del self.opening[country]
+      opening.set_exception(e)
+      raise
+    with self.lock:
+      self.tunnels[country] = tunnel
+      del self.opening[country]
+    opening.set_result(tunnel)
+    logger.debug(f'opened {tunnel}')
+    return tunnel
+
+  def reserve(
+    self: TunnelPoolService,
+    country: str,
+  ) -> Tunnel:
+    # called with the lock held
+    configs = config_paths(self.config_to_country, country)
+    if len(configs) == 0:
+      raise TunnelPoolServiceException(f'Could not find config for {country}')
+    if len(self.free_indices) == 0:
+      raise TunnelPoolServiceException('Too many open tunnels')
+    index = self.free_indices.pop(0)
+    return Tunnel(
+      country,
+      index,
+      f'{self.namespace_prefix}{index}',
+      configs[0],
+      os.path.join(self.td.name, f'openvpn{index}.pid'),
+    )
+
+  def connect(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+    timeout: float,
+  ) -> None:
+    """Set `tunnel` up and wait for CONNECTED, tearing it down on failure."""
+    try:
+      self.setup_namespace(tunnel)
+      self.spawn_openvpn(tunnel)
+      with OpenVPNManagementClient(tunnel.ns_ip, self.management_port, self.credentials) as omc:
+        omc.wait_for_state('CONNECTED', timeout)
+    except (TunnelPoolServiceException, OpenVPNServiceException) as e:
+      self.teardown(tunnel)
+      raise TunnelPoolServiceException(f'Could not connect to {tunnel.country}') from e
+    except BaseException:
+      self.teardown(tunnel)
+      raise
+
+  def open_many(
+    self: TunnelPoolService,
+    countries: list[str],
+    timeout: float = 30,
+  ) -> dict[str, Tunnel]:
+    """Open tunnels to all `countries` concurrently."""
+    with ThreadPoolExecutor(max_workers=max(len(countries), 1)) as executor:
+      futures = {
+        country: executor.submit(self.open, country, timeout)
+        for country in countries
+      }
+    return {country: future.result() for country, future in futures.items()}
+
+  def close(
+    self: TunnelPoolService,
+    country: str,
+  ) -> None:
+    with self.lock:
+      tunnel = self.tunnels.pop(country, None)
+    if tunnel is not None:
+      self.teardown(tunnel)
+
+  def teardown(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+  ) -> None:
+    try:
+      if tunnel.pid is not None:
+        elapsed = Utils.terminate_pid(tunnel.pid)
+        logger.debug(f'openvpn {tunnel.pid} exited after {elapsed:.3f}s')
+      for cmd in self.teardown_cmds(tunnel):
+        Utils.run_proc(cmd, expect_error=True)
+    finally:
+      with self.lock:
+        self.free_indices.append(tunnel.index)
+    logger.debug(f'closed {tunnel}')
+
+  def close_all(self: TunnelPoolService) -> None:
+    for country in list(self.tunnels):
+      self.close(country)
+
+  def setup_cmds(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+  ) -> list[list[str]]:
+    ns_exec = ['sudo', 'ip', 'netns', 'exec', tunnel.namespace]
+    return [
+      ['sudo', 'ip', 'netns', 'add', tunnel.namespace],
+      ['sudo', 'ip', 'link', 'add', tunnel.host_veth, 'type', 'veth', 'peer', 'name', tunnel.ns_veth],
+      ['sudo', 'ip', 'link', 'set', tunnel.ns_veth, 'netns', tunnel.namespace],
+      ['sudo', 'ip', 'addr', 'add', f'{tunnel.host_ip}/30', 'dev', tunnel.host_veth],
+      ['sudo', 'ip', 'link', 'set', tunnel.host_veth, 'up'],
+      ns_exec + ['ip', 'link', 'set', 'lo', 'up'],
+      ns_exec + ['ip', 'addr', 'add', f'{tunnel.ns_ip}/30', 'dev', tunnel.ns_veth],
+      ns_exec + ['ip', 'link', 'set', tunnel.ns_veth, 'up'],
+      ns_exec + ['ip', 'route', 'add', 'default', 'via', tunnel.host_ip],
+      ['sudo', 'sysctl', '-q', '-w', 'net.ipv4.ip_forward=1'],
+      ['sudo', 'iptables', '-t', 'nat', '-A', 'POSTROUTING', '-s', tunnel.subnet, '-j', 'MASQUERADE'],
+    ]
+
+  def teardown_cmds(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+  ) -> list[list[str]]:
+    if not tunnel.namespace_created:
+      return []
+    return [
+      ['sudo', 'iptables', '-t', 'nat', '-D', 'POSTROUTING', '-s', tunnel.subnet, '-j', 'MASQUERADE'],
+      # removing the namespace also removes the veth pair
+      ['sudo', 'ip', 'netns', 'delete', tunnel.namespace],
+    ]
+
+  def setup_namespace(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+  ) -> None:
+    for cmd in self.setup_cmds(tunnel):
+      try:
+        Utils.run_proc(cmd)
+      except (OSError, subprocess.CalledProcessError) as e:
+        raise TunnelPoolServiceException(f'Could not set up namespace {tunnel.namespace}') from e
+      # the first command adds the namespace
+      tunnel.namespace_created = True
+
+  def connect_cmd(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+  ) -> list[str]:
+    cmd = tunnel.netns_cmd([
+      self.openvpn_executable_path,
+      '--auth-retry', 'nointeract',
+      '--config', tunnel.config_path,
+      '--script-security', '2',
+      '--daemon', f'openvpn_iplocationchanger_{tunnel.namespace}',
+      '--writepid', tunnel.pid_path,
+      # listen on the namespace side of the veth link so the host can reach it
+      '--management', tunnel.ns_ip, str(self.management_port),
+    ], user='root')
+    if self.credentials is not None:
+      cmd.extend(['--management-query-passwords', '--auth-user-pass'])
+    elif len(self.credentials_path) > 0:
+      cmd.extend(['--auth-user-pass', self.credentials_path])
+    return cmd
+
+  def spawn_openvpn(
+    self: TunnelPoolService,
+    tunnel: Tunnel,
+    pid_timeout: float = 5,
+  ) -> None:
+    try:
+      Utils.run_proc(self.connect_cmd(tunnel))
+    except (OSError, subprocess.CalledProcessError) as e:
+      raise TunnelPoolServiceException(f'Could not start openvpn in {tunnel.namespace}') from e
+
+    # openvpn writes its pid file right after daemonizing
+    tunnel.pid = Utils.wait_for_pid_file(tunnel.pid_path, pid_timeout)
+    if tunnel.pid is None:
+      raise TunnelPoolServiceException(f'openvpn in {tunnel.namespace} wrote no pid')
@@ -1,52 +1,253 @@
 from __future__ import annotations
+from typing import Optional, Protocol
 
 import logging
-import requests
 import json
+import time
 
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.exception.iplocationchanger_exception import IPLocationChangerException
 from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
 
 logger = logging.getLogger(__name__)
 
+# 'two-step': get_ip then get_location_from_ip
+# 'single': one lookup of the caller's own address, two-step where unsupported
+# 'race': every registered provider with budget left, first answer wins
+# 'scheduled': registered providers in schedule order until a quorum agrees
+VALIDATIONS = ('two-step', 'single', 'race', 'scheduled')
+
+# answers to a lookup without input from an API which does not support it
+UNSUPPORTED_LOOKUP_ERRORS = ('No input', 'Invalid input')
+
+class LocationBackend(Protocol):
+  def get_location_from_ip(self, ip: str) -> str: ...
+
+class LocationProvider(Protocol):
+  name: str
+  def locate(self) -> tuple[str, str]: ...
+
 class WhatIsMyIPService:
+  """Find the exit IP and its country with the WhatIsMyIP API.
+  `validation` picks how the connection is validated, see VALIDATIONS.
+  The service registers itself in `registry`, along with `providers`
+  (e.g. HTTPLocationProvider), which 'race' and 'scheduled' ask.
+  Sample usage:
+    wms = WhatIsMyIPService('whatismyip_api_key')
+    wms.locate() # ('203.0.113.7', 'TR')
+    wms.validate_connection('TR')
+  """
+  name = 'whatismyip'
+
   def __init__(
     self: WhatIsMyIPService,
     api_key: str,
+    base_url: str = 'https://api.whatismyip.com',
+    pool_size: int = 4,
+    timeout: float = 10,
+    max_retries: int = 3,
+    backoff_factor: float = 0.5,
+    location_cache: Optional[TTLCache] = None,
+    location_backend: Optional[LocationBackend] = None,
+    metrics: Optional[Metrics] = None,
+    validation: str = 'single',
+    providers: Optional[list[LocationProvider]] = None,
+    registry: Optional[LocationProviderRegistry] = None,
   ) -> None:
     if len(api_key) <= 0:
       raise Exception('Invalid API Key')
+    if validation not in VALIDATIONS:
+      raise ValueError(f'Unknown validation {validation}, expected one of {", ".join(VALIDATIONS)}')
     self.api_key = api_key
+    self.base_url = base_url.rstrip('/')
+    self.pool_size = pool_size
+    self.timeout = timeout
+    self.max_retries = max_retries
+    self.backoff_factor = backoff_factor
+    self.location_cache = location_cache
+    self.location_backend = location_backend
+    self.metrics = metrics if metrics is not None else Metrics()
+    self.validation = validation
+    # (ip, country) seen by the last validate_connection, '' where unknown
+    self.last_location = ('', '')
+    self.registry = registry if registry is not None else LocationProviderRegistry()
+    if self.name not in self.registry:
+      self.registry.register(self)
+    for provider in providers if providers is not None else []:
+      self.registry.register(provider)
+    # cleared once the API turns a lookup without input down
+    self.single_lookup = True
+    # built on the first request, requests takes longer to import than
+    # the rest of the package
+    self.session = None
+
+  def build_session(self: WhatIsMyIPService) -> requests.Session:
+    """Build a keep-alive session which retries 5xx responses with backoff."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+      total=self.max_retries,
+      backoff_factor=self.backoff_factor,
+      status_forcelist=(500, 502, 503, 504),
+      allowed_methods=frozenset(['GET']),
+      raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+      pool_connections=self.pool_size,
+      pool_maxsize=self.pool_size,
+      max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+  def get_session(self: WhatIsMyIPService) -> requests.Session:
+    if self.session is None:
+      self.session = self.build_session()
+    return self.session
+
+  def reset_session(self: WhatIsMyIPService) -> None:
+    """Drop pooled connections, e.g. after the tunnel changed and sockets
+    bound to the previous route must not be reused.
+    """
+    logger.debug('resetting HTTP session')
+    if self.session is not None:
+      self.session.close()
+      self.session = None
+    for provider in self.registry.providers.values():
+      if provider is not self and hasattr(provider, 'reset_session'):
+        provider.reset_session()
 
   def get_ip(self: WhatIsMyIPService) -> tuple[bool, str]:
     res_body = self.request('ip')
+    return self.parse_ip(res_body)
+
+  def parse_ip(
+    self: WhatIsMyIPService,
+    res_body: dict,
+  ) -> str:
     try:
       ip = res_body['ip_address']
       logger.debug(f'IP: {ip}')
       return ip
     except KeyError as e:
       raise WhatIsMyIPServiceException('Could not get IP address') from e
-    
 
   def get_location_from_ip(
     self: WhatIsMyIPService, 
     ip: str,
   ) -> tuple[bool, str]:
+    location = self.known_location(ip)
+    if location is not None:
+      return location
+
     res_body = self.request('ip-address-lookup', {'input': ip})
+    return self.parse_location(ip, res_body)
+
+  def known_location(
+    self: WhatIsMyIPService,
+    ip: str,
+  ) -> Optional[str]:
+    """Resolve `ip` without calling the API, from the location backend or the
+    lookup cache. Returns None if the API has to be asked.
+    """
+    if self.location_backend is not None:
+      # local lookups are cheap, only the public IP discovery hits the API
+      try:
+        return self.location_backend.get_location_from_ip(ip)
+      except IPLocationChangerException as e:
+        raise WhatIsMyIPServiceException(f'Could not locate {ip}') from e
+
+    if self.location_cache is not None:
+      location = self.location_cache.get(ip)
+      if location is not None:
+        logger.debug(f'Location (cached): {location}')
+        return location
+    return None
+
+  def parse_location(
+    self: WhatIsMyIPService,
+    ip: str,
+    res_body: dict,
+  ) -> str:
     try:
       location = res_body['ip_address_lookup'][0]['country']
       logger.debug(f'Location: {location}')
-      return location
     except KeyError as e:
       raise WhatIsMyIPServiceException('n') from e
 
+    if self.location_cache is not None:
+      self.location_cache.set(ip, location)
+    return location
+
+  def parse_lookup(
+    self: WhatIsMyIPService,
+    res_body: dict,
+  ) -> tuple[str, str]:
+    try:
+      lookup = res_body['ip_address_lookup'][0]
+      ip, location = lookup['ip'], lookup['country']
+      logger.debug(f'IP: {ip}, location: {location}')
+    except (KeyError, IndexError, TypeError) as e:
+      raise WhatIsMyIPServiceException('Could not get IP address and location') from e
+
+    if self.location_cache is not None:
+      self.location_cache.set(ip, location)
+    return ip, location
+
+  def use_single_lookup(self: WhatIsMyIPService) -> bool:
+    # with a local backend the IP discovery is the only API call anyway
+    return self.single_lookup and self.location_backend is None
+
+  def locate(self: WhatIsMyIPService) -> tuple[str, str]:
+    """Return (IP, country) of the caller with a single lookup without
+    input, or get_ip and get_location_from_ip where that is not supported.
+    """
+    if self.use_single_lookup():
+      try:
+        return self.parse_lookup(self.request('ip-address-lookup'))
+      except WhatIsMyIPServiceException as e:
+        # rate limits and connection errors are no reason to give up on it
+        if str(e) not in UNSUPPORTED_LOOKUP_ERRORS and not isinstance(e.__cause__, (LookupError, TypeError)):
+          raise
+        logger.info(f'Lookup without input not supported ({e}), using two requests')
+        self.single_lookup = False
+    ip = self.get_ip()
+    return ip, self.get_location_from_ip(ip)
+
+  def current_location(self: WhatIsMyIPService) -> tuple[str, str]:
+    """Return (IP, country) of the caller following `self.validation`."""
+    if self.validation == 'two-step':
+      with self.metrics.phase('get_ip'):
+        ip = self.get_ip()
+      with self.metrics.phase('get_location_from_ip'):
+        return ip, self.get_location_from_ip(ip)
+    with self.metrics.phase('locate'):
+      if self.validation == 'single':
+        return self.locate()
+      try:
+        if self.validation == 'race':
+          return self.registry.race()
+        return self.registry.locate()
+      except LocationProviderException as e:
+        raise WhatIsMyIPServiceException(str(e)) from e
+
   def validate_connection(
     self: WhatIsMyIPService, 
     country_code: str
-  ) -> None:
-    ip = self.get_ip()
-    location = self.get_location_from_ip(ip)
+  ) -> str:
+    """Check the exit location is `country_code`, returning the exit IP."""
+    self.last_location = ('', '')
+    ip, location = self.current_location()
+    self.last_location = (ip, location)
     if (location.lower().strip() == country_code.lower().strip()):
-      return
+      return ip
     raise WhatIsMyIPServiceException(f'{country_code} not {location}')
   
   def request(
@@ -54,21 +255,80 @@ class WhatIsMyIPService:
     path: str,
     other_params: dict[str, str] = {},
   ) -> dict:
-    url = f'https://api.whatismyip.com/{path}.php'
+    import requests
+
+    url, params = self.request_args(path, other_params)
+    session = self.get_session()
+
+    for attempt in range(self.max_retries + 1):
+      try:
+        res = session.get(url, params=params, timeout=self.timeout)
+      except requests.exceptions.RequestException as e:
+        self.metrics.api_calls.inc(endpoint=path, outcome='connection_error')
+        raise WhatIsMyIPServiceException(f'Could not complete request "{path}".') from e
+      if res.status_code < 200 or res.status_code > 299:
+        self.metrics.api_calls.inc(endpoint=path, outcome='http_error')
+        logger.debug(f'Status code: {res.status_code}')
+        logger.debug(f'Response: {res.content.decode("utf-8")}')
+        raise WhatIsMyIPServiceException(f'Could not complete request "{path}".')
+
+      res_body = res.content.decode('utf-8')
+      logger.debug(f'Response raw: {res_body}')
+      self.count_api_call(path, res_body)
+      delay = self.rate_limit_delay(res_body, attempt)
+      if delay is None:
+        break
+      time.sleep(delay)
+    return self.parse_response(res_body)
+
+  def request_args(
+    self: WhatIsMyIPService,
+    path: str,
+    other_params: dict[str, str],
+  ) -> tuple[str, dict[str, str]]:
+    url = f'{self.base_url}/{path}.php'
     params = {
       'key': self.api_key,
       'output': 'json',
     }
     params.update(other_params)
+    return url, params
+
+  def count_api_call(
+    self: WhatIsMyIPService,
+    path: str,
+    res_body: str,
+  ) -> None:
+    stripped = res_body.strip()
+    if stripped == '3':
+      outcome = 'rate_limited'
+    elif len(stripped) == 1 and stripped.isdigit():
+      outcome = 'api_error'
+    else:
+      outcome = 'ok'
+    self.metrics.api_calls.inc(endpoint=path, outcome=outcome)
 
-    res = requests.get(url, params=params)
-    if res.status_code < 200 or res.status_code > 299:
-      logger.debug(f'Status code: {res.status_code}')
-      logger.debug(f'Response: {res.content.decode("utf-8")}')
-      raise WhatIsMyIPServiceException(f'Could not complete request "{path}".')
-    
-    res_body = res.content.decode('utf-8')
-    logger.debug(f'Response raw: {res_body}')
+  def rate_limit_delay(
+    self: WhatIsMyIPService,
+    res_body: str,
+    attempt: int,
+  ) -> Optional[float]:
+    """Seconds to back off before retrying a '3' (too many lookups) response,
+    or None if the response should not be retried.
+    """
+    if res_body.strip() != '3' or attempt >= self.max_retries:
+      return None
+    if self.validation in ('race', 'scheduled') and len(self.registry) > 1:
+      # another provider answers rather than waiting for the quota
+      return None
+    delay = self.backoff_factor * (2 ** attempt)
+    logger.debug(f'Too many lookups, retrying in {delay}s')
+    return delay
+
+  def parse_response(
+    self: WhatIsMyIPService,
+    res_body: str,
+  ) -> dict:
     self.check_request_error(res_body)
 
     try:
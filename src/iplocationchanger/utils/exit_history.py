@@ -0,0 +1,232 @@
+from __future__ import annotations
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# a located exit IP in another country than the one asked for; config maps
+# may spell countries in any case
+WRONG_COUNTRY = "v.location != '' AND UPPER(TRIM(v.location)) != UPPER(TRIM(v.country))"
+
+class Validation(NamedTuple):
+  ts: float
+  config: str
+  # country asked for
+  country: str
+  # exit IP and the country it was located in, '' if the lookup failed
+  ip: str
+  location: str
+  ok: bool
+  # seconds the tunnel took to come up, None if unknown
+  latency: Optional[float]
+
+
+class ConfigStats(NamedTuple):
+  config: str
+  attempts: int
+  successes: int
+  # validations answered with another country than the one asked for
+  wrong_country: int
+  mean_latency: Optional[float]
+
+  @property
+  def success_rate(self: ConfigStats) -> float:
+    return self.successes / self.attempts if self.attempts > 0 else 0.0
+
+  @property
+  def wrong_rate(self: ConfigStats) -> float:
+    return self.wrong_country / self.attempts if self.attempts > 0 else 0.0
+
+
+class ExitIP(NamedTuple):
+  ip: str
+  seen: int
+  wrong_country: int
+  last_seen: float
+
+
+class ExitHistory:
+  """Append-only log of exit location validations in SQLite, queried in
+  place so it can grow to millions of rows. Config paths are stored once
+  and referenced by id; rows are indexed by config and time.
+  As a ranker it orders configs by their (smoothed) success rate, so
+  configs with a record of wrong exit countries are tried last.
+  Sample usage:
+    history = ExitHistory('/var/lib/iplocationchanger/history.db')
+    history.record('/assets/tr1.ovpn', 'TR', '203.0.113.7', 'TR', True, latency=2.4)
+    history.stats()['/assets/tr1.ovpn'].success_rate
+    history.flagged()       # configs whose IPs geolocate elsewhere too often
+  """
+  def __init__(
+    self: ExitHistory,
+    path: str,
+    min_attempts: int = 5,
+    max_wrong_rate: float = 0.2,
+    clock: Callable[[], float] = time.time,
+  ) -> None:
+    self.path = path
+    self.min_attempts = min_attempts
+    self.max_wrong_rate = max_wrong_rate
+    self.clock = clock
+    self.lock = threading.Lock()
+    self.config_ids: dict[str, int] = {}
+    self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    with self.conn:
+      self.conn.execute('PRAGMA journal_mode=WAL')
+      self.conn.execute(
+        'CREATE TABLE IF NOT EXISTS configs ('
+        ' id INTEGER PRIMARY KEY,'
+        ' path TEXT NOT NULL UNIQUE'
+        ')'
+      )
+      self.conn.execute(
+        'CREATE TABLE IF NOT EXISTS validations ('
+        ' ts REAL NOT NULL,'
+        ' config_id INTEGER NOT NULL REFERENCES configs (id),'
+        ' country TEXT NOT NULL,'
+        ' ip TEXT NOT NULL,'
+        ' location TEXT NOT NULL,'
+        ' ok INTEGER NOT NULL,'
+        ' latency REAL'
+        ')'
+      )
+      self.conn.execute(
+        'CREATE INDEX IF NOT EXISTS validations_config_ts ON validations (config_id, ts)'
+      )
+      self.conn.execute('CREATE INDEX IF NOT EXISTS validations_ts ON validations (ts)')
+
+  def config_id(
+    self: ExitHistory,
+    config: str,
+  ) -> int:
+    # caller must hold self.lock; the id is cached by the caller once the
+    # transaction adding the row committed
+    if config in self.config_ids:
+      return self.config_ids[config]
+    self.conn.execute('INSERT OR IGNORE INTO configs (path) VALUES (?)', (config,))
+    return self.conn.execute('SELECT id FROM configs WHERE path = ?', (config,)).fetchone()[0]
+
+  def record(
+    self: ExitHistory,
+    config: str,
+    country: str,
+    ip: str,
+    location: str,
+    ok: bool,
+    latency: Optional[float] = None,
+  ) -> None:
+    with self.lock:
+      with self.conn:
+        config_id = self.config_id(config)
+        self.conn.execute(
+          'INSERT INTO validations (ts, config_id, country, ip, location, ok, latency)'
+          ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+          (self.clock(), config_id, country, ip, location, int(ok), latency),
+        )
+      self.config_ids[config] = config_id
+
+  def stats(
+    self: ExitHistory,
+    configs: Optional[list[str]] = None,
+    since: float = 0,
+  ) -> dict[str, ConfigStats]:
+    """Per config counts of the validations since `since` (all by default)."""
+    query = (
+      'SELECT c.path, COUNT(*), SUM(v.ok),'
+      f' SUM({WRONG_COUNTRY}), AVG(v.latency)'
+      ' FROM validations v JOIN configs c ON c.id = v.config_id'
+      ' WHERE v.ts >= ?'
+    )
+    params: list = [since]
+    if configs is not None:
+      if len(configs) == 0:
+        return {}
+      query += f' AND c.path IN ({", ".join("?" * len(configs))})'
+      params += configs
+    query += ' GROUP BY v.config_id'
+    with self.lock:
+      rows = self.conn.execute(query, params).fetchall()
+    return {row[0]: ConfigStats(*row) for row in rows}
+
+  def flagged(
+    self: ExitHistory,
+    configs: Optional[list[str]] = None,
+    since: float = 0,
+  ) -> list[str]:
+    """Configs validated at least `min_attempts` times whose exit IPs were
+    located in another country more often than `max_wrong_rate`.
+    """
+    return sorted(
+      s.config for s in self.stats(configs, since).values()
+      if s.attempts >= self.min_attempts and s.wrong_rate > self.max_wrong_rate
+    )
+
+  def exit_ips(
+    self: ExitHistory,
+    config: str,
+    limit: int = 100,
+  ) -> list[ExitIP]:
+    """Exit IPs `config` produced, most recently seen first."""
+    with self.lock:
+      rows = self.conn.execute(
+        f'SELECT v.ip, COUNT(*), SUM({WRONG_COUNTRY}), MAX(v.ts)'
+        ' FROM validations v JOIN configs c ON c.id = v.config_id'
+        " WHERE c.path = ? AND v.ip != ''"
+        ' GROUP BY v.ip ORDER BY MAX(v.ts) DESC LIMIT ?',
+        (config, limit),
+      ).fetchall()
+    return [ExitIP(*row) for row in rows]
+
+  def rows(
+    self: ExitHistory,
+    config: Optional[str] = None,
+    since: float = 0,
+  ) -> Iterator[Validation]:
+    """Stream the validations since `since` in time order, one at a time."""
+    query = (
+      'SELECT v.ts, c.path, v.country, v.ip, v.location, v.ok, v.latency'
+      ' FROM validations v JOIN configs c ON c.id = v.config_id'
+      ' WHERE v.ts >= ?'
+    )
+    params: list = [since]
+    if config is not None:
+      query += ' AND c.path = ?'
+      params.append(config)
+    query += ' ORDER BY v.ts'
+    # a connection of its own, so writers are not held up while iterating
+    conn = sqlite3.connect(self.path, timeout=5)
+    try:
+      for ts, path, country, ip, location, ok, latency in conn.execute(query, params):
+        yield Validation(ts, path, country, ip, location, bool(ok), latency)
+    finally:
+      conn.close()
+
+  def rank(
+    self: ExitHistory,
+    configs: list[str],
+  ) -> list[str]:
+    """Order `configs` by success rate, flagged configs last. Rates are
+    smoothed so configs without history sit between good and bad ones.
+    """
+    stats = self.stats(configs)
+    flagged = set(self.flagged(configs))
+    def key(config: str) -> tuple[bool, float]:
+      s = stats.get(config)
+      rate = 0.5 if s is None else (s.successes + 1) / (s.attempts + 2)
+      return (config in flagged, -rate)
+    return sorted(configs, key=key)
+
+  def prune(
+    self: ExitHistory,
+    before: float,
+  ) -> int:
+    with self.lock, self.conn:
+      cur = self.conn.execute('DELETE FROM validations WHERE ts < ?', (before,))
+    return cur.rowcount
+
+  def close(self: ExitHistory) -> None:
+    self.conn.close()
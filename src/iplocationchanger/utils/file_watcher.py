@@ -0,0 +1,191 @@
+from __future__ import annotations
+from typing import Callable, Optional
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) event masks
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+# editors and config management replace files by renaming, so the parent
+# directories are watched rather than the files
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+def load_inotify():
+  """libc with the inotify calls, None where there is no inotify."""
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+  except (OSError, AttributeError):
+    return None
+  return libc
+
+def file_signature(path: str) -> Optional[tuple[int, int, int]]:
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class FileWatcher:
+  """Call `callback` with the set of changed paths whenever files in `paths`
+  are written, replaced or removed. Uses inotify on Linux and polls every
+  `interval` seconds elsewhere; changes within `debounce` seconds of each
+  other are reported together.
+  Sample usage:
+    watcher = FileWatcher(['/assets/configmap.json'], lambda changed: print(changed))
+    watcher.start()
+    ...
+    watcher.stop()
+  """
+  def __init__(
+    self: FileWatcher,
+    paths: list[str],
+    callback: Callable[[set[str]], None],
+    interval: float = 2,
+    debounce: float = 0.2,
+    use_inotify: bool = True,
+  ) -> None:
+    self.callback = callback
+    self.interval = interval
+    self.debounce = debounce
+    self.libc = load_inotify() if use_inotify else None
+    self.fd: Optional[int] = None
+    self.watches: dict[int, str] = {}
+    self.paths: set[str] = set()
+    self.signatures: dict[str, Optional[tuple[int, int, int]]] = {}
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.thread: Optional[threading.Thread] = None
+    if self.libc is not None:
+      fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+      if fd < 0:
+        logger.warning(f'inotify unavailable ({os.strerror(ctypes.get_errno())}), polling instead')
+        self.libc = None
+      else:
+        self.fd = fd
+    self.set_paths(paths)
+
+  @property
+  def mode(self: FileWatcher) -> str:
+    return 'inotify' if self.fd is not None else 'polling'
+
+  def set_paths(
+    self: FileWatcher,
+    paths: list[str],
+  ) -> None:
+    """Watch `paths` from now on."""
+    with self.lock:
+      self.paths = {os.path.abspath(path) for path in paths}
+      self.signatures = {path: file_signature(path) for path in self.paths}
+      if self.fd is None:
+        return
+      watched = set(self.watches.values())
+      for directory in {os.path.dirname(path) for path in self.paths} - watched:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+          logger.warning(f'Could not watch {directory}: {os.strerror(ctypes.get_errno())}')
+          continue
+        self.watches[wd] = directory
+
+  def start(self: FileWatcher) -> None:
+    self.stopped.clear()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(
+    self: FileWatcher,
+    timeout: float = 5,
+  ) -> None:
+    self.stopped.set()
+    if self.thread is not None:
+      self.thread.join(timeout)
+      self.thread = None
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+      self.watches = {}
+
+  def run(self: FileWatcher) -> None:
+    while not self.stopped.is_set():
+      changed = self.wait_inotify() if self.fd is not None else self.wait_polling()
+      if len(changed) == 0:
+        continue
+      logger.debug(f'changed: {", ".join(sorted(changed))}')
+      try:
+        self.callback(changed)
+      except Exception as e:
+        logger.exception(e)
+
+  def wait_polling(self: FileWatcher) -> set[str]:
+    if self.stopped.wait(self.interval):
+      return set()
+    return self.poll()
+
+  def poll(self: FileWatcher) -> set[str]:
+    """Paths whose inode, mtime or size changed since the last poll."""
+    changed = set()
+    with self.lock:
+      for path in self.paths:
+        signature = file_signature(path)
+        if signature != self.signatures.get(path):
+          self.signatures[path] = signature
+          changed.add(path)
+    return changed
+
+  def wait_inotify(self: FileWatcher) -> set[str]:
+    changed = self.read_events(timeout=min(self.interval, 1))
+    if len(changed) == 0:
+      return changed
+    # a burst of writes is reported once
+    deadline = time.monotonic() + self.debounce
+    while time.monotonic() < deadline:
+      changed |= self.read_events(timeout=deadline - time.monotonic())
+    with self.lock:
+      for path in changed:
+        self.signatures[path] = file_signature(path)
+    return changed
+
+  def read_events(
+    self: FileWatcher,
+    timeout: float,
+  ) -> set[str]:
+    ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+    if len(ready) == 0:
+      return set()
+    try:
+      data = os.read(self.fd, 64 * 1024)
+    except BlockingIOError:
+      return set()
+    changed = set()
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+      wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+      offset += EVENT_HEADER.size
+      name = data[offset:offset + length].rstrip(b'\0')
+      offset += length
+      directory = self.watches.get(wd)
+      if directory is None or len(name) == 0:
+        continue
+      path = os.path.join(directory, os.fsdecode(name))
+      if path in self.paths:
+        changed.add(path)
+    return changed
@@ -0,0 +1,279 @@
+from __future__ import annotations
+from typing import Callable, Iterator, Optional
+
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds, spanning API calls (tens of ms) to slow tunnel handshakes
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape_label(value: str) -> str:
+  return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(
+  labelnames: tuple[str, ...],
+  values: tuple[str, ...],
+  extra: str = '',
+) -> str:
+  pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+  if len(extra) > 0:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+
+def format_value(value: float) -> str:
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+  def __init__(
+    self: Counter,
+    name: str,
+    help: str,
+    labelnames: tuple[str, ...] = (),
+  ) -> None:
+    self.name = name
+    self.help = help
+    self.labelnames = labelnames
+    self.lock = threading.Lock()
+    self.values: dict[tuple[str, ...], float] = {}
+
+  def inc(
+    self: Counter,
+    amount: float = 1,
+    **labels: str,
+  ) -> None:
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def get(self: Counter, **labels: str) -> float:
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    with self.lock:
+      return self.values.get(key, 0)
+
+  def render(self: Counter) -> list[str]:
+    lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+    with self.lock:
+      for key, value in sorted(self.values.items()):
+        lines.append(f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}')
+    return lines
+
+
+class Histogram:
+  def __init__(
+    self: Histogram,
+    name: str,
+    help: str,
+    labelnames: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+  ) -> None:
+    self.name = name
+    self.help = help
+    self.labelnames = labelnames
+    self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    self.lock = threading.Lock()
+    # per label set: bucket counts (not cumulative), sum
+    self.values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+  def observe(
+    self: Histogram,
+    value: float,
+    **labels: str,
+  ) -> None:
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    with self.lock:
+      counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          counts[i] += 1
+          break
+      self.values[key] = (counts, total + value)
+
+  def count(self: Histogram, **labels: str) -> int:
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    with self.lock:
+      counts, _ = self.values.get(key, ([0], 0.0))
+      return sum(counts)
+
+  def render(self: Histogram) -> list[str]:
+    lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+    with self.lock:
+      for key, (counts, total) in sorted(self.values.items()):
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+          cumulative += count
+          labels = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+          lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+    return lines
+
+
+class Metrics:
+  """Timings and counters of region switches, rendered in the Prometheus
+  text exposition format.
+  Phases timed with `phase` are observed in a histogram and summed per
+  switch in `timings`, which `start_switch` resets.
+  Sample usage:
+    metrics = Metrics()
+    metrics.start_switch()
+    with metrics.phase('spawn'):
+      ...
+    metrics.timings  # {'spawn': 0.12}
+    metrics.render()
+  """
+  def __init__(
+    self: Metrics,
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+  ) -> None:
+    self.phase_seconds = Histogram(
+      'iplocationchanger_phase_seconds',
+      'Duration of region switch phases.',
+      ('phase',),
+      buckets,
+    )
+    self.switch_seconds = Histogram(
+      'iplocationchanger_switch_seconds',
+      'Duration of region switches, failover included.',
+      (),
+      buckets,
+    )
+    self.switches = Counter(
+      'iplocationchanger_switches_total',
+      'Region switches attempted.',
+      ('country',),
+    )
+    self.switches_reused = Counter(
+      'iplocationchanger_switches_reused_total',
+      'Region switches skipped as the region was connected and recently validated.',
+      ('country',),
+    )
+    self.switch_failures = Counter(
+      'iplocationchanger_switch_failures_total',
+      'Region switches which failed, by the exception causing the failure.',
+      ('exception',),
+    )
+    self.api_calls = Counter(
+      'iplocationchanger_api_calls_total',
+      'WhatIsMyIP API requests, by endpoint and outcome.',
+      ('endpoint', 'outcome'),
+    )
+    self.collectors: list[Callable[[], list[str]]] = []
+    self.timings: dict[str, float] = {}
+
+  def start_switch(self: Metrics) -> None:
+    self.timings = {}
+
+  @contextlib.contextmanager
+  def phase(
+    self: Metrics,
+    name: str,
+  ) -> Iterator[None]:
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      self.observe_phase(name, time.monotonic() - start)
+
+  def observe_phase(
+    self: Metrics,
+    name: str,
+    elapsed: float,
+  ) -> None:
+    self.phase_seconds.observe(elapsed, phase=name)
+    self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+  def watch_cache(
+    self: Metrics,
+    cache,
+    name: str = 'location_cache',
+  ) -> None:
+    """Export the hit/miss counters of a TTLCache."""
+    def collect() -> list[str]:
+      stats = cache.stats()
+      lines = []
+      for stat in ('hits', 'misses', 'evictions', 'expirations'):
+        metric = f'iplocationchanger_{name}_{stat}_total'
+        lines += [f'# TYPE {metric} counter', f'{metric} {stats[stat]}']
+      return lines
+    self.collectors.append(collect)
+
+  def render(self: Metrics) -> str:
+    lines = []
+    for family in (
+      self.switches,
+      self.switches_reused,
+      self.switch_failures,
+      self.switch_seconds,
+      self.phase_seconds,
+      self.api_calls,
+    ):
+      lines += family.render()
+    for collect in self.collectors:
+      lines += collect()
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+  """Serve `metrics` on http://host:port/metrics from a daemon thread.
+  Sample usage:
+    server = MetricsServer(metrics, 9105)
+    server.start()
+    ...
+    server.close()
+  """
+  def __init__(
+    self: MetricsServer,
+    metrics: Metrics,
+    port: int,
+    host: str = '127.0.0.1',
+  ) -> None:
+    self.metrics = metrics
+    self.host = host
+    self.port = port
+    self.httpd: Optional[ThreadingHTTPServer] = None
+    self.thread: Optional[threading.Thread] = None
+
+  def start(self: MetricsServer) -> None:
+    # only imported when metrics are served
+    from http.server import BaseHTTPRequestHandler
+    from http.server import ThreadingHTTPServer
+
+    metrics = self.metrics
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+          self.send_error(404)
+          return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+    self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+    # port 0 binds an ephemeral port
+    self.port = self.httpd.server_address[1]
+    self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    self.thread.start()
+    logger.debug(f'serving metrics on {self.host}:{self.port}')
+
+  def close(self: MetricsServer) -> None:
+    if self.httpd is not None:
+      self.httpd.shutdown()
+      self.httpd.server_close()
+      self.httpd = None
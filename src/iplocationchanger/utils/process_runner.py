@@ -0,0 +1,199 @@
+from __future__ import annotations
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ProcessResult(NamedTuple):
+  cmd: list[str]
+  # negative if the process was killed by a signal
+  returncode: int
+  duration: float
+  # the last `keep_lines` lines of each stream
+  stdout: str
+  stderr: str
+  timed_out: bool
+  cancelled: bool
+
+  @property
+  def signal(self: ProcessResult) -> Optional[int]:
+    return -self.returncode if self.returncode < 0 else None
+
+  @property
+  def ok(self: ProcessResult) -> bool:
+    return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+  def describe(self: ProcessResult) -> str:
+    if self.timed_out:
+      outcome = 'timed out'
+    elif self.cancelled:
+      outcome = 'cancelled'
+    elif self.signal is not None:
+      outcome = f'killed by {signal.Signals(self.signal).name}'
+    else:
+      outcome = f'exit status {self.returncode}'
+    return f'{outcome} after {self.duration:.3f}s'
+
+  def check(self: ProcessResult) -> ProcessResult:
+    """Raise the subprocess exception `subprocess.run` would have raised."""
+    if self.timed_out:
+      raise subprocess.TimeoutExpired(self.cmd, self.duration, self.stdout, self.stderr)
+    if not self.ok:
+      raise subprocess.CalledProcessError(self.returncode, self.cmd, self.stdout, self.stderr)
+    return self
+
+
+class ProcessRunner:
+  """Run a command without blocking on it. Its stdout and stderr are read
+  line by line as they are written, handed to `on_line(stream, line)` or
+  logged at `log_level`, and only the last `keep_lines` lines of each are
+  kept. `wait` takes a timeout and `cancel` stops the process from any
+  thread: SIGTERM, then SIGKILL after a grace period.
+  Sample usage:
+    runner = ProcessRunner(['openvpn', '--config', '/assets/tr.ovpn'], on_line=print).start()
+    ...
+    result = runner.wait(timeout=30)
+    result.returncode, result.signal, result.duration
+  """
+  def __init__(
+    self: ProcessRunner,
+    cmd: list[str],
+    on_line: Optional[Callable[[str, str], None]] = None,
+    keep_lines: int = 1000,
+    log_level: int = logging.DEBUG,
+    env: Optional[dict] = None,
+  ) -> None:
+    self.cmd = cmd
+    self.on_line = on_line
+    self.log_level = log_level
+    self.env = env
+    self.lines = {
+      'stdout': deque(maxlen=keep_lines),
+      'stderr': deque(maxlen=keep_lines),
+    }
+    self.proc: Optional[subprocess.Popen] = None
+    self.readers: list[threading.Thread] = []
+    self.started_at = 0.0
+    self.finished_at: Optional[float] = None
+    self.timed_out = False
+    self.cancelled = False
+    self.lock = threading.Lock()
+
+  @property
+  def pid(self: ProcessRunner) -> Optional[int]:
+    return self.proc.pid if self.proc is not None else None
+
+  def start(self: ProcessRunner) -> ProcessRunner:
+    """Spawn the process; raises OSError if it cannot be executed."""
+    logger.debug(f'CMD: {self.cmd}')
+    self.started_at = time.monotonic()
+    self.proc = subprocess.Popen(
+      self.cmd,
+      stdin=subprocess.DEVNULL,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.PIPE,
+      env=self.env,
+    )
+    for stream, pipe in (('stdout', self.proc.stdout), ('stderr', self.proc.stderr)):
+      reader = threading.Thread(target=self.read, args=(stream, pipe), daemon=True)
+      reader.start()
+      self.readers.append(reader)
+    return self
+
+  def read(
+    self: ProcessRunner,
+    stream: str,
+    pipe,
+  ) -> None:
+    with pipe:
+      for raw in iter(pipe.readline, b''):
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        self.lines[stream].append(line)
+        if self.on_line is None:
+          logger.log(self.log_level, f'{os.path.basename(self.cmd[0])}[{self.pid}] {stream}: {line}')
+          continue
+        try:
+          self.on_line(stream, line)
+        except Exception as e:
+          logger.exception(e)
+
+  def running(self: ProcessRunner) -> bool:
+    return self.proc is not None and self.proc.poll() is None
+
+  def output(
+    self: ProcessRunner,
+    stream: str,
+  ) -> str:
+    lines = list(self.lines[stream])
+    return '\n'.join(lines) + '\n' if len(lines) > 0 else ''
+
+  def wait(
+    self: ProcessRunner,
+    timeout: Optional[float] = None,
+    grace: float = 5,
+  ) -> ProcessResult:
+    """Wait for the process to exit, stopping it if it is still running
+    after `timeout` seconds.
+    """
+    try:
+      self.proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+      logger.warning(f'{self.cmd[0]} still running after {timeout}s, stopping it')
+      self.timed_out = True
+      self.terminate(grace)
+    return self.result()
+
+  def cancel(
+    self: ProcessRunner,
+    grace: float = 5,
+  ) -> ProcessResult:
+    self.cancelled = True
+    self.terminate(grace)
+    return self.result()
+
+  def terminate(
+    self: ProcessRunner,
+    grace: float = 5,
+  ) -> None:
+    with self.lock:
+      if self.proc.poll() is not None:
+        return
+      self.proc.terminate()
+      try:
+        self.proc.wait(grace)
+      except subprocess.TimeoutExpired:
+        logger.debug(f'sending SIGKILL to {self.pid}')
+        self.proc.kill()
+        self.proc.wait()
+
+  def result(self: ProcessRunner) -> ProcessResult:
+    if self.finished_at is None:
+      self.finished_at = time.monotonic()
+    # the pipes close once the process and any children holding them exited
+    for reader in self.readers:
+      reader.join(1)
+    return ProcessResult(
+      self.cmd,
+      self.proc.returncode,
+      self.finished_at - self.started_at,
+      self.output('stdout'),
+      self.output('stderr'),
+      self.timed_out,
+      self.cancelled,
+    )
+
+
+def run(
+  cmd: list[str],
+  timeout: Optional[float] = None,
+  on_line: Optional[Callable[[str, str], None]] = None,
+) -> ProcessResult:
+  """Run `cmd` to completion; `subprocess.run` with streamed output."""
+  return ProcessRunner(cmd, on_line=on_line).start().wait(timeout)
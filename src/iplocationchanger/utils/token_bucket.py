@@ -0,0 +1,64 @@
+from __future__ import annotations
+from typing import Callable
+
+import threading
+import time
+
+PERIODS = {'s': 1, 'min': 60, 'h': 3600, 'd': 86400}
+
+def parse_rate(rate: str) -> tuple[float, float]:
+  """Parse 'COUNT/PERIOD', e.g. '1000/d', into (tokens per second, burst).
+  PERIOD is one of s, min, h or d; the whole count may be spent at once.
+  """
+  try:
+    count, period = rate.split('/', 1)
+    count = float(count)
+    seconds = PERIODS[period.strip()]
+  except (ValueError, KeyError) as e:
+    raise ValueError(f'Invalid rate {rate}, expected COUNT/PERIOD with PERIOD one of {", ".join(PERIODS)}') from e
+  if count <= 0:
+    raise ValueError(f'Invalid rate {rate}, COUNT must be positive')
+  return count / seconds, count
+
+
+class TokenBucket:
+  """Allow `rate` acquisitions per second on average, in bursts of at most
+  `burst`.
+  Sample usage:
+    bucket = TokenBucket(*parse_rate('1000/d'))
+    if bucket.try_acquire():
+      ...
+  """
+  def __init__(
+    self: TokenBucket,
+    rate: float,
+    burst: float = 1,
+    clock: Callable[[], float] = time.monotonic,
+  ) -> None:
+    self.rate = rate
+    self.burst = burst
+    self.clock = clock
+    self.tokens = burst
+    self.updated = clock()
+    self.lock = threading.Lock()
+
+  def refill(self: TokenBucket) -> None:
+    now = self.clock()
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def available(self: TokenBucket) -> float:
+    with self.lock:
+      self.refill()
+      return self.tokens
+
+  def try_acquire(
+    self: TokenBucket,
+    tokens: float = 1,
+  ) -> bool:
+    with self.lock:
+      self.refill()
+      if self.tokens < tokens:
+        return False
+      self.tokens -= tokens
+      return True
@@ -0,0 +1,187 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class SQLiteCacheStore:
+  """On-disk key/value store with expiry timestamps, shareable between processes."""
+  def __init__(
+    self: SQLiteCacheStore,
+    path: str,
+  ) -> None:
+    self.path = path
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    with self.conn:
+      self.conn.execute('PRAGMA journal_mode=WAL')
+      self.conn.execute(
+        'CREATE TABLE IF NOT EXISTS cache ('
+        ' key TEXT PRIMARY KEY,'
+        ' value TEXT NOT NULL,'
+        ' expires_at REAL NOT NULL'
+        ')'
+      )
+
+  def get(
+    self: SQLiteCacheStore,
+    key: str,
+    now: float,
+  ) -> Optional[tuple[str, float]]:
+    with self.lock:
+      row = self.conn.execute(
+        'SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?',
+        (key, now),
+      ).fetchone()
+    return row
+
+  def set(
+    self: SQLiteCacheStore,
+    key: str,
+    value: str,
+    expires_at: float,
+  ) -> None:
+    with self.lock, self.conn:
+      self.conn.execute(
+        'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+        (key, value, expires_at),
+      )
+
+  def purge(
+    self: SQLiteCacheStore,
+    now: float,
+  ) -> int:
+    with self.lock, self.conn:
+      cur = self.conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+    return cur.rowcount
+
+  def close(self: SQLiteCacheStore) -> None:
+    self.conn.close()
+
+
+class TTLCache:
+  """In-memory LRU cache with a per-entry time to live.
+  Optionally backed by a `SQLiteCacheStore` which is consulted on memory misses
+  and written through on every `set`. Expired rows are deleted from the store
+  when the cache is created and every `purge_every` sets.
+  Sample usage:
+    cache = TTLCache(maxsize=1024, ttl=3600)
+    cache.set('95.223.119.45', 'DE')
+    cache.get('95.223.119.45') # 'DE'
+  """
+  def __init__(
+    self: TTLCache,
+    maxsize: int = 1024,
+    ttl: float = 3600,
+    store: Optional[SQLiteCacheStore] = None,
+    clock: Callable[[], float] = time.time,
+    purge_every: int = 1000,
+  ) -> None:
+    if maxsize <= 0:
+      raise ValueError('maxsize must be positive')
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.store = store
+    self.clock = clock
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+    self.purge_every = purge_every
+    # sets since the store was last purged
+    self.unpurged_sets = 0
+    if self.store is not None:
+      self.purge_store()
+
+  def __len__(self: TTLCache) -> int:
+    return len(self.entries)
+
+  def get(
+    self: TTLCache,
+    key: str,
+  ) -> Optional[str]:
+    now = self.clock()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        value, expires_at = entry
+        if expires_at > now:
+          self.entries.move_to_end(key)
+          self.hits += 1
+          return value
+        del self.entries[key]
+        self.expirations += 1
+
+    if self.store is not None:
+      row = self.store.get(key, now)
+      if row is not None:
+        with self.lock:
+          self.insert(key, row[0], row[1])
+          self.hits += 1
+        return row[0]
+
+    with self.lock:
+      self.misses += 1
+    return None
+
+  def set(
+    self: TTLCache,
+    key: str,
+    value: str,
+  ) -> None:
+    expires_at = self.clock() + self.ttl
+    with self.lock:
+      self.insert(key, value, expires_at)
+    if self.store is not None:
+      self.store.set(key, value, expires_at)
+      with self.lock:
+        self.unpurged_sets += 1
+        purge = self.unpurged_sets >= self.purge_every
+        if purge:
+          self.unpurged_sets = 0
+      if purge:
+        self.purge_store()
+
+  def purge_store(self: TTLCache) -> None:
+    try:
+      purged = self.store.purge(self.clock())
+    except sqlite3.Error as e:
+      # another process may hold the database, it purges next time
+      logger.warning(f'Could not purge the cache store: {e}')
+      return
+    if purged > 0:
+      logger.debug(f'purged {purged} expired cache entries')
+
+  def insert(
+    self: TTLCache,
+    key: str,
+    value: str,
+    expires_at: float,
+  ) -> None:
+    # caller must hold self.lock
+    self.entries[key] = (value, expires_at)
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.maxsize:
+      self.entries.popitem(last=False)
+      self.evictions += 1
+
+  def clear(self: TTLCache) -> None:
+    with self.lock:
+      self.entries.clear()
+
+  def stats(self: TTLCache) -> dict[str, int]:
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'expirations': self.expirations,
+        'size': len(self.entries),
+      }
@@ -1,30 +1,68 @@
 from __future__ import annotations
+from typing import Optional
 
+import os
 import subprocess
-import requests
 import logging
+import time
+
+from iplocationchanger.utils import process_runner
 
 logger = logging.getLogger(__name__)
 
 class Utils:
   @classmethod
-  def run_proc(cls: Utils, cmd: list[str], expect_error=False) -> tuple[bool, str, str]:
+  def run_proc(
+    cls: Utils,
+    cmd: list[str],
+    expect_error=False,
+    timeout: Optional[float] = None,
+  ) -> tuple[bool, str, str]:
+    """Run `cmd`, streaming its output to the debug log, and return
+    (success, stdout, stderr). A failure, or still running after `timeout`
+    seconds, raises subprocess.CalledProcessError (TimeoutExpired) unless
+    `expect_error` is set, in which case success is False.
+    """
+    try:
+      result = process_runner.run(cmd, timeout=timeout).check()
+    except (OSError, subprocess.SubprocessError) as e:
+      logger.debug(e, exc_info=True)
+      if expect_error:
+        return (
+          False,
+          getattr(e, 'stdout', None) or '',
+          getattr(e, 'stderr', None) or str(e),
+        )
+      raise e
+    return (
+      True,
+      result.stdout,
+      result.stderr,
+    )
+
+  @classmethod
+  async def run_proc_async(cls: Utils, cmd: list[str], expect_error=False) -> tuple[bool, str, str]:
+    """asyncio counterpart of `run_proc`."""
+    import asyncio
+
     try:
       logger.debug(f'CMD: {cmd}')
-      proc = subprocess.run(
-        cmd,
-        capture_output = True,
-        check = True,
+      proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
       )
-      success = proc.returncode == 0
+      stdout_b, stderr_b = await proc.communicate()
+      if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout_b, stderr_b)
 
-      stdout = proc.stdout.decode('utf-8')
-      stderr = proc.stderr.decode('utf-8')
+      stdout = stdout_b.decode('utf-8')
+      stderr = stderr_b.decode('utf-8')
       logger.debug(f'STDOUT: {stdout}')
       logger.debug(f'STDERR: {stderr}')
 
       return (
-        success,
+        True,
         stdout,
         stderr,
       )
@@ -32,8 +70,110 @@ class Utils:
       logger.debug(e, exc_info=True)
       if expect_error:
         return (
-          True,
-          'execution failed',
-          '',
+          False,
+          (getattr(e, 'stdout', None) or b'').decode('utf-8'),
+          (getattr(e, 'stderr', None) or b'').decode('utf-8') or str(e),
         )
       raise e
+
+  @classmethod
+  def pid_alive(cls: Utils, pid: int) -> bool:
+    try:
+      os.kill(pid, 0)
+    except ProcessLookupError:
+      return False
+    except PermissionError:
+      # exists, but is owned by another user (e.g. root)
+      pass
+    # an exited daemon stays a zombie until its new parent reaps it
+    try:
+      with open(f'/proc/{pid}/stat') as f_ptr:
+        return f_ptr.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+      return True
+
+  @classmethod
+  def interface_up(cls: Utils, dev: str) -> Optional[bool]:
+    """Whether network interface `dev` is up, None where this cannot be
+    told (no /sys/class/net, e.g. macOS).
+    """
+    if not os.path.isdir('/sys/class/net'):
+      return None
+    try:
+      with open(f'/sys/class/net/{dev}/flags') as f_ptr:
+        # IFF_UP
+        return int(f_ptr.read().strip(), 16) & 0x1 == 0x1
+    except FileNotFoundError:
+      return False
+    except (OSError, ValueError):
+      return None
+
+  @classmethod
+  def read_pid(cls: Utils, pid_path: str) -> int:
+    with open(pid_path) as f_ptr:
+      return int(f_ptr.read().strip())
+
+  @classmethod
+  def wait_for_pid_file(
+    cls: Utils,
+    pid_path: str,
+    timeout: float = 5,
+    poll_interval: float = 0.05,
+  ) -> Optional[int]:
+    """Wait for a daemon to write its pid to `pid_path` (e.g. openvpn
+    --writepid). Returns None if no pid was written within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+      try:
+        return cls.read_pid(pid_path)
+      except (OSError, ValueError):
+        if time.monotonic() > deadline:
+          return None
+        time.sleep(poll_interval)
+
+  @classmethod
+  def terminate_pid(
+    cls: Utils,
+    pid: int,
+    timeout: float = 5,
+    poll_interval: float = 0.05,
+  ) -> float:
+    """Send SIGTERM to `pid`, escalate to SIGKILL if it is still alive after
+    `timeout` seconds, and return the seconds it took for the process to exit.
+    """
+    start = time.monotonic()
+    for signal_name, wait in (('TERM', timeout), ('KILL', timeout)):
+      if not cls.pid_alive(pid):
+        break
+      logger.debug(f'sending SIG{signal_name} to {pid}')
+      cls.run_proc(['sudo', 'kill', f'-{signal_name}', str(pid)], expect_error=True)
+      deadline = time.monotonic() + wait
+      while cls.pid_alive(pid) and time.monotonic() < deadline:
+        time.sleep(poll_interval)
+    if cls.pid_alive(pid):
+      logger.error(f'process {pid} survived SIGKILL')
+    return time.monotonic() - start
+
+  @classmethod
+  async def terminate_pid_async(
+    cls: Utils,
+    pid: int,
+    timeout: float = 5,
+    poll_interval: float = 0.05,
+  ) -> float:
+    """asyncio counterpart of `terminate_pid`."""
+    import asyncio
+
+    start = time.monotonic()
+    for signal_name, wait in (('TERM', timeout), ('KILL', timeout)):
+      if not cls.pid_alive(pid):
+        break
+      logger.debug(f'sending SIG{signal_name} to {pid}')
+      await cls.run_proc_async(['sudo', 'kill', f'-{signal_name}', str(pid)], expect_error=True)
+      deadline = time.monotonic() + wait
+      while cls.pid_alive(pid) and time.monotonic() < deadline:
+        await asyncio.sleep(poll_interval)
+    if cls.pid_alive(pid):
+      logger.error(f'process {pid} survived SIGKILL')
+    return time.monotonic() - start
@@ -0,0 +1,71 @@
+import unittest
+
+from iplocationchanger.model.openvpn_config import OpenVPNConfig
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
+
+CONFIG = '''
+# provider config
+client
+dev tun
+proto tcp
+remote tr1.example.com 443
+remote tr2.example.com
+; remote commented.example.com 1194
+remote tr3.example.com 1195 udp6
+<connection>
+remote tr4.example.com 8443 tcp-client
+</connection>
+remote-random
+<ca>
+-----BEGIN CERTIFICATE-----
+remote not.a.directive 1
+-----END CERTIFICATE-----
+</ca>
+auth-user-pass "/path/with spaces/creds.txt"
+'''
+
+class TestOpenVPNConfig(unittest.TestCase):
+  def test_parse(self):
+    config = OpenVPNConfig.parse(CONFIG, '/path/to/tr.ovpn')
+    self.assertEqual(config.path, '/path/to/tr.ovpn')
+    self.assertEqual(config.get('dev'), ['tun'])
+    self.assertEqual(config.get('remote-random'), [])
+    self.assertEqual(config.get('auth-user-pass'), ['/path/with spaces/creds.txt'])
+    self.assertIsNone(config.get('cipher'))
+    self.assertIn('remote not.a.directive 1', config.inline['ca'])
+
+  def test_remotes(self):
+    test_cases = [
+      {
+        'case_name': 'proto directive',
+        'text': CONFIG,
+        'expected': [
+          OpenVPNRemote('tr1.example.com', 443, 'tcp'),
+          OpenVPNRemote('tr2.example.com', 1194, 'tcp'),
+          OpenVPNRemote('tr3.example.com', 1195, 'udp6'),
+          OpenVPNRemote('tr4.example.com', 8443, 'tcp-client'),
+        ],
+      },
+      {
+        'case_name': 'defaults',
+        'text': 'remote 198.51.100.1\n',
+        'expected': [OpenVPNRemote('198.51.100.1', 1194, 'udp')],
+      },
+      {
+        'case_name': 'port directive',
+        'text': 'port 1300\nremote 198.51.100.1\n',
+        'expected': [OpenVPNRemote('198.51.100.1', 1300, 'udp')],
+      },
+      {
+        'case_name': 'no remote',
+        'text': 'client\n',
+        'expected': [],
+      },
+    ]
+
+    for tc in test_cases:
+      self.assertEqual(OpenVPNConfig.parse(tc['text']).remotes(), tc['expected'], msg=tc['case_name'])
+
+  def test_transport(self):
+    self.assertEqual(OpenVPNRemote('h', 1, 'tcp4-client').transport, 'tcp')
+    self.assertEqual(OpenVPNRemote('h', 1, 'udp6').transport, 'udp')
@@ -1,48 +1,41 @@
 import unittest
 
 from unittest.mock import patch
-from unittest.mock import call
-from unittest.mock import Mock
 
 from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
 
 class TestOpenVPNCredentials(unittest.TestCase):
-  @patch('iplocationchanger.model.openvpn_credentials.open')
-  @patch('iplocationchanger.model.openvpn_credentials.TemporaryDirectory')
-  def test_init(self, TemporaryDirectoryMock, open_mock):
-    f_ptr_write_mock = Mock()
-    f_ptr_mock = Mock()
-    f_ptr_mock.write = f_ptr_write_mock
-    open_mock_return = Mock()
-    open_mock_return.__enter__ = Mock(return_value=f_ptr_mock)
-    open_mock_return.__exit__ = Mock()
-    open_mock.return_value = open_mock_return
-
-    tmp_dir_path = '/temp/dir'
-    tdm = Mock()
-    tdm.name = tmp_dir_path
-    tdm_cleanup = Mock()
-    tdm.cleanup = tdm_cleanup
-    TemporaryDirectoryMock.return_value = tdm
-    
-    user = 'username'
-    password = 'password'
-    ovnc = OpenVPNCredentials(user, password)
-
-    credentials_path = tmp_dir_path + '/openvpn_credentials'
-    open_mock.assert_called_once_with(credentials_path, 'w')
-
-    f_ptr_write_mock.assert_has_calls(
-      [
-        call(f'{user}\n'),
-        call(f'{password}\n'),
-      ],
-    )
-
-    self.assertEqual(
-      ovnc.file_path(),
-      credentials_path,
-    )
-
-    del(ovnc)
-    tdm_cleanup.assert_called_once()
+  @patch('builtins.open')
+  def test_commands(self, open_mock):
+    test_cases = [
+      {
+        'case_name': 'plain',
+        'user': 'username',
+        'password': 's3cret',
+        'expected': [
+          'username "Auth" "username"',
+          'password "Auth" "s3cret"',
+        ],
+      },
+      {
+        'case_name': 'quotes, backslashes and spaces escaped',
+        'user': 'user name',
+        'password': 'pa"ss\\word',
+        'expected': [
+          'username "Auth" "user name"',
+          'password "Auth" "pa\\"ss\\\\word"',
+        ],
+      },
+    ]
+
+    for tc in test_cases:
+      ovnc = OpenVPNCredentials(tc['user'], tc['password'])
+      self.assertEqual(ovnc.commands(), tc['expected'], msg=tc['case_name'])
+      # the same credentials serve every connect
+      self.assertEqual(ovnc.commands(), tc['expected'], msg=tc['case_name'])
+      self.assertNotIn(tc['password'], repr(ovnc), msg=tc['case_name'])
+    open_mock.assert_not_called()
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      OpenVPNCredentials('username', 'pass\nword')
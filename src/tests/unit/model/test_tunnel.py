@@ -0,0 +1,40 @@
+import unittest
+
+from unittest.mock import patch
+
+from iplocationchanger.model.tunnel import Tunnel
+
+class TestTunnel(unittest.TestCase):
+  def test_init(self):
+    tunnel = Tunnel('TR', 3, 'ilc3', '/path/to/tr.ovpn', '/tmp/pid')
+    self.assertEqual(tunnel.subnet, '10.200.3.0/30')
+    self.assertEqual(tunnel.host_ip, '10.200.3.1')
+    self.assertEqual(tunnel.ns_ip, '10.200.3.2')
+    self.assertEqual((tunnel.host_veth, tunnel.ns_veth), ('ilc3-h', 'ilc3-n'))
+
+  @patch('iplocationchanger.model.tunnel.getpass.getuser')
+  @patch('iplocationchanger.model.tunnel.Utils')
+  def test_netns_cmd(self, UtilsMock, getuser_mock):
+    getuser_mock.return_value = 'scraper'
+    tunnel = Tunnel('TR', 3, 'ilc3', '/path/to/tr.ovpn', '/tmp/pid')
+    test_cases = [
+      {
+        'cmd': ['curl', 'https://example.com'],
+        'user': None,
+        'expected': ['sudo', 'ip', 'netns', 'exec', 'ilc3', 'sudo', '-u', 'scraper', 'curl', 'https://example.com'],
+      },
+      {
+        'cmd': ['ip', 'addr'],
+        'user': 'root',
+        'expected': ['sudo', 'ip', 'netns', 'exec', 'ilc3', 'ip', 'addr'],
+      },
+    ]
+
+    for tc in test_cases:
+      self.assertEqual(tunnel.netns_cmd(tc['cmd'], user=tc['user']), tc['expected'])
+
+    tunnel.run(['curl', 'https://example.com'])
+    UtilsMock.run_proc.assert_called_once_with(
+      ['sudo', 'ip', 'netns', 'exec', 'ilc3', 'sudo', '-u', 'scraper', 'curl', 'https://example.com'],
+      expect_error=False,
+    )
@@ -0,0 +1,95 @@
+import socket
+import struct
+import threading
+import time
+
+
+class FakeOpenVPNManagement:
+  """Local stand-in for an openvpn management interface.
+  `states` are reported one after the other, `state_delay` seconds apart,
+  once a client enables real-time state notifications.
+  On the `reset_on` command it resets the connection like a dying openvpn.
+  With `credentials` (user, password) it asks for them like
+  `--management-query-passwords` and only goes on once they are given.
+  """
+  def __init__(self, states=('CONNECTING', 'CONNECTED'), state_delay=0.05, current_state='WAIT', bytes_in=0, bytes_out=0, credentials=None, reset_on=None):
+    self.states = list(states)
+    self.credentials = credentials
+    self.reset_on = reset_on
+    self.password_pending = credentials is not None
+    self.given = {}
+    self.bytes_in = bytes_in
+    self.bytes_out = bytes_out
+    self.state_delay = state_delay
+    self.current_state = current_state
+    self.commands = []
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.listener.bind(('127.0.0.1', 0))
+    self.listener.listen(1)
+    self.port = self.listener.getsockname()[1]
+    self.thread = threading.Thread(target=self.serve, daemon=True)
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *_):
+    self.listener.close()
+    self.thread.join(timeout=2)
+
+  def state_line(self, state):
+    return f'{int(time.time())},{state},SUCCESS,10.8.0.2,203.0.113.7,1194,,'
+
+  def report_states(self, f_ptr):
+    for state in self.states:
+      time.sleep(self.state_delay)
+      self.current_state = state
+      f_ptr.write(f'>STATE:{self.state_line(state)}\r\n')
+      f_ptr.flush()
+
+  def serve(self):
+    try:
+      conn, _ = self.listener.accept()
+    except OSError:
+      return
+    with conn:
+      f_ptr = conn.makefile('rw', encoding='utf-8', newline='')
+      f_ptr.write(">INFO:OpenVPN Management Interface Version 3 -- type 'help' for more info\r\n")
+      if self.password_pending:
+        f_ptr.write(">PASSWORD:Need 'Auth' username/password\r\n")
+      f_ptr.flush()
+      for line in f_ptr:
+        command = line.strip()
+        self.commands.append(command)
+        if command == self.reset_on:
+          # close with RST instead of FIN
+          conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+          f_ptr.close()
+          return
+        if command == 'state on':
+          f_ptr.write('SUCCESS: real-time state notification set to ON\r\n')
+          f_ptr.flush()
+        elif command == 'state':
+          f_ptr.write(f'{self.state_line(self.current_state)}\r\nEND\r\n')
+          f_ptr.flush()
+          if not self.password_pending:
+            self.report_states(f_ptr)
+        elif command.startswith(('username ', 'password ')):
+          kind, _, value = command.partition(' "Auth" ')
+          self.given[kind] = value.strip('"')
+          f_ptr.write(f"SUCCESS: 'Auth' {kind} entered, but not yet verified\r\n")
+          f_ptr.flush()
+          if len(self.given) == 2:
+            self.password_pending = False
+            if (self.given['username'], self.given['password']) != self.credentials:
+              f_ptr.write(">PASSWORD:Verification Failed: 'Auth'\r\n")
+              f_ptr.flush()
+            elif 'state' in self.commands:
+              self.report_states(f_ptr)
+        elif command == 'load-stats':
+          f_ptr.write(f'SUCCESS: nclients=0,bytesin={self.bytes_in},bytesout={self.bytes_out}\r\n')
+          f_ptr.flush()
+        else:
+          f_ptr.write(f'ERROR: unknown command [{command}]\r\n')
+          f_ptr.flush()
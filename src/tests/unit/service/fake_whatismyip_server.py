@@ -0,0 +1,76 @@
+import json
+import threading
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+
+
+class FakeWhatIsMyIPServer:
+  """Local HTTP stub emulating the `ip.php` and `ip-address-lookup.php` endpoints.
+  `responses` maps a path to a queue of (status, body) tuples served in order;
+  once a queue is exhausted its default JSON body is served.
+  """
+  def __init__(self, ip='203.0.113.7', country='TR'):
+    self.ip = ip
+    self.country = country
+    self.responses = {}
+    self.requests = []
+    self.connections = 0
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def setup(self):
+        server.connections += 1
+        super().setup()
+
+      def log_message(self, *_):
+        pass
+
+      def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        server.requests.append((url.path, params))
+        status, body = server.respond(url.path, params)
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.httpd.daemon_threads = True
+    self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+    self.thread = threading.Thread(
+      target=self.httpd.serve_forever,
+      kwargs={'poll_interval': 0.05},
+      daemon=True,
+    )
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *_):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+  def queue(self, path, status, body):
+    self.responses.setdefault(path, deque()).append((status, body))
+
+  def respond(self, path, params):
+    if len(self.responses.get(path, ())) > 0:
+      return self.responses[path].popleft()
+    if path == '/ip.php':
+      return 200, json.dumps({'ip_address': self.ip})
+    if path == '/ip-address-lookup.php':
+      ip = params.get('input', self.ip)
+      return 200, json.dumps({
+        'ip_address_lookup': [{'status': 'ok', 'ip': ip, 'country': self.country}],
+      })
+    return 404, 'not found'
@@ -0,0 +1,78 @@
+import unittest
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from iplocationchanger.service.async_location_changer_service import AsyncLocationChangerService
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+def async_service_mock(**kwargs):
+  service = Mock()
+  service.pid = None
+  for name in ('connect', 'disconnect', 'wait_until_connected', 'validate_connection', 'reset_session', 'close'):
+    setattr(service, name, AsyncMock(side_effect=kwargs.get(name)))
+  return service
+
+class TestAsyncLocationChangerService(unittest.IsolatedAsyncioTestCase):
+  @patch('iplocationchanger.service.async_location_changer_service.AsyncOpenVPNService')
+  @patch('iplocationchanger.service.async_location_changer_service.AsyncWhatIsMyIPService')
+  async def test_connect_region(self, AsyncWhatIsMyIPServiceMock, AsyncOpenVPNServiceMock):
+    test_cases = [
+      {
+        'case_name': 'success',
+        'ovs': {},
+        'wms': {},
+        'expects_exception': False,
+      },
+      {
+        'case_name': 'openvpn fails',
+        'ovs': {'connect': OpenVPNServiceException('')},
+        'wms': {},
+        'expects_exception': True,
+      },
+      {
+        'case_name': 'tunnel never up',
+        'ovs': {'wait_until_connected': OpenVPNServiceException('')},
+        'wms': {},
+        'expects_exception': True,
+      },
+      {
+        'case_name': 'wrong location',
+        'ovs': {},
+        'wms': {'validate_connection': WhatIsMyIPServiceException('')},
+        'expects_exception': True,
+      },
+    ]
+
+    for tc in test_cases:
+      ovs = async_service_mock(**tc['ovs'])
+      wms = async_service_mock(**tc['wms'])
+      AsyncOpenVPNServiceMock.return_value = ovs
+      AsyncWhatIsMyIPServiceMock.return_value = wms
+
+      lcs = AsyncLocationChangerService('api_key', {'DE': '/path/to/de.ovpn'}, 'openvpnexec')
+      if tc['expects_exception']:
+        with self.assertRaises(LocationChangerServiceException, msg=tc['case_name']):
+          await lcs.connect_region('DE', 0)
+      else:
+        await lcs.connect_region('DE', 0)
+        ovs.connect.assert_awaited_once_with('DE', '/path/to/de.ovpn')
+        ovs.wait_until_connected.assert_awaited_once_with(0)
+        wms.validate_connection.assert_awaited_once_with('DE')
+
+  @patch('iplocationchanger.service.async_location_changer_service.AsyncOpenVPNService')
+  @patch('iplocationchanger.service.async_location_changer_service.AsyncWhatIsMyIPService')
+  async def test_context_manager(self, AsyncWhatIsMyIPServiceMock, AsyncOpenVPNServiceMock):
+    ovs = async_service_mock()
+    wms = async_service_mock()
+    AsyncOpenVPNServiceMock.return_value = ovs
+    AsyncWhatIsMyIPServiceMock.return_value = wms
+
+    async with AsyncLocationChangerService('api_key', {}, 'openvpnexec'):
+      pass
+
+    ovs.disconnect.assert_awaited_once_with()
+    wms.close.assert_awaited_once_with()
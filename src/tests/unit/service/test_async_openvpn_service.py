@@ -0,0 +1,56 @@
+import subprocess
+import unittest
+
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.service.async_openvpn_service import AsyncOpenVPNService
+from iplocationchanger.service.async_openvpn_management_client import AsyncOpenVPNManagementClient
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+from tests.unit.service.fake_openvpn_management import FakeOpenVPNManagement
+
+class TestAsyncOpenVPNService(unittest.IsolatedAsyncioTestCase):
+  @patch('iplocationchanger.service.async_openvpn_service.Utils')
+  async def test_connect(self, UtilsMock):
+    UtilsMock.run_proc_async = AsyncMock(return_value=(True, '', ''))
+    UtilsMock.read_pid = Mock(return_value=4242)
+    ovs = AsyncOpenVPNService({'DE': '/path/to/de.ovpn'}, 'usr/bin/openvpn')
+    await ovs.connect('DE')
+    UtilsMock.run_proc_async.assert_awaited_once_with(ovs.connect_cmd('DE'))
+    self.assertEqual(ovs.pid, 4242)
+
+    with self.assertRaises(OpenVPNServiceException):
+      await ovs.connect('TR')
+
+    UtilsMock.run_proc_async = AsyncMock(side_effect=subprocess.CalledProcessError(1, []))
+    with self.assertRaises(OpenVPNServiceException):
+      await ovs.connect('DE')
+
+  @patch('iplocationchanger.service.async_openvpn_service.Utils')
+  async def test_disconnect(self, UtilsMock):
+    UtilsMock.terminate_pid_async = AsyncMock(return_value=0.5)
+    ovs = AsyncOpenVPNService({}, '')
+    self.assertEqual(await ovs.disconnect(), 0.0)
+    UtilsMock.terminate_pid_async.assert_not_awaited()
+
+    ovs.pid = 4242
+    self.assertEqual(await ovs.disconnect(timeout=2), 0.5)
+    UtilsMock.terminate_pid_async.assert_awaited_once_with(4242, 2)
+    self.assertIsNone(ovs.pid)
+
+  async def test_wait_until_connected(self):
+    with FakeOpenVPNManagement(['AUTH', 'CONNECTED']) as fom:
+      ovs = AsyncOpenVPNService({}, '', management_port=fom.port)
+      await ovs.wait_until_connected(5)
+
+    with FakeOpenVPNManagement(['AUTH', 'CONNECTED'], credentials=('user', 'secret')) as fom:
+      ovs = AsyncOpenVPNService({}, '', management_port=fom.port, credentials=OpenVPNCredentials('user', 'secret'))
+      await ovs.wait_until_connected(5)
+    self.assertIn('password "Auth" "secret"', fom.commands)
+
+    with FakeOpenVPNManagement(['AUTH']) as fom:
+      async with AsyncOpenVPNManagementClient('127.0.0.1', fom.port) as omc:
+        with self.assertRaises(OpenVPNServiceException):
+          await omc.wait_for_state('CONNECTED', timeout=0.3)
@@ -0,0 +1,159 @@
+import unittest
+
+from unittest.mock import Mock
+
+from iplocationchanger.service import async_whatismyip_service
+from iplocationchanger.service.async_whatismyip_service import AsyncWhatIsMyIPService
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+from tests.unit.service.fake_whatismyip_server import FakeWhatIsMyIPServer
+
+@unittest.skipIf(async_whatismyip_service.aiohttp is None, 'aiohttp is not installed')
+class TestAsyncWhatIsMyIPService(unittest.IsolatedAsyncioTestCase):
+  async def test_validate_connection(self):
+    test_cases = [
+      {'server_country': 'TR', 'country': 'tr', 'expects_exception': False},
+      {'server_country': 'TR', 'country': 'DE', 'expects_exception': True},
+    ]
+
+    for tc in test_cases:
+      with FakeWhatIsMyIPServer(country=tc['server_country']) as fws:
+        ws = AsyncWhatIsMyIPService('apikeyisthisstring', base_url=fws.base_url)
+        try:
+          if tc['expects_exception']:
+            with self.assertRaises(WhatIsMyIPServiceException):
+              await ws.validate_connection(tc['country'])
+          else:
+            await ws.validate_connection(tc['country'])
+          # both requests share one pooled connection
+          self.assertEqual(fws.connections, 1)
+        finally:
+          await ws.close()
+
+  async def test_request_retries(self):
+    test_cases = [
+      {
+        'case_name': 'retry on 503 and too many lookups',
+        'queued': [(503, 'unavailable'), (200, '3')],
+        'expects_exception': False,
+      },
+      {
+        'case_name': 'not found',
+        'queued': [(404, 'not found')],
+        'expects_exception': True,
+      },
+      {
+        'case_name': 'invalid API key',
+        'queued': [(200, '1')],
+        'expects_exception': True,
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeWhatIsMyIPServer() as fws:
+        for status, body in tc['queued']:
+          fws.queue('/ip.php', status, body)
+        ws = AsyncWhatIsMyIPService(
+          'apikeyisthisstring',
+          base_url=fws.base_url,
+          max_retries=2,
+          backoff_factor=0.01,
+        )
+        try:
+          if tc['expects_exception']:
+            with self.assertRaises(WhatIsMyIPServiceException, msg=tc['case_name']):
+              await ws.get_ip()
+          else:
+            self.assertEqual(await ws.get_ip(), fws.ip, msg=tc['case_name'])
+        finally:
+          await ws.close()
+
+  async def test_get_location_from_ip_cached(self):
+    with FakeWhatIsMyIPServer(country='DE') as fws:
+      ws = AsyncWhatIsMyIPService(
+        'apikeyisthisstring',
+        base_url=fws.base_url,
+        location_cache=TTLCache(ttl=60),
+      )
+      try:
+        self.assertEqual(await ws.get_location_from_ip('95.223.119.45'), 'DE')
+        self.assertEqual(await ws.get_location_from_ip('95.223.119.45'), 'DE')
+        self.assertEqual(len(fws.requests), 1)
+      finally:
+        await ws.close()
+
+  async def test_locate(self):
+    test_cases = [
+      {
+        'case_name': 'single lookup',
+        'queued': [],
+        'requests': 1,
+      },
+      {
+        'case_name': 'lookup without input rejected',
+        'queued': [(200, '4')],
+        'requests': 3,
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeWhatIsMyIPServer(country='TR') as fws:
+        for status, body in tc['queued']:
+          fws.queue('/ip-address-lookup.php', status, body)
+        ws = AsyncWhatIsMyIPService('apikeyisthisstring', base_url=fws.base_url)
+        try:
+          self.assertEqual(await ws.locate(), (fws.ip, 'TR'), msg=tc['case_name'])
+          self.assertEqual(len(fws.requests), tc['requests'], msg=tc['case_name'])
+        finally:
+          await ws.close()
+
+  async def test_race(self):
+    failing = Mock(locate=Mock(side_effect=LocationProviderException('down')))
+    failing.name = 'failing'
+    fast = Mock(locate=Mock(return_value=('203.0.113.7', 'TR')))
+    fast.name = 'fast'
+    with FakeWhatIsMyIPServer() as fws:
+      fws.queue('/ip-address-lookup.php', 503, 'unavailable')
+      ws = AsyncWhatIsMyIPService(
+        'apikeyisthisstring',
+        base_url=fws.base_url,
+        max_retries=0,
+        validation='race',
+        providers=[failing, fast],
+      )
+      try:
+        await ws.validate_connection('TR')
+        fast.locate.assert_called_once()
+
+        fast.locate.side_effect = LocationProviderException('down')
+        for _ in range(3):
+          fws.queue('/ip-address-lookup.php', 503, 'unavailable')
+        with self.assertRaises(WhatIsMyIPServiceException):
+          await ws.validate_connection('TR')
+      finally:
+        await ws.close()
+
+  async def test_scheduled(self):
+    de = Mock(locate=Mock(return_value=('203.0.113.7', 'DE')))
+    de.name = 'de'
+    tr = Mock(locate=Mock(return_value=('203.0.113.7', 'TR')))
+    tr.name = 'tr'
+    with FakeWhatIsMyIPServer(country='TR') as fws:
+      registry = LocationProviderRegistry(quorum=2)
+      ws = AsyncWhatIsMyIPService(
+        'apikeyisthisstring',
+        base_url=fws.base_url,
+        validation='scheduled',
+        registry=registry,
+      )
+      registry.register(de)
+      registry.register(tr)
+      try:
+        await ws.validate_connection('TR')
+        de.locate.assert_called_once()
+        tr.locate.assert_called_once()
+        self.assertIn('whatismyip', registry.latency)
+      finally:
+        await ws.close()
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+import unittest
+
+from tempfile import TemporaryDirectory
+
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
+from iplocationchanger.service.config_selector_service import config_paths
+from iplocationchanger.exception.config_catalogue_service_exception import ConfigCatalogueServiceException
+
+class TestConfigCatalogueService(unittest.TestCase):
+  def setUp(self):
+    self.td = TemporaryDirectory()
+
+  def tearDown(self):
+    self.td.cleanup()
+
+  def write(self, name, content):
+    path = os.path.join(self.td.name, name)
+    with open(path, 'w') as f_ptr:
+      f_ptr.write(content)
+    return path
+
+  def test_load(self):
+    tr1 = self.write('tr1.ovpn', 'client\nproto udp\nremote tr1.example.com 1194\n<ca>\nCERT\n</ca>\n')
+    tr2 = self.write('tr2.ovpn', 'client\nremote tr2.example.com 443 tcp\nremote shared.example.com\n')
+    de = self.write('de.ovpn', 'client\nremote shared.example.com 1194\n')
+    broken = self.write('broken.ovpn', 'client\ndev tun\n')
+    missing = os.path.join(self.td.name, 'missing.ovpn')
+    map_path = self.write('configmap.json', json.dumps({
+      'TR': [tr1, tr2, missing],
+      'DE': de,
+      'AR': broken,
+    }))
+
+    catalogue = ConfigCatalogueService.from_file(map_path)
+    self.assertEqual(catalogue['TR'], (tr1, tr2))
+    self.assertEqual(config_paths(catalogue, 'DE'), [de])
+    # countries without a usable config are left out
+    self.assertNotIn('AR', catalogue)
+    self.assertEqual(sorted(catalogue), ['DE', 'TR'])
+    self.assertEqual(sorted(catalogue.errors), sorted([broken, missing]))
+    self.assertIn('no remote', catalogue.errors[broken])
+
+    self.assertEqual(catalogue.by_proto('tcp'), frozenset([tr2]))
+    self.assertEqual(catalogue.by_proto('udp'), frozenset([tr1, tr2, de]))
+    self.assertEqual(catalogue.by_server('shared.example.com'), frozenset([tr2, de]))
+    self.assertEqual(catalogue.by_server('unknown.example.com'), frozenset())
+    self.assertEqual(catalogue.country_of(de), 'DE')
+    self.assertEqual(catalogue.config(tr1).inline['ca'], 'CERT')
+
+    with self.assertRaises(ConfigCatalogueServiceException):
+      catalogue.config(broken)
+
+  def test_mtime_invalidation(self):
+    tr = self.write('tr.ovpn', 'client\nremote tr1.example.com 1194\n')
+    catalogue = ConfigCatalogueService({'TR': tr})
+    config = catalogue.config(tr)
+    self.assertIs(catalogue.config(tr), config)
+    self.assertEqual(catalogue.load(), [])
+
+    self.write('tr.ovpn', 'client\nremote tr2.example.com 1194\n')
+    os.utime(tr, ns=(0, 10 ** 9))
+    self.assertEqual(catalogue.config(tr).remotes()[0].host, 'tr2.example.com')
+    self.assertEqual(catalogue.by_server('tr2.example.com'), frozenset([tr]))
+    self.assertEqual(catalogue.by_server('tr1.example.com'), frozenset())
+
+    # a config breaking after startup drops out of the map
+    self.write('tr.ovpn', 'client\n')
+    os.utime(tr, ns=(0, 2 * 10 ** 9))
+    self.assertEqual(catalogue.load(), [tr])
+    self.assertNotIn('TR', catalogue)
+
+  def test_invalid_map(self):
+    test_cases = [
+      {'case_name': 'not JSON', 'content': '{"TR": '},
+      {'case_name': 'not an object', 'content': '["tr.ovpn"]'},
+      {'case_name': 'not a path', 'content': '{"TR": 1}'},
+    ]
+    for tc in test_cases:
+      map_path = self.write('configmap.json', tc['content'])
+      with self.assertRaises(ConfigCatalogueServiceException, msg=tc['case_name']):
+        ConfigCatalogueService.from_file(map_path)
+
+    with self.assertRaises(ConfigCatalogueServiceException):
+      ConfigCatalogueService.from_file(os.path.join(self.td.name, 'missing.json'))
+
+  def test_watch(self):
+    tr = self.write('tr.ovpn', 'client\nremote tr.example.com 1194\n')
+    de = self.write('de.ovpn', 'client\nremote de.example.com 1194\n')
+    map_path = self.write('configmap.json', json.dumps({'TR': tr}))
+    catalogue = ConfigCatalogueService.from_file(map_path)
+    tr_config = catalogue.config(tr)
+    test_cases = [
+      {
+        'case_name': 'country added',
+        'content': json.dumps({'TR': tr, 'DE': de}),
+        'expected': ['DE', 'TR'],
+      },
+      {
+        'case_name': 'invalid map is ignored',
+        'content': '{"TR": ',
+        'expected': ['DE', 'TR'],
+      },
+      {
+        'case_name': 'country removed',
+        'content': json.dumps({'TR': tr}),
+        'expected': ['TR'],
+      },
+    ]
+
+    for use_inotify in (False, True):
+      catalogue.watch(interval=0.05, use_inotify=use_inotify)
+      try:
+        for tc in test_cases:
+          self.write('configmap.json.tmp', tc['content'])
+          os.replace(os.path.join(self.td.name, 'configmap.json.tmp'), map_path)
+          deadline = time.monotonic() + 5
+          while sorted(catalogue) != tc['expected'] and time.monotonic() < deadline:
+            time.sleep(0.02)
+          time.sleep(0.2)
+          self.assertEqual(sorted(catalogue), tc['expected'], msg=tc['case_name'])
+      finally:
+        catalogue.stop_watching()
+      # unchanged configs are not parsed again
+      self.assertIs(catalogue.config(tr), tr_config)
@@ -0,0 +1,82 @@
+import unittest
+
+from unittest.mock import patch
+from unittest.mock import Mock
+
+from iplocationchanger.service.config_selector_service import ConfigSelectorService
+from iplocationchanger.service.config_selector_service import config_paths
+
+CONFIG_TO_COUNTRY = {
+  'TR': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn', '/path/to/tr3.ovpn'],
+  'AR': '/path/to/ar.ovpn',
+}
+
+class TestConfigSelectorService(unittest.TestCase):
+  def test_config_paths(self):
+    test_cases = [
+      {'country': 'TR', 'expected': CONFIG_TO_COUNTRY['TR']},
+      {'country': 'AR', 'expected': ['/path/to/ar.ovpn']},
+      {'country': 'DE', 'expected': []},
+    ]
+
+    for tc in test_cases:
+      self.assertEqual(config_paths(CONFIG_TO_COUNTRY, tc['country']), tc['expected'])
+
+  def test_round_robin(self):
+    css = ConfigSelectorService(CONFIG_TO_COUNTRY, 'round-robin')
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn', '/path/to/tr3.ovpn'])
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr2.ovpn', '/path/to/tr3.ovpn', '/path/to/tr1.ovpn'])
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr3.ovpn', '/path/to/tr1.ovpn', '/path/to/tr2.ovpn'])
+    self.assertEqual(css.candidates('TR')[0], '/path/to/tr1.ovpn')
+    self.assertEqual(css.candidates('AR'), ['/path/to/ar.ovpn'])
+
+  def test_latency(self):
+    css = ConfigSelectorService(CONFIG_TO_COUNTRY, 'latency', alpha=0.5)
+    css.record('/path/to/tr1.ovpn', 2.0)
+    css.record('/path/to/tr2.ovpn', 1.0)
+    # unmeasured configs are tried first
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr3.ovpn', '/path/to/tr2.ovpn', '/path/to/tr1.ovpn'])
+
+    css.record('/path/to/tr3.ovpn', None)
+    css.record('/path/to/tr2.ovpn', 5.0)
+    self.assertEqual(css.latencies['/path/to/tr2.ovpn'], 3.0)
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn', '/path/to/tr3.ovpn'])
+
+  @patch('iplocationchanger.service.config_selector_service.random.shuffle')
+  def test_random(self, shuffle_mock):
+    shuffle_mock.side_effect = lambda configs: configs.reverse()
+    css = ConfigSelectorService(CONFIG_TO_COUNTRY, 'random')
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr3.ovpn', '/path/to/tr2.ovpn', '/path/to/tr1.ovpn'])
+    # the configured order is left untouched
+    self.assertEqual(CONFIG_TO_COUNTRY['TR'][0], '/path/to/tr1.ovpn')
+
+  def test_invalid_strategy(self):
+    with self.assertRaises(ValueError):
+      ConfigSelectorService(CONFIG_TO_COUNTRY, 'fastest')
+
+  def test_probe(self):
+    ranker = Mock()
+    ranker.rank.side_effect = lambda configs: list(reversed(configs))
+    css = ConfigSelectorService(CONFIG_TO_COUNTRY, 'probe', ranker=ranker)
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr3.ovpn', '/path/to/tr2.ovpn', '/path/to/tr1.ovpn'])
+    ranker.rank.assert_called_once_with(CONFIG_TO_COUNTRY['TR'])
+
+    with self.assertRaises(ValueError):
+      ConfigSelectorService(CONFIG_TO_COUNTRY, 'probe')
+
+  def test_history(self):
+    history = Mock()
+    history.rank.side_effect = lambda configs: list(reversed(configs))
+    history.flagged.return_value = ['/path/to/tr1.ovpn']
+
+    css = ConfigSelectorService(CONFIG_TO_COUNTRY, 'history', history=history)
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr3.ovpn', '/path/to/tr2.ovpn', '/path/to/tr1.ovpn'])
+
+    # flagged configs go last whatever the strategy
+    css = ConfigSelectorService(CONFIG_TO_COUNTRY, 'round-robin', history=history)
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr2.ovpn', '/path/to/tr3.ovpn', '/path/to/tr1.ovpn'])
+    self.assertEqual(css.candidates('TR'), ['/path/to/tr2.ovpn', '/path/to/tr3.ovpn', '/path/to/tr1.ovpn'])
+    history.flagged.assert_called_with(CONFIG_TO_COUNTRY['TR'])
+
+    with self.assertRaises(ValueError):
+      ConfigSelectorService(CONFIG_TO_COUNTRY, 'history')
@@ -0,0 +1,141 @@
+import os
+import socket
+import threading
+import unittest
+
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock
+
+from iplocationchanger.service.control_service import ControlServer
+from iplocationchanger.service.control_service import ControlClient
+from iplocationchanger.service.location_changer_service import TunnelState
+from iplocationchanger.exception.control_service_exception import ControlServiceException
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+
+class TestControlService(unittest.TestCase):
+  def setUp(self):
+    self.td = TemporaryDirectory()
+    self.socket_path = os.path.join(self.td.name, 'ilc.sock')
+    self.lcs = Mock()
+    self.lcs.ovs.pid = None
+    self.lcs.ovs.remote_ip = ''
+    self.lcs.metrics.timings = {'spawn': 0.1}
+    self.lcs.state = Mock(return_value=TunnelState(None, None, None, '', None, 0))
+    self.lcs.disconnect_region = Mock(return_value=0.2)
+    def connect_region(country, timeout):
+      if country == 'XX':
+        self.lcs.ovs.pid = None
+        self.lcs.state.return_value = TunnelState(None, None, None, '', None, 0)
+        raise LocationChangerServiceException(f'Could not connect to {country}')
+      self.lcs.ovs.pid = 4242
+      self.lcs.ovs.remote_ip = '203.0.113.7'
+      self.lcs.state.return_value = TunnelState(country, f'{country}.ovpn', 4242, '198.51.100.9', 1.0, 0)
+    self.lcs.connect_region = Mock(side_effect=connect_region)
+    self.server = ControlServer(self.lcs, self.socket_path, connect_timeout=12)
+    self.server.start()
+
+  def tearDown(self):
+    self.server.close()
+    self.td.cleanup()
+
+  def test_commands(self):
+    with ControlClient(self.socket_path, timeout=5) as client:
+      self.assertEqual(client.request('status')['connected'], False)
+
+      response = client.request('connect', country='TR')
+      self.assertEqual(response['country'], 'TR')
+      self.assertEqual(response['timings'], {'spawn': 0.1})
+      self.lcs.connect_region.assert_called_once_with('TR', 12.0)
+
+      status = client.request('status')
+      self.assertEqual(status['country'], 'TR')
+      self.assertEqual(status['remote_ip'], '203.0.113.7')
+      self.assertEqual(status['exit_ip'], '198.51.100.9')
+      self.assertEqual(status['leases'], 0)
+      self.assertTrue(status['connected'])
+
+      # the health monitor reconnected behind the daemon's back
+      self.lcs.state.return_value = TunnelState('TR', 'TR.ovpn', 4343, '198.51.100.10', 2.0, 1)
+      status = client.request('status')
+      self.assertEqual(status['exit_ip'], '198.51.100.10')
+      self.assertEqual(status['leases'], 1)
+
+      client.request('connect', country='DE', timeout=3)
+      self.lcs.connect_region.assert_called_with('DE', 3.0)
+
+      with self.assertRaisesRegex(ControlServiceException, 'Could not connect to XX'):
+        client.request('connect', country='XX')
+      status = client.request('status')
+      self.assertIsNone(status['country'])
+      self.assertFalse(status['connected'])
+
+      self.assertEqual(client.request('disconnect')['elapsed'], 0.2)
+      self.lcs.disconnect_region.assert_called_once()
+
+  def test_invalid_requests(self):
+    test_cases = [
+      {'case_name': 'not JSON', 'line': b'connect TR\n', 'error': 'Invalid request'},
+      {'case_name': 'not an object', 'line': b'["connect"]\n', 'error': 'Invalid request'},
+      {'case_name': 'unknown command', 'line': b'{"command": "reboot"}\n', 'error': 'Unknown command reboot'},
+      {'case_name': 'no country', 'line': b'{"command": "connect"}\n', 'error': 'requires a country'},
+      {'case_name': 'bad timeout', 'line': b'{"command": "connect", "country": "TR", "timeout": "soon"}\n', 'error': 'Invalid request'},
+    ]
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+      sock.settimeout(5)
+      sock.connect(self.socket_path)
+      f_ptr = sock.makefile('rwb')
+      for tc in test_cases:
+        f_ptr.write(tc['line'])
+        f_ptr.flush()
+        response = f_ptr.readline().decode('utf-8')
+        self.assertIn('"ok": false', response, msg=tc['case_name'])
+        self.assertIn(tc['error'], response, msg=tc['case_name'])
+    self.lcs.connect_region.assert_not_called()
+
+  def test_unexpected_error(self):
+    self.lcs.disconnect_region = Mock(side_effect=ConnectionResetError(104, 'Connection reset by peer'))
+    with ControlClient(self.socket_path, timeout=5) as client:
+      with self.assertRaisesRegex(ControlServiceException, 'disconnect failed: ConnectionResetError'):
+        client.request('disconnect')
+      # the same connection is still served
+      self.assertTrue(client.request('status')['ok'])
+
+  def test_status_during_switch(self):
+    switching = threading.Event()
+    release = threading.Event()
+    def connect_region(country, timeout):
+      switching.set()
+      release.wait(5)
+    self.lcs.connect_region = Mock(side_effect=connect_region)
+
+    def connect():
+      with ControlClient(self.socket_path, timeout=5) as client:
+        client.request('connect', country='TR')
+    thread = threading.Thread(target=connect)
+    thread.start()
+    self.assertTrue(switching.wait(5))
+    with ControlClient(self.socket_path, timeout=5) as client:
+      self.assertTrue(client.request('status')['busy'])
+    release.set()
+    thread.join(5)
+
+  def test_socket_lifecycle(self):
+    # a second daemon must not steal a live socket
+    with self.assertRaises(ControlServiceException):
+      ControlServer(self.lcs, self.socket_path).bind()
+    self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+
+    self.server.close()
+    self.assertFalse(os.path.exists(self.socket_path))
+    with self.assertRaises(ControlServiceException):
+      ControlClient(self.socket_path).request('status')
+
+    # a stale socket file is replaced
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(self.socket_path)
+    stale.close()
+    self.server = ControlServer(self.lcs, self.socket_path)
+    self.server.start()
+    with ControlClient(self.socket_path, timeout=5) as client:
+      self.assertTrue(client.request('status')['ok'])
@@ -0,0 +1,206 @@
+import threading
+import time
+import unittest
+
+from unittest.mock import patch
+from unittest.mock import Mock
+
+from iplocationchanger.service.health_monitor_service import HealthMonitorService
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+
+class TestHealthMonitorService(unittest.TestCase):
+  def setUp(self):
+    self.lcs = Mock()
+    self.lcs.lock = threading.RLock()
+    self.lcs.country = 'TR'
+    self.lcs.switch_count = 0
+    self.lcs.ovs.pid = 4242
+    self.lcs.ovs.dev = 'tun0'
+    self.lcs.ovs.tunnel_stats = Mock(return_value=('CONNECTED', 100, 100))
+    self.lcs.wms.current_location = Mock(return_value=('203.0.113.7', 'TR'))
+    self.events = []
+    self.hms = HealthMonitorService(
+      self.lcs,
+      check_interval=0.01,
+      min_validate_interval=10,
+      max_validate_interval=40,
+      min_backoff=0.001,
+      max_backoff=0.004,
+    )
+    self.hms.add_listener(self.events.append)
+
+  @patch('iplocationchanger.utils.utils.Utils.interface_up')
+  @patch('iplocationchanger.utils.utils.Utils.pid_alive')
+  def test_check_liveness(self, pid_alive_mock, interface_up_mock):
+    test_cases = [
+      {
+        'case_name': 'healthy',
+        'pid': 4242, 'alive': True, 'up': True,
+        'stats': ('CONNECTED', 100, 100),
+        'expected': None,
+      },
+      {
+        'case_name': 'interface state unknown',
+        'pid': 4242, 'alive': True, 'up': None,
+        'stats': ('CONNECTED', 100, 100),
+        'expected': None,
+      },
+      {
+        'case_name': 'no process',
+        'pid': None, 'alive': True, 'up': True,
+        'stats': ('CONNECTED', 100, 100),
+        'expected': 'openvpn is not running',
+      },
+      {
+        'case_name': 'process died',
+        'pid': 4242, 'alive': False, 'up': True,
+        'stats': ('CONNECTED', 100, 100),
+        'expected': 'openvpn is not running',
+      },
+      {
+        'case_name': 'interface down',
+        'pid': 4242, 'alive': True, 'up': False,
+        'stats': ('CONNECTED', 100, 100),
+        'expected': 'tun0 is down',
+      },
+      {
+        'case_name': 'reconnecting',
+        'pid': 4242, 'alive': True, 'up': True,
+        'stats': ('RECONNECTING', 100, 100),
+        'expected': 'openvpn is RECONNECTING',
+      },
+      {
+        'case_name': 'management unreachable',
+        'pid': 4242, 'alive': True, 'up': True,
+        'stats': OpenVPNServiceException('Could not connect to management interface'),
+        'expected': 'Could not connect to management interface',
+      },
+    ]
+
+    for tc in test_cases:
+      self.hms.reset()
+      self.lcs.ovs.pid = tc['pid']
+      pid_alive_mock.return_value = tc['alive']
+      interface_up_mock.return_value = tc['up']
+      self.lcs.ovs.tunnel_stats.side_effect = None
+      if isinstance(tc['stats'], Exception):
+        self.lcs.ovs.tunnel_stats.side_effect = tc['stats']
+      else:
+        self.lcs.ovs.tunnel_stats.return_value = tc['stats']
+      self.assertEqual(self.hms.check_liveness(), tc['expected'], msg=tc['case_name'])
+
+  @patch('iplocationchanger.utils.utils.Utils.interface_up', Mock(return_value=True))
+  @patch('iplocationchanger.utils.utils.Utils.pid_alive', Mock(return_value=True))
+  def test_check_liveness_stall(self):
+    self.hms.stall_checks = 2
+    # bytes out keep growing while nothing comes back
+    stats = [('CONNECTED', 100, 100), ('CONNECTED', 100, 200), ('CONNECTED', 150, 300),
+             ('CONNECTED', 150, 400), ('CONNECTED', 150, 500)]
+    self.lcs.ovs.tunnel_stats.side_effect = stats
+    results = [self.hms.check_liveness() for _ in stats]
+    self.assertEqual(results[:4], [None, None, None, None])
+    self.assertEqual(results[4], 'no traffic received for 2 checks')
+
+  def test_check_location(self):
+    # validation interval doubles while the location stays right
+    self.assertIsNone(self.hms.check_location('TR'))
+    self.assertEqual(self.hms.validate_interval, 20)
+    self.lcs.wms.current_location.return_value = ('203.0.113.7', 'tr')
+    self.assertIsNone(self.hms.check_location('TR'))
+    self.assertIsNone(self.hms.check_location('TR'))
+    self.assertEqual(self.hms.validate_interval, 40)
+    self.assertEqual([e.kind for e in self.events], ['validated'] * 3)
+
+    # an API failure postpones validation without failing the tunnel
+    self.lcs.wms.current_location.side_effect = WhatIsMyIPServiceException('Too many lookups')
+    self.assertIsNone(self.hms.check_location('TR'))
+    self.assertLessEqual(self.hms.next_validation, time.monotonic() + 10)
+
+    self.lcs.wms.current_location.side_effect = None
+    self.lcs.wms.current_location.return_value = ('203.0.113.8', 'DE')
+    self.assertEqual(self.hms.check_location('TR'), 'exit location is DE')
+
+  @patch('iplocationchanger.utils.utils.Utils.interface_up', Mock(return_value=True))
+  @patch('iplocationchanger.utils.utils.Utils.pid_alive', Mock(return_value=False))
+  def test_check_reconnects(self):
+    attempts = []
+    def connect_region(country, timeout):
+      attempts.append(country)
+      if len(attempts) < 4:
+        raise LocationChangerServiceException(f'Could not connect to {country}')
+    self.lcs.connect_region = Mock(side_effect=connect_region)
+    self.hms.validate_interval = 40
+
+    self.hms.check()
+    self.assertEqual(attempts, ['TR'] * 4)
+    self.assertEqual(
+      [e.kind for e in self.events],
+      ['unhealthy'] + ['reconnecting', 'reconnect_failed'] * 3 + ['reconnecting', 'reconnected'],
+    )
+    self.assertEqual(self.events[0].detail, 'openvpn is not running')
+    # learnt state is reset for the new tunnel
+    self.assertEqual(self.hms.validate_interval, 10)
+
+  @patch('iplocationchanger.utils.utils.Utils.interface_up', Mock(return_value=True))
+  @patch('iplocationchanger.utils.utils.Utils.pid_alive', Mock(return_value=False))
+  def test_reconnect_cancelled(self):
+    test_cases = [
+      {'case_name': 'disconnected', 'country': None},
+      {'case_name': 'switched to another country', 'country': 'DE'},
+    ]
+
+    for tc in test_cases:
+      self.lcs.country = 'TR'
+      self.lcs.switch_count = 0
+      self.events.clear()
+      self.hms.min_backoff = 0.2
+      self.lcs.connect_region = Mock(side_effect=LocationChangerServiceException('Could not connect to TR'))
+      def switch():
+        # another caller, during the backoff after the first attempt
+        while self.lcs.connect_region.call_count == 0:
+          time.sleep(0.005)
+        with self.lcs.lock:
+          self.lcs.switch_count += 1
+          self.lcs.country = tc['country']
+      switcher = threading.Thread(target=switch)
+      switcher.start()
+
+      self.hms.check()
+      switcher.join()
+      self.assertEqual(self.lcs.connect_region.call_count, 1, msg=tc['case_name'])
+      self.assertEqual(
+        [e.kind for e in self.events],
+        ['unhealthy', 'reconnecting', 'reconnect_failed'],
+        msg=tc['case_name'],
+      )
+
+  def test_check_skipped(self):
+    test_cases = [
+      {'case_name': 'disconnected', 'country': None, 'busy': False},
+      {'case_name': 'switch in progress', 'country': 'TR', 'busy': True},
+    ]
+
+    for tc in test_cases:
+      self.lcs.country = tc['country']
+      self.lcs.ovs.tunnel_stats.reset_mock()
+      if tc['busy']:
+        holder = threading.Thread(target=self.lcs.lock.acquire)
+        holder.start()
+        holder.join()
+      self.hms.check()
+      self.lcs.ovs.tunnel_stats.assert_not_called()
+      self.lcs.connect_region.assert_not_called()
+
+  @patch('iplocationchanger.utils.utils.Utils.interface_up', Mock(return_value=True))
+  @patch('iplocationchanger.utils.utils.Utils.pid_alive', Mock(return_value=True))
+  def test_start_stop(self):
+    self.hms.start()
+    deadline = time.monotonic() + 5
+    while self.lcs.ovs.tunnel_stats.call_count < 2 and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.hms.stop()
+    self.assertIsNone(self.hms.thread)
+    self.assertGreaterEqual(self.lcs.ovs.tunnel_stats.call_count, 2)
+    self.lcs.connect_region.assert_not_called()
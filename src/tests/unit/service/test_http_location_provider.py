@@ -0,0 +1,90 @@
+import json
+import unittest
+
+from iplocationchanger.service.http_location_provider import HTTPLocationProvider
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+from tests.unit.service.fake_whatismyip_server import FakeWhatIsMyIPServer
+
+class TestHTTPLocationProvider(unittest.TestCase):
+  def test_locate(self):
+    test_cases = [
+      {
+        'case_name': 'flat fields',
+        'ip_field': 'ip',
+        'country_field': 'country',
+        'response': (200, json.dumps({'ip': '203.0.113.7', 'country': 'TR'})),
+        'expected': ('203.0.113.7', 'TR'),
+        'outcome': 'ok',
+      },
+      {
+        'case_name': 'nested fields',
+        'ip_field': 'query',
+        'country_field': 'location.country_code',
+        'response': (200, json.dumps({'query': '203.0.113.7', 'location': {'country_code': 'DE'}})),
+        'expected': ('203.0.113.7', 'DE'),
+        'outcome': 'ok',
+      },
+      {
+        'case_name': 'missing country',
+        'ip_field': 'ip',
+        'country_field': 'country',
+        'response': (200, json.dumps({'ip': '203.0.113.7'})),
+        'expected': None,
+        'outcome': 'api_error',
+      },
+      {
+        'case_name': 'not JSON',
+        'ip_field': 'ip',
+        'country_field': 'country',
+        'response': (200, 'TR'),
+        'expected': None,
+        'outcome': 'api_error',
+      },
+      {
+        'case_name': 'rate limited',
+        'ip_field': 'ip',
+        'country_field': 'country',
+        'response': (429, 'slow down'),
+        'expected': None,
+        'outcome': 'rate_limited',
+      },
+      {
+        'case_name': 'server error',
+        'ip_field': 'ip',
+        'country_field': 'country',
+        'response': (500, 'oops'),
+        'expected': None,
+        'outcome': 'http_error',
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeWhatIsMyIPServer() as fws:
+        fws.queue('/json', *tc['response'])
+        provider = HTTPLocationProvider(
+          'stub',
+          f'{fws.base_url}/json',
+          ip_field=tc['ip_field'],
+          country_field=tc['country_field'],
+          params={'token': 'secret'},
+        )
+        if tc['expected'] is None:
+          with self.assertRaises(LocationProviderException, msg=tc['case_name']):
+            provider.locate()
+        else:
+          self.assertEqual(provider.locate(), tc['expected'], msg=tc['case_name'])
+        self.assertEqual(fws.requests, [('/json', {'token': 'secret'})], msg=tc['case_name'])
+        self.assertEqual(
+          provider.metrics.api_calls.get(endpoint='stub', outcome=tc['outcome']),
+          1,
+          msg=tc['case_name'],
+        )
+
+  def test_from_preset(self):
+    provider = HTTPLocationProvider.from_preset('ip-api', timeout=3)
+    self.assertEqual(provider.name, 'ip-api')
+    self.assertEqual(provider.ip_field, 'query')
+    self.assertEqual(provider.country_field, 'countryCode')
+    self.assertEqual(provider.timeout, 3)
+    with self.assertRaises(LocationProviderException):
+      HTTPLocationProvider.from_preset('nope')
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import socket
+import threading
+import unittest
+
+from tempfile import TemporaryDirectory
+from unittest.mock import AsyncMock
+
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
+from iplocationchanger.service.latency_probe_service import LatencyProbeService
+from iplocationchanger.service.latency_probe_service import hard_reset_packet
+from iplocationchanger.service.latency_probe_service import HARD_RESET_OPCODE
+
+class UDPEchoServer:
+  """Answers every datagram, standing in for an openvpn UDP server."""
+  def __init__(self):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.bind(('127.0.0.1', 0))
+    self.port = self.sock.getsockname()[1]
+    self.received = []
+    self.thread = threading.Thread(target=self.serve, daemon=True)
+    self.thread.start()
+
+  def serve(self):
+    while True:
+      try:
+        data, addr = self.sock.recvfrom(2048)
+      except OSError:
+        return
+      self.received.append(data)
+      self.sock.sendto(b'\x40' + data[1:9], addr)
+
+  def close(self):
+    self.sock.close()
+
+
+class TestLatencyProbeService(unittest.TestCase):
+  def setUp(self):
+    self.td = TemporaryDirectory()
+    self.tcp_server = socket.socket()
+    self.tcp_server.bind(('127.0.0.1', 0))
+    self.tcp_server.listen(8)
+    self.tcp_port = self.tcp_server.getsockname()[1]
+    self.udp_server = UDPEchoServer()
+    # bound but not listening: connections are refused
+    self.closed = socket.socket()
+    self.closed.bind(('127.0.0.1', 0))
+    self.closed_port = self.closed.getsockname()[1]
+    # bound but never answering
+    self.silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.silent.bind(('127.0.0.1', 0))
+    self.silent_port = self.silent.getsockname()[1]
+
+  def tearDown(self):
+    self.tcp_server.close()
+    self.udp_server.close()
+    self.closed.close()
+    self.silent.close()
+    self.td.cleanup()
+
+  def write_config(self, name, text):
+    path = os.path.join(self.td.name, name)
+    with open(path, 'w') as f_ptr:
+      f_ptr.write(text)
+    return path
+
+  def test_hard_reset_packet(self):
+    packet = hard_reset_packet()
+    self.assertEqual(len(packet), 14)
+    self.assertEqual(packet[0], HARD_RESET_OPCODE)
+    self.assertEqual(packet[9:], b'\x00' * 5)
+
+  def test_probe(self):
+    tcp = self.write_config('tcp.ovpn', f'proto tcp\nremote 127.0.0.1 {self.tcp_port}\n')
+    udp = self.write_config('udp.ovpn', f'remote 127.0.0.1 {self.udp_server.port} udp\n')
+    dead = self.write_config('dead.ovpn', f'remote 127.0.0.1 {self.closed_port} tcp\n')
+    # drops the hard reset like a tls-auth server, its host still answers
+    tls_auth = self.write_config('tls_auth.ovpn', f'remote 127.0.0.1 {self.silent_port} udp\n')
+    unprobed = self.write_config('unprobed.ovpn', 'remote 127.0.0.1 1 tcp\n')
+    lps = LatencyProbeService(
+      {'TR': [dead, udp, tcp, tls_auth], 'DE': unprobed},
+      timeout=0.2,
+    )
+
+    results = lps.probe(['TR'])
+    self.assertEqual(len(results), 4)
+    self.assertIsNotNone(results[OpenVPNRemote('127.0.0.1', self.tcp_port, 'tcp')])
+    self.assertIsNotNone(results[OpenVPNRemote('127.0.0.1', self.udp_server.port, 'udp')])
+    self.assertIsNone(results[OpenVPNRemote('127.0.0.1', self.closed_port, 'tcp')])
+    self.assertLess(results[OpenVPNRemote('127.0.0.1', self.silent_port, 'udp')], 0.2)
+    self.assertEqual(self.udp_server.received[0][0], HARD_RESET_OPCODE)
+
+    self.assertEqual(lps.config_score(dead), 0.4)
+    ranked = lps.rank([unprobed, dead, udp, tls_auth, tcp])
+    self.assertEqual(set(ranked[:3]), {udp, tcp, tls_auth})
+    self.assertEqual(ranked[3:], [dead, unprobed])
+
+  def test_probe_udp_no_answer(self):
+    test_cases = [
+      {
+        'case_name': 'host answers over TCP',
+        'probe_tcp': [0.05],
+        'expected': 0.05,
+      },
+      {
+        'case_name': 'connection refused',
+        'probe_tcp': ConnectionRefusedError(),
+        'expected': 0.0,
+      },
+      {
+        'case_name': 'no answer at all',
+        'probe_tcp': asyncio.TimeoutError(),
+        'expected': None,
+      },
+    ]
+
+    remote = OpenVPNRemote('198.51.100.1', 1194, 'udp')
+    for tc in test_cases:
+      lps = LatencyProbeService({}, timeout=0.2)
+      lps.probe_udp = AsyncMock(side_effect=asyncio.TimeoutError())
+      lps.probe_tcp = AsyncMock(side_effect=tc['probe_tcp'])
+      latency = asyncio.run(lps.probe_remote(remote))
+      if tc['expected'] is None:
+        self.assertIsNone(latency, msg=tc['case_name'])
+        # unknown, not charged as unreachable
+        self.assertNotIn(remote, lps.scores, msg=tc['case_name'])
+      else:
+        self.assertAlmostEqual(latency, tc['expected'], places=2, msg=tc['case_name'])
+        self.assertAlmostEqual(lps.scores[remote], tc['expected'], places=2, msg=tc['case_name'])
+
+  def test_record(self):
+    lps = LatencyProbeService({}, timeout=1, alpha=0.5)
+    remote = OpenVPNRemote('198.51.100.1', 1194, 'udp')
+    lps.record(remote, 1.0)
+    lps.record(remote, 3.0)
+    self.assertEqual(lps.scores[remote], 2.0)
+    lps.record(remote, None)
+    self.assertEqual(lps.scores[remote], 2.0)
+
+  def test_unreadable_config(self):
+    lps = LatencyProbeService({'TR': os.path.join(self.td.name, 'missing.ovpn')})
+    self.assertEqual(lps.probe(), {})
+    self.assertIsNone(lps.config_score(os.path.join(self.td.name, 'missing.ovpn')))
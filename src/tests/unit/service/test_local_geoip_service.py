@@ -0,0 +1,67 @@
+import os
+import unittest
+
+from tempfile import TemporaryDirectory
+
+from iplocationchanger.service.local_geoip_service import LocalGeoIPService
+from iplocationchanger.exception.local_geoip_service_exception import LocalGeoIPServiceException
+
+FIXTURE_DB = os.path.join(os.path.dirname(__file__), 'fixtures', 'geoip.csv')
+
+class TestLocalGeoIPService(unittest.TestCase):
+  def test_get_location_from_ip(self):
+    test_cases_valid = [
+      {'ip': '1.0.0.0', 'expected': 'AU'},
+      {'ip': '1.0.0.255', 'expected': 'AU'},
+      {'ip': '95.223.119.45', 'expected': 'DE'},
+      {'ip': '203.0.113.7', 'expected': 'TR'},
+      {'ip': '8.8.8.8', 'expected': 'US'},
+      {'ip': '2001:db8::1', 'expected': 'NL'},
+    ]
+
+    test_cases_invalid = [
+      {'ip': '1.0.1.0'},
+      {'ip': '0.255.255.255'},
+      {'ip': '255.255.255.255'},
+      {'ip': '2001:db9::1'},
+      {'ip': 'not an ip'},
+    ]
+
+    lgs = LocalGeoIPService(FIXTURE_DB)
+    for tc in test_cases_valid:
+      self.assertEqual(lgs.get_location_from_ip(tc['ip']), tc['expected'], msg=tc['ip'])
+
+    for tc in test_cases_invalid:
+      with self.assertRaises(LocalGeoIPServiceException, msg=tc['ip']):
+        lgs.get_location_from_ip(tc['ip'])
+
+  def test_load_invalid(self):
+    test_cases = [
+      {
+        'case_name': 'overlapping ranges',
+        'content': '1.0.0.0,1.0.0.255,AU\n1.0.0.128,1.0.1.0,CN\n',
+      },
+      {
+        'case_name': 'reversed range',
+        'content': '1.0.0.255,1.0.0.0,AU\n',
+      },
+      {
+        'case_name': 'mixed versions',
+        'content': '1.0.0.0,2001:db8::,AU\n',
+      },
+      {
+        'case_name': 'bad column count',
+        'content': '1.0.0.0\n',
+      },
+    ]
+
+    with TemporaryDirectory() as td:
+      for tc in test_cases:
+        path = os.path.join(td, 'db.csv')
+        with open(path, 'w') as f_ptr:
+          f_ptr.write(tc['content'])
+        with self.assertRaises(LocalGeoIPServiceException, msg=tc['case_name']):
+          LocalGeoIPService(path)
+
+      with self.assertRaises(LocalGeoIPServiceException):
+        LocalGeoIPService(os.path.join(td, 'missing.csv'))
@@ -1,12 +1,19 @@
+import os
+import socket
+import threading
+import time
 import unittest
 
+from tempfile import TemporaryDirectory
 from unittest.mock import Mock
 from unittest.mock import patch
 
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
 from iplocationchanger.service.location_changer_service import LocationChangerService
 from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
 from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
 from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+from iplocationchanger.exception.route_service_exception import RouteServiceException
 
 class TestLocationChangerService(unittest.TestCase):
   @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
@@ -91,14 +98,15 @@ class TestLocationChangerService(unittest.TestCase):
 
     lcs = LocationChangerService(
       'api_key',
-      {},
+      {'DE': '/path/to/de.ovpn'},
       'openvpnexec',
     )
     lcs.connect_region(
       country,
       0,
     )
-    OpenVPNServiceMockObject.connect.assert_called_once_with(country)
+    OpenVPNServiceMockObject.connect.assert_called_once_with(country, '/path/to/de.ovpn')
+    OpenVPNServiceMockObject.wait_until_connected.assert_called_once_with(0)
     WhatIsMyIPServiceMockObject.validate_connection.assert_called_once_with(country)
 
     # OpenVPNServiceException
@@ -112,13 +120,32 @@ class TestLocationChangerService(unittest.TestCase):
     with self.assertRaises(LocationChangerServiceException):
       lcs = LocationChangerService(
         'api_key',
-        {},
+        {'DE': '/path/to/de.ovpn'},
+        'openvpnexec',
+      )
+      lcs.connect_region(
+        country,
+        0,
+      )
+
+    # OpenVPNServiceException while waiting for the tunnel
+    OpenVPNServiceMockObject = Mock()
+    OpenVPNServiceMockObject.wait_until_connected = Mock(side_effect=OpenVPNServiceException(''))
+    OpenVPNServiceMock.return_value = OpenVPNServiceMockObject
+    WhatIsMyIPServiceMockObject = Mock()
+    WhatIsMyIPServiceMock.return_value = WhatIsMyIPServiceMockObject
+
+    with self.assertRaises(LocationChangerServiceException):
+      lcs = LocationChangerService(
+        'api_key',
+        {'DE': '/path/to/de.ovpn'},
         'openvpnexec',
       )
       lcs.connect_region(
         country,
         0,
       )
+    WhatIsMyIPServiceMockObject.validate_connection.assert_not_called()
 
     # WhatIsMyIPServiceException
     OpenVPNServiceMockObject = Mock()
@@ -130,10 +157,440 @@ class TestLocationChangerService(unittest.TestCase):
     with self.assertRaises(LocationChangerServiceException):
       lcs = LocationChangerService(
         'api_key',
-        {},
+        {'DE': '/path/to/de.ovpn'},
         'openvpnexec',
       )
       lcs.connect_region(
         country,
         0,
       )
+
+  @patch('iplocationchanger.service.location_changer_service.socket.getaddrinfo')
+  @patch('iplocationchanger.service.location_changer_service.RouteService')
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_switch_region(self, WhatIsMyIPServiceMock, OpenVPNServiceMock, RouteServiceMock, getaddrinfo_mock):
+    td = TemporaryDirectory()
+    self.addCleanup(td.cleanup)
+    config_path = os.path.join(td.name, 'tr.ovpn')
+    with open(config_path, 'w') as f_ptr:
+      f_ptr.write('client\nremote tr.example.com 1194 udp\nremote tr-down.example.com 1194 udp\n')
+    def getaddrinfo(host, port, family, type):
+      if host == 'tr-down.example.com':
+        raise socket.gaierror('Name or service not known')
+      return [(family, type, 0, '', (ip, port)) for ip in ('203.0.113.7', '203.0.113.9')]
+    getaddrinfo_mock.side_effect = getaddrinfo
+
+    def openvpn_service_mock(dev, pid, remote_ip):
+      ovs = Mock()
+      ovs.dev = dev
+      ovs.pid = pid
+      ovs.remote_ip = remote_ip
+      ovs.disconnect = Mock(return_value=0.1)
+      return ovs
+
+    test_cases = [
+      {
+        'case_name': 'switch succeeds',
+        'standby': {},
+        'route_through': None,
+        'validate_connection': None,
+        'expects_exception': False,
+      },
+      {
+        'case_name': 'standby never connects',
+        'standby': {'wait_until_connected': Mock(side_effect=OpenVPNServiceException(''))},
+        'route_through': None,
+        'validate_connection': None,
+        'expects_exception': True,
+      },
+      {
+        'case_name': 'route flip fails',
+        'standby': {},
+        'route_through': [RouteServiceException(''), None],
+        'validate_connection': None,
+        'expects_exception': True,
+      },
+      {
+        'case_name': 'standby in wrong country',
+        'standby': {},
+        'route_through': None,
+        'validate_connection': WhatIsMyIPServiceException(''),
+        'expects_exception': True,
+      },
+    ]
+
+    for tc in test_cases:
+      active = openvpn_service_mock('tun20', 4242, '198.51.100.1')
+      standby = openvpn_service_mock('tun21', 4343, '203.0.113.7')
+      for name, value in tc['standby'].items():
+        setattr(standby, name, value)
+      OpenVPNServiceMock.side_effect = [active, standby]
+      routes = Mock()
+      routes.route_through = Mock(side_effect=tc['route_through'])
+      RouteServiceMock.return_value = routes
+      # the standby's servers are pinned before it starts
+      standby.connect = Mock(side_effect=lambda *_, **__: self.assertEqual(
+        [c.args[0] for c in routes.pin.call_args_list],
+        ['203.0.113.7', '203.0.113.9'],
+        msg=tc['case_name'],
+      ))
+      wms = Mock()
+      wms.validate_connection = Mock(side_effect=tc['validate_connection'])
+      WhatIsMyIPServiceMock.return_value = wms
+
+      lcs = LocationChangerService('api_key', {'TR': config_path}, 'openvpnexec', make_before_break=True)
+      self.assertEqual(
+        [c.kwargs['dev'] for c in OpenVPNServiceMock.call_args_list[-2:]],
+        ['tun20', 'tun21'],
+      )
+
+      if tc['expects_exception']:
+        with self.assertRaises(LocationChangerServiceException, msg=tc['case_name']):
+          lcs.connect_region('TR', 0)
+        # traffic handed back to the active tunnel, standby dropped
+        self.assertIs(lcs.ovs, active, msg=tc['case_name'])
+        routes.route_through.assert_called_with('tun20', '198.51.100.1')
+        standby.disconnect.assert_called_once_with()
+        active.disconnect.assert_not_called()
+        self.assertEqual(
+          sorted(c.args[0] for c in routes.unpin.call_args_list),
+          ['203.0.113.7', '203.0.113.9'],
+          msg=tc['case_name'],
+        )
+        self.assertEqual(lcs.standby_pins, [], msg=tc['case_name'])
+      else:
+        lcs.connect_region('TR', 0)
+        standby.connect.assert_called_once_with(
+          'TR',
+          config_path,
+          remotes=[
+            OpenVPNRemote('203.0.113.7', 1194, 'udp'),
+            OpenVPNRemote('203.0.113.9', 1194, 'udp'),
+          ],
+        )
+        routes.route_through.assert_called_once_with('tun21', '203.0.113.7')
+        wms.validate_connection.assert_called_once_with('TR')
+        # roles swapped and the previous tunnel torn down after the flip
+        self.assertIs(lcs.ovs, standby)
+        self.assertIs(lcs.standby_ovs, active)
+        active.disconnect.assert_called_once_with()
+        # the server the standby did not use, then the previous tunnel's
+        self.assertEqual(
+          [c.args[0] for c in routes.unpin.call_args_list],
+          ['203.0.113.9', '198.51.100.1'],
+        )
+
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_connect_region_failover(self, WhatIsMyIPServiceMock, OpenVPNServiceMock):
+    configs = {'TR': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn', '/path/to/tr3.ovpn']}
+    test_cases = [
+      {
+        'case_name': 'first config dead',
+        'wait_until_connected': [OpenVPNServiceException(''), None],
+        'validate_connection': [None],
+        'expected_attempts': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn'],
+        'expects_exception': False,
+      },
+      {
+        'case_name': 'first config in wrong country',
+        'wait_until_connected': [None, None],
+        'validate_connection': [WhatIsMyIPServiceException(''), None],
+        'expected_attempts': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn'],
+        'expects_exception': False,
+      },
+      {
+        'case_name': 'attempts exhausted',
+        'wait_until_connected': [OpenVPNServiceException('')] * 2,
+        'validate_connection': [],
+        'expected_attempts': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn'],
+        'expects_exception': True,
+      },
+    ]
+
+    for tc in test_cases:
+      ovs = Mock()
+      ovs.pid = None
+      ovs.wait_until_connected = Mock(side_effect=tc['wait_until_connected'])
+      OpenVPNServiceMock.return_value = ovs
+      wms = Mock()
+      wms.validate_connection = Mock(side_effect=tc['validate_connection'])
+      WhatIsMyIPServiceMock.return_value = wms
+
+      lcs = LocationChangerService('api_key', configs, 'openvpnexec', max_config_attempts=2)
+      if tc['expects_exception']:
+        with self.assertRaises(LocationChangerServiceException, msg=tc['case_name']):
+          lcs.connect_region('TR', 0)
+      else:
+        lcs.connect_region('TR', 0)
+
+      self.assertEqual(
+        [c.args[1] for c in ovs.connect.call_args_list],
+        tc['expected_attempts'],
+        msg=tc['case_name'],
+      )
+      # every failed config is torn down before the next one is tried
+      self.assertEqual(ovs.disconnect.call_count, len(tc['expected_attempts']) - (0 if tc['expects_exception'] else 1))
+
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_connect_region_metrics(self, WhatIsMyIPServiceMock, OpenVPNServiceMock):
+    ovs = Mock()
+    ovs.pid = None
+    ovs.wait_until_connected = Mock(side_effect=[None, OpenVPNServiceException('')])
+    OpenVPNServiceMock.return_value = ovs
+
+    lcs = LocationChangerService('api_key', {'DE': '/path/to/de.ovpn'}, 'openvpnexec')
+    # services share the switch's metrics
+    self.assertIs(OpenVPNServiceMock.call_args.kwargs['metrics'], lcs.metrics)
+    self.assertIs(WhatIsMyIPServiceMock.call_args.kwargs['metrics'], lcs.metrics)
+
+    lcs.connect_region('DE', 0)
+    self.assertIn('config_lookup', lcs.metrics.timings)
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.connect_region('DE', 0)
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.connect_region('AR', 0)
+
+    self.assertEqual(lcs.metrics.switches.get(country='DE'), 2)
+    self.assertEqual(lcs.metrics.switch_failures.get(exception='OpenVPNServiceException'), 1)
+    self.assertEqual(lcs.metrics.switch_failures.get(exception='LocationChangerServiceException'), 1)
+    self.assertEqual(lcs.metrics.switch_seconds.count(), 3)
+
+  @patch('iplocationchanger.service.latency_probe_service.LatencyProbeService')
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_connect_region_probe(self, WhatIsMyIPServiceMock, OpenVPNServiceMock, LatencyProbeServiceMock):
+    configs = {'TR': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn'], 'DE': '/path/to/de.ovpn'}
+    ovs = Mock()
+    ovs.pid = None
+    OpenVPNServiceMock.return_value = ovs
+    prober = Mock()
+    prober.rank.side_effect = lambda configs: list(reversed(configs))
+    LatencyProbeServiceMock.return_value = prober
+
+    lcs = LocationChangerService('api_key', configs, 'openvpnexec', config_strategy='probe')
+    lcs.connect_region('TR', 0)
+    prober.probe.assert_called_once_with(['TR'])
+    ovs.connect.assert_called_once_with('TR', '/path/to/tr2.ovpn')
+
+    # a single config is not worth probing
+    lcs.connect_region('DE', 0)
+    prober.probe.assert_called_once()
+
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_connect_region_no_config(self, WhatIsMyIPServiceMock, OpenVPNServiceMock):
+    lcs = LocationChangerService('api_key', {'TR': []}, 'openvpnexec')
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.connect_region('DE', 0)
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.connect_region('TR', 0)
+    OpenVPNServiceMock.return_value.connect.assert_not_called()
+
+  @patch('iplocationchanger.service.location_changer_service.Utils')
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_connect_region_reuse(self, WhatIsMyIPServiceMock, OpenVPNServiceMock, UtilsMock):
+    test_cases = [
+      {
+        'case_name': 'same country, fresh',
+        'country': 'TR', 'reuse_window': 60, 'alive': True, 'invalidate': False,
+        'expected_connects': 1,
+      },
+      {
+        'case_name': 'other country',
+        'country': 'DE', 'reuse_window': 60, 'alive': True, 'invalidate': False,
+        'expected_connects': 2,
+      },
+      {
+        'case_name': 'validation too old',
+        'country': 'TR', 'reuse_window': 0, 'alive': True, 'invalidate': False,
+        'expected_connects': 2,
+      },
+      {
+        'case_name': 'openvpn died',
+        'country': 'TR', 'reuse_window': 60, 'alive': False, 'invalidate': False,
+        'expected_connects': 2,
+      },
+      {
+        'case_name': 'invalidated',
+        'country': 'TR', 'reuse_window': 60, 'alive': True, 'invalidate': True,
+        'expected_connects': 2,
+      },
+    ]
+
+    for tc in test_cases:
+      ovs = Mock()
+      ovs.pid = None
+      def connect(country, config_path, ovs=ovs):
+        ovs.pid = 4242
+      ovs.connect = Mock(side_effect=connect)
+      OpenVPNServiceMock.return_value = ovs
+      WhatIsMyIPServiceMock.return_value.validate_connection = Mock(return_value='203.0.113.7')
+      UtilsMock.pid_alive = Mock(return_value=tc['alive'])
+
+      lcs = LocationChangerService(
+        'api_key',
+        {'TR': '/path/to/tr.ovpn', 'DE': '/path/to/de.ovpn'},
+        'openvpnexec',
+        reuse_window=tc['reuse_window'],
+      )
+      lcs.connect_region('TR', 0)
+      state = lcs.state()
+      self.assertEqual(
+        (state.country, state.config_path, state.pid, state.exit_ip),
+        ('TR', '/path/to/tr.ovpn', 4242, '203.0.113.7'),
+        msg=tc['case_name'],
+      )
+      if tc['invalidate']:
+        lcs.invalidate()
+      time.sleep(0.001)
+      lcs.connect_region(tc['country'], 0)
+      self.assertEqual(ovs.connect.call_count, tc['expected_connects'], msg=tc['case_name'])
+      self.assertEqual(
+        lcs.metrics.switches_reused.get(country='TR'),
+        2 - tc['expected_connects'],
+        msg=tc['case_name'],
+      )
+
+    lcs.disconnect_region()
+    self.assertEqual(lcs.state().country, None)
+    self.assertIsNone(lcs.state().validated_at)
+
+  @patch('iplocationchanger.service.location_changer_service.Utils')
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_lease(self, WhatIsMyIPServiceMock, OpenVPNServiceMock, UtilsMock):
+    ovs = Mock()
+    ovs.pid = None
+    def connect(country, config_path):
+      time.sleep(0.05)
+      ovs.pid = 4242
+    ovs.connect = Mock(side_effect=connect)
+    OpenVPNServiceMock.return_value = ovs
+    UtilsMock.pid_alive = Mock(return_value=True)
+    lcs = LocationChangerService(
+      'api_key',
+      {'TR': '/path/to/tr.ovpn', 'DE': '/path/to/de.ovpn'},
+      'openvpnexec',
+      reuse_window=0,
+    )
+
+    # concurrent callers of one country share a single connect
+    leased = threading.Barrier(4)
+    done = threading.Event()
+    def hold(country):
+      with lcs.lease(country, 0):
+        leased.wait(5)
+        done.wait(5)
+    threads = [threading.Thread(target=hold, args=('TR',)) for _ in range(3)]
+    for thread in threads:
+      thread.start()
+    leased.wait(5)
+    self.assertEqual(lcs.state().leases, 3)
+    self.assertEqual(ovs.connect.call_count, 1)
+
+    # another country is refused while TR is leased
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.connect_region('DE', 0)
+    with self.assertRaises(LocationChangerServiceException):
+      with lcs.lease('DE', 0, wait=0.05):
+        pass
+    done.set()
+    for thread in threads:
+      thread.join(5)
+    self.assertEqual(lcs.state().leases, 0)
+
+    # and served once the last lease is released
+    with lcs.lease('DE', 0, wait=1) as leased_lcs:
+      self.assertIs(leased_lcs, lcs)
+      self.assertEqual(lcs.state().country, 'DE')
+    self.assertEqual([c.args[0] for c in ovs.connect.call_args_list], ['TR', 'DE'])
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.release('DE')
+
+    # a slow first connect does not hold up callers for another country
+    connecting = threading.Event()
+    def slow_connect(country, config_path):
+      connecting.set()
+      time.sleep(0.5)
+      ovs.pid = 4242
+    ovs.connect.side_effect = slow_connect
+    done.clear()
+    def hold_alone():
+      with lcs.lease('TR', 0):
+        done.wait(5)
+    holder = threading.Thread(target=hold_alone)
+    holder.start()
+    connecting.wait(5)
+    start = time.monotonic()
+    with self.assertRaises(LocationChangerServiceException):
+      with lcs.lease('DE', 0, wait=0.05):
+        pass
+    self.assertLess(time.monotonic() - start, 0.3)
+    done.set()
+    holder.join(5)
+    self.assertEqual(lcs.state().leases, 0)
+
+    # a failed connect lets the next caller try
+    ovs.connect.side_effect = OpenVPNServiceException('Could not connect to TR')
+    with self.assertRaises(LocationChangerServiceException):
+      with lcs.lease('TR', 0, wait=1):
+        pass
+    ovs.connect.side_effect = connect
+    with lcs.lease('TR', 0, wait=1):
+      self.assertEqual(lcs.state().leases, 1)
+
+      # the tunnel is not torn down under its lease holders
+      ovs.disconnect.reset_mock()
+      with self.assertRaises(LocationChangerServiceException):
+        lcs.disconnect_region()
+      ovs.disconnect.assert_not_called()
+      self.assertEqual(lcs.state().country, 'TR')
+
+    # unless forced, which drops the leases
+    lcs.acquire('TR', 0)
+    ovs.disconnect.reset_mock()
+    lcs.disconnect_region(force=True)
+    ovs.disconnect.assert_called_once()
+    self.assertEqual((lcs.state().country, lcs.state().leases), (None, 0))
+    with self.assertRaises(LocationChangerServiceException):
+      lcs.release('TR')
+
+  @patch('iplocationchanger.service.location_changer_service.OpenVPNService')
+  @patch('iplocationchanger.service.location_changer_service.WhatIsMyIPService')
+  def test_connect_region_history(self, WhatIsMyIPServiceMock, OpenVPNServiceMock):
+    ovs = Mock()
+    ovs.pid = None
+    OpenVPNServiceMock.return_value = ovs
+    wms = Mock()
+    # the first config exits in the wrong country
+    def validate_connection(country):
+      if wms.validate_connection.call_count == 1:
+        wms.last_location = ('198.51.100.7', 'NL')
+        raise WhatIsMyIPServiceException(f'{country} not NL')
+      wms.last_location = ('203.0.113.7', 'TR')
+      return '203.0.113.7'
+    wms.validate_connection = Mock(side_effect=validate_connection)
+    WhatIsMyIPServiceMock.return_value = wms
+    history = Mock()
+    history.rank.side_effect = lambda configs: configs
+
+    lcs = LocationChangerService(
+      'api_key',
+      {'TR': ['/path/to/tr1.ovpn', '/path/to/tr2.ovpn']},
+      'openvpnexec',
+      config_strategy='history',
+      history=history,
+    )
+    lcs.connect_region('TR', 0)
+    history.rank.assert_called_once_with(['/path/to/tr1.ovpn', '/path/to/tr2.ovpn'])
+    self.assertEqual(
+      [c.args[:5] for c in history.record.call_args_list],
+      [
+        ('/path/to/tr1.ovpn', 'TR', '198.51.100.7', 'NL', False),
+        ('/path/to/tr2.ovpn', 'TR', '203.0.113.7', 'TR', True),
+      ],
+    )
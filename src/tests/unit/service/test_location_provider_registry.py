@@ -0,0 +1,163 @@
+import json
+import unittest
+
+from unittest.mock import Mock
+
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.service.http_location_provider import HTTPLocationProvider
+from iplocationchanger.service.whatismyip_service import WhatIsMyIPService
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
+from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from tests.unit.service.fake_whatismyip_server import FakeWhatIsMyIPServer
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+def provider(name, answer=('203.0.113.7', 'TR')):
+  p = Mock()
+  p.name = name
+  if isinstance(answer, Exception):
+    p.locate = Mock(side_effect=answer)
+  else:
+    p.locate = Mock(return_value=answer)
+  return p
+
+class TestLocationProviderRegistry(unittest.TestCase):
+  def test_schedule(self):
+    clock = FakeClock()
+    registry = LocationProviderRegistry(clock=clock)
+    registry.register(provider('slow'))
+    registry.register(provider('fast'))
+    registry.register(provider('limited'), rate=1 / 60, burst=1)
+    registry.register(provider('new'))
+    registry.observe('slow', 0.5)
+    registry.observe('fast', 0.1)
+    registry.observe('limited', 0.05)
+
+    # never asked first, then by latency
+    self.assertEqual([p.name for p in registry.schedule()], ['new', 'limited', 'fast', 'slow'])
+
+    # out of budget until the bucket refills
+    self.assertTrue(registry.acquire('limited'))
+    self.assertEqual([p.name for p in registry.schedule()], ['new', 'fast', 'slow'])
+    clock.now += 60
+    self.assertEqual(registry.schedule()[1].name, 'limited')
+
+    # a failure sets a cooldown which doubles until a success
+    registry.fail('fast', LocationProviderException('Too many lookups'))
+    self.assertNotIn('fast', [p.name for p in registry.schedule()])
+    clock.now += 1
+    registry.fail('fast', LocationProviderException('Too many lookups'))
+    clock.now += 1
+    self.assertNotIn('fast', [p.name for p in registry.schedule()])
+    clock.now += 1
+    self.assertIn('fast', [p.name for p in registry.schedule()])
+    registry.observe('fast', 0.1)
+    self.assertEqual(registry.failures['fast'], 0)
+
+    # latency is smoothed
+    registry.observe('slow', 1.5)
+    self.assertAlmostEqual(registry.latency['slow'], 0.8)
+
+  def test_locate(self):
+    test_cases = [
+      {
+        'case_name': 'first provider suffices',
+        'quorum': 1,
+        'answers': [('203.0.113.7', 'TR'), ('203.0.113.7', 'TR')],
+        'expected': 'TR',
+        'asked': [True, False],
+      },
+      {
+        'case_name': 'failure falls through',
+        'quorum': 1,
+        'answers': [LocationProviderException('down'), ('203.0.113.7', 'TR')],
+        'expected': 'TR',
+        'asked': [True, True],
+      },
+      {
+        'case_name': 'two of three agree',
+        'quorum': 2,
+        'answers': [('203.0.113.7', 'TR'), ('203.0.113.7', 'DE'), ('203.0.113.7', 'tr')],
+        'expected': 'TR',
+        'asked': [True, True, True],
+      },
+      {
+        'case_name': 'quorum reached without the third',
+        'quorum': 2,
+        'answers': [('203.0.113.7', 'TR'), ('203.0.113.7', 'TR'), ('203.0.113.7', 'TR')],
+        'expected': 'TR',
+        'asked': [True, True, False],
+      },
+      {
+        'case_name': 'no quorum',
+        'quorum': 2,
+        'answers': [('203.0.113.7', 'TR'), ('203.0.113.7', 'DE'), LocationProviderException('down')],
+        'expected': None,
+        'asked': [True, True, True],
+      },
+    ]
+
+    for tc in test_cases:
+      registry = LocationProviderRegistry(quorum=tc['quorum'])
+      providers = [provider(f'p{i}', answer) for i, answer in enumerate(tc['answers'])]
+      for i, p in enumerate(providers):
+        registry.register(p)
+        # keep the schedule in registration order
+        registry.observe(p.name, i)
+      if tc['expected'] is None:
+        with self.assertRaises(LocationProviderException, msg=tc['case_name']):
+          registry.locate()
+      else:
+        self.assertEqual(registry.locate()[1].upper(), tc['expected'], msg=tc['case_name'])
+      self.assertEqual([p.locate.called for p in providers], tc['asked'], msg=tc['case_name'])
+
+  def test_race(self):
+    registry = LocationProviderRegistry()
+    down = provider('down', LocationProviderException('down'))
+    up = provider('up')
+    limited = provider('limited')
+    registry.register(down)
+    registry.register(up)
+    registry.register(limited, rate=1 / 3600, burst=1)
+    registry.acquire('limited')
+
+    self.assertEqual(registry.race(), ('203.0.113.7', 'TR'))
+    limited.locate.assert_not_called()
+    self.assertEqual(registry.failures['down'], 1)
+
+    registry.fail('up', LocationProviderException('down'))
+    with self.assertRaises(LocationProviderException):
+      registry.race()
+
+  def test_stub_providers(self):
+    # WhatIsMyIP is rate limited, the two other providers agree
+    with FakeWhatIsMyIPServer(country='TR') as fws:
+      fws.queue('/ip-address-lookup.php', 200, '3')
+      fws.queue('/ipinfo', 200, json.dumps({'ip': fws.ip, 'country': 'TR'}))
+      fws.queue('/ip-api', 200, json.dumps({'query': fws.ip, 'countryCode': 'TR'}))
+      registry = LocationProviderRegistry(quorum=2)
+      ws = WhatIsMyIPService(
+        'apikeyisthisstring',
+        base_url=fws.base_url,
+        backoff_factor=10,
+        validation='scheduled',
+        registry=registry,
+      )
+      self.assertIn('whatismyip', registry)
+      registry.register(HTTPLocationProvider('ipinfo', f'{fws.base_url}/ipinfo'))
+      registry.register(HTTPLocationProvider('ip-api', f'{fws.base_url}/ip-api', ip_field='query', country_field='countryCode'))
+      ws.validate_connection('TR')
+      # the rate limited answer was not retried
+      self.assertEqual([path for path, _ in fws.requests].count('/ip-address-lookup.php'), 1)
+      self.assertEqual(registry.failures['whatismyip'], 1)
+      self.assertEqual(ws.metrics.phase_seconds.count(phase='locate'), 1)
+
+      fws.queue('/ipinfo', 200, json.dumps({'ip': fws.ip, 'country': 'DE'}))
+      fws.queue('/ip-api', 200, json.dumps({'query': fws.ip, 'countryCode': 'TR'}))
+      with self.assertRaisesRegex(WhatIsMyIPServiceException, 'No 2 location providers agreed'):
+        ws.validate_connection('TR')
@@ -0,0 +1,141 @@
+import socket
+import time
+import unittest
+
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
+from iplocationchanger.service.openvpn_management_client import OpenVPNManagementClient
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+from tests.unit.service.fake_openvpn_management import FakeOpenVPNManagement
+
+class TestOpenVPNManagementClient(unittest.TestCase):
+  def test_wait_for_state(self):
+    test_cases = [
+      {
+        'case_name': 'connected after transitions',
+        'current_state': 'WAIT',
+        'states': ['AUTH', 'GET_CONFIG', 'CONNECTED'],
+      },
+      {
+        'case_name': 'already connected',
+        'current_state': 'CONNECTED',
+        'states': [],
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeOpenVPNManagement(tc['states'], current_state=tc['current_state']) as fom:
+        with OpenVPNManagementClient('127.0.0.1', fom.port) as omc:
+          start = time.monotonic()
+          fields = omc.wait_for_state('CONNECTED', timeout=5)
+          self.assertLess(time.monotonic() - start, 2, msg=tc['case_name'])
+          self.assertEqual(fields[1], 'CONNECTED', msg=tc['case_name'])
+          self.assertEqual(fields[4], '203.0.113.7', msg=tc['case_name'])
+          self.assertEqual(
+            list(omc.state_times),
+            [tc['current_state']] + tc['states'],
+            msg=tc['case_name'],
+          )
+        self.assertEqual(fom.commands[:2], ['state on', 'state'], msg=tc['case_name'])
+
+  def test_wait_for_state_failure(self):
+    test_cases = [
+      {
+        'case_name': 'exiting',
+        'states': ['AUTH', 'EXITING'],
+        'timeout': 5,
+      },
+      {
+        'case_name': 'deadline exceeded',
+        'states': ['AUTH'],
+        'timeout': 0.3,
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeOpenVPNManagement(tc['states']) as fom:
+        with OpenVPNManagementClient('127.0.0.1', fom.port) as omc:
+          with self.assertRaises(OpenVPNServiceException, msg=tc['case_name']):
+            omc.wait_for_state('CONNECTED', timeout=tc['timeout'])
+
+  def test_current_state_and_load_stats(self):
+    with FakeOpenVPNManagement([], current_state='CONNECTED', bytes_in=1234, bytes_out=5678) as fom:
+      with OpenVPNManagementClient('127.0.0.1', fom.port) as omc:
+        omc.open(timeout=2)
+        self.assertEqual(omc.current_state(timeout=2)[1], 'CONNECTED')
+        self.assertEqual(omc.load_stats(timeout=2), (1234, 5678))
+      self.assertEqual(fom.commands, ['state', 'load-stats'])
+
+  def test_open_unreachable(self):
+    # grab a free port and release it so nothing listens there
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    omc = OpenVPNManagementClient('127.0.0.1', port)
+    with self.assertRaises(OpenVPNServiceException):
+      omc.open(timeout=0.3)
+
+  def test_send_command_error(self):
+    with FakeOpenVPNManagement() as fom:
+      with OpenVPNManagementClient('127.0.0.1', fom.port) as omc:
+        omc.open(timeout=2)
+        with self.assertRaises(OpenVPNServiceException):
+          omc.send_command('unsupported')
+
+  def test_connection_reset(self):
+    test_cases = [
+      {
+        'case_name': 'reset while waiting for a response',
+        'reset_on': 'state on',
+      },
+      {
+        'case_name': 'reset while waiting for a state',
+        'reset_on': 'state',
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeOpenVPNManagement(['AUTH', 'CONNECTED'], reset_on=tc['reset_on']) as fom:
+        with OpenVPNManagementClient('127.0.0.1', fom.port) as omc:
+          with self.assertRaises(OpenVPNServiceException, msg=tc['case_name']):
+            omc.wait_for_state('CONNECTED', timeout=2)
+          # writing to the reset socket fails the same way
+          with self.assertRaises(OpenVPNServiceException, msg=tc['case_name']):
+            for _ in range(3):
+              omc.send_command('state', timeout=2)
+
+  def test_wait_for_state_credentials(self):
+    test_cases = [
+      {
+        'case_name': 'credentials given',
+        'credentials': OpenVPNCredentials('user', 'secret'),
+        'error': '',
+      },
+      {
+        'case_name': 'wrong credentials',
+        'credentials': OpenVPNCredentials('user', 'wrong'),
+        'error': 'authentication failed',
+      },
+      {
+        'case_name': 'no credentials',
+        'credentials': None,
+        'error': "'Auth' password",
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeOpenVPNManagement(['AUTH', 'CONNECTED'], credentials=('user', 'secret')) as fom:
+        with OpenVPNManagementClient('127.0.0.1', fom.port, credentials=tc['credentials']) as omc:
+          if len(tc['error']) > 0:
+            with self.assertRaises(OpenVPNServiceException, msg=tc['case_name']) as cm:
+              omc.wait_for_state('CONNECTED', timeout=2)
+            self.assertIn(tc['error'], str(cm.exception), msg=tc['case_name'])
+            continue
+          fields = omc.wait_for_state('CONNECTED', timeout=2)
+        self.assertEqual(fields[1], 'CONNECTED', msg=tc['case_name'])
+        self.assertEqual(
+          fom.commands,
+          ['state on', 'state', 'username "Auth" "user"', 'password "Auth" "secret"'],
+          msg=tc['case_name'],
+        )
@@ -1,9 +1,19 @@
+import os
+import signal
+import sys
+import time
 import unittest
 
 from unittest.mock import patch
 from unittest.mock import Mock
 
+from tempfile import TemporaryDirectory
+
+from iplocationchanger.model.openvpn_config import OpenVPNRemote
+from iplocationchanger.model.openvpn_credentials import OpenVPNCredentials
 from iplocationchanger.service.openvpn_service import OpenVPNService
+from iplocationchanger.utils.utils import Utils
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
 from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
 
 class TestOpenVPNService(unittest.TestCase):
@@ -35,29 +45,31 @@ class TestOpenVPNService(unittest.TestCase):
   def test_disconnect(self, UtilsMock):
     test_cases = [
       {
-        'success': True,
-        'stdout': 'success',
-        'stderr': 'error message',
-        'expected': True,
-        'case_name': 'True from success',
+        'pid': 4242,
+        'teardown': 0.25,
+        'expected': 0.25,
+        'case_name': 'terminates own daemon',
+      },
+      {
+        'pid': None,
+        'teardown': 0.25,
+        'expected': 0.0,
+        'case_name': 'nothing to disconnect',
       },
     ]
 
     for tc in test_cases:
       ovs = OpenVPNService({}, '')
+      ovs.pid = tc['pid']
+      UtilsMock.terminate_pid = Mock(return_value=tc['teardown'])
 
-      UtilsMock.run_proc = Mock(return_value=(
-        True,
-        tc['stdout'],
-        tc['stderr'],
-      ))
-
-      ovs.disconnect()
-
-      UtilsMock.run_proc.assert_called_once_with(
-        ['sudo', 'killall', 'openvpn'],
-        expect_error = True,
-      )
+      self.assertEqual(ovs.disconnect(timeout=3), tc['expected'], msg=tc['case_name'])
+      self.assertIsNone(ovs.pid)
+      if tc['pid'] is None:
+        UtilsMock.terminate_pid.assert_not_called()
+      else:
+        UtilsMock.terminate_pid.assert_called_once_with(tc['pid'], 3)
+      UtilsMock.run_proc.assert_not_called()
 
   @patch('iplocationchanger.service.openvpn_service.Utils')
   def test_connect(self, UtilsMock):
@@ -140,8 +152,10 @@ class TestOpenVPNService(unittest.TestCase):
         tc['stdout'],
         tc['stderr'],
       ))
+      UtilsMock.wait_for_pid_file = Mock(return_value=4242)
 
       ovs.connect(tc['country'])
+      self.assertEqual(ovs.pid, 4242)
 
       if len(tc['country']) != 0:
         run_proc_args = [
@@ -150,6 +164,8 @@ class TestOpenVPNService(unittest.TestCase):
           '--config', tc['config_path'],
           '--script-security', '2',
           '--daemon', tc['openvpn_daemon_name'],
+          '--writepid', ovs.pid_path,
+          '--management', '127.0.0.1', '7505',
         ]
         if tc['has_credentials']:
           run_proc_args.extend(
@@ -177,3 +193,138 @@ class TestOpenVPNService(unittest.TestCase):
 
       with self.assertRaises(OpenVPNServiceException, msg=tc['case_name']):
         ovs.connect(tc['country'])
+
+    # openvpn started but never wrote its pid
+    ovs = OpenVPNService({'BR': '/path/to/config2.ovpn'}, 'usr/bin/openvpn')
+    UtilsMock.run_proc = Mock(return_value=(True, '', ''))
+    UtilsMock.wait_for_pid_file = Mock(return_value=None)
+    with self.assertRaises(OpenVPNServiceException):
+      ovs.connect('BR')
+
+    # the pid file of a previous daemon is removed before spawning
+    with open(ovs.pid_path, 'w') as f_ptr:
+      f_ptr.write('4242\n')
+    UtilsMock.run_proc = Mock(side_effect=lambda cmd: (not os.path.exists(ovs.pid_path), '', ''))
+    UtilsMock.wait_for_pid_file = Mock(return_value=4343)
+    ovs.connect('BR')
+    self.assertEqual(ovs.pid, 4343)
+
+  def test_connect_cmd_catalogue(self):
+    with TemporaryDirectory() as td:
+      config_path = os.path.join(td, 'tr.ovpn')
+      with open(config_path, 'w') as f_ptr:
+        f_ptr.write('client\nremote tr.example.com 1194\n')
+      ovs = OpenVPNService(ConfigCatalogueService({'TR': config_path}), 'openvpn')
+      self.assertIn(config_path, ovs.connect_cmd('TR'))
+
+      # broken after the catalogue was loaded
+      with open(config_path, 'w') as f_ptr:
+        f_ptr.write('client\n')
+      os.utime(config_path, ns=(0, 10 ** 9))
+      with self.assertRaises(OpenVPNServiceException):
+        ovs.connect_cmd('TR', config_path)
+
+  def test_connect_cmd_credentials(self):
+    ovs = OpenVPNService(
+      {'TR': '/assets/tr.ovpn'},
+      'openvpn',
+      credentials_path='path/to/credentials',
+      credentials=OpenVPNCredentials('user', 'secret'),
+    )
+    cmd = ovs.connect_cmd('TR')
+    self.assertEqual(cmd[-2:], ['--management-query-passwords', '--auth-user-pass'])
+    self.assertNotIn('path/to/credentials', cmd)
+    self.assertNotIn('secret', ' '.join(cmd))
+
+  def test_connect_cmd_remotes(self):
+    ovs = OpenVPNService({'TR': '/assets/tr.ovpn'}, 'openvpn')
+    cmd = ovs.connect_cmd('TR', remotes=[
+      OpenVPNRemote('203.0.113.7', 1194, 'udp'),
+      OpenVPNRemote('203.0.113.8', 443, 'tcp-client'),
+    ])
+    self.assertEqual(
+      cmd[:cmd.index('--config')],
+      [
+        'sudo', 'openvpn',
+        '--auth-retry', 'nointeract',
+        '--remote', '203.0.113.7', '1194', 'udp',
+        '--remote', '203.0.113.8', '443', 'tcp-client',
+      ],
+    )
+    self.assertNotIn('--remote', ovs.connect_cmd('TR'))
+
+  def test_connect_cmd_foreground(self):
+    ovs = OpenVPNService({'TR': '/assets/tr.ovpn'}, 'openvpn', foreground=True)
+    cmd = ovs.connect_cmd('TR')
+    self.assertNotIn('--daemon', cmd)
+    self.assertIn('--writepid', cmd)
+    self.assertIn('--daemon', OpenVPNService({'TR': '/assets/tr.ovpn'}, 'openvpn').connect_cmd('TR'))
+
+  @patch.object(Utils, 'terminate_pid')
+  def test_spawn_foreground(self, terminate_pid_mock):
+    def terminate_pid(pid, timeout):
+      os.kill(pid, signal.SIGTERM)
+      return 0.1
+    terminate_pid_mock.side_effect = terminate_pid
+    ovs = OpenVPNService({}, 'openvpn', foreground=True)
+    lines = []
+    ovs.add_log_listener(lines.append)
+
+    # stands in for openvpn: writes its pid, logs and runs until terminated
+    fake_openvpn = [sys.executable, '-c', (
+      'import os, sys, time\n'
+      f'open({ovs.pid_path!r}, "w").write(str(os.getpid()))\n'
+      'print("Initialization Sequence Completed", flush=True)\n'
+      'time.sleep(10)\n'
+    )]
+    ovs.spawn_foreground('TR', fake_openvpn)
+    self.assertEqual(ovs.pid, ovs.process.pid)
+    deadline = time.monotonic() + 5
+    while len(lines) == 0 and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(lines, ['Initialization Sequence Completed'])
+
+    self.assertGreaterEqual(ovs.disconnect(timeout=2), 0.1)
+    self.assertIsNone(ovs.pid)
+    self.assertIsNone(ovs.process)
+
+    # exits before writing its pid
+    failing_openvpn = [sys.executable, '-c', 'import sys; print("Options error: bad option", file=sys.stderr); sys.exit(1)']
+    ovs.clear_pid_file()
+    with self.assertRaises(OpenVPNServiceException) as cm:
+      ovs.spawn_foreground('TR', failing_openvpn)
+    self.assertIn('exit status 1', str(cm.exception))
+    self.assertIn('Options error: bad option', str(cm.exception))
+    self.assertIsNone(ovs.process)
+
+  @patch('iplocationchanger.service.openvpn_service.OpenVPNManagementClient')
+  def test_wait_until_connected(self, OpenVPNManagementClientMock):
+    omc = Mock()
+    def wait_for_state(state, timeout):
+      time.sleep(0.02)
+      omc.state_times = {'WAIT': time.monotonic()}
+      time.sleep(0.02)
+      omc.state_times['GET_CONFIG'] = time.monotonic()
+      time.sleep(0.02)
+      return ['1', 'CONNECTED', 'SUCCESS']
+    omc.wait_for_state = Mock(side_effect=wait_for_state)
+    OpenVPNManagementClientMock.return_value.__enter__ = Mock(return_value=omc)
+    OpenVPNManagementClientMock.return_value.__exit__ = Mock(return_value=False)
+
+    ovs = OpenVPNService({}, '', management_port=7600)
+    ovs.wait_until_connected(12)
+
+    OpenVPNManagementClientMock.assert_called_once_with('127.0.0.1', 7600, credentials=None)
+    omc.wait_for_state.assert_called_once_with('CONNECTED', 12)
+    # the wait is split where authentication completed
+    self.assertGreaterEqual(ovs.metrics.timings['handshake'], 0.04)
+    self.assertGreaterEqual(ovs.metrics.timings['tunnel_up'], 0.02)
+    self.assertLess(ovs.metrics.timings['tunnel_up'], ovs.metrics.timings['handshake'])
+
+    omc.wait_for_state = Mock(side_effect=OpenVPNServiceException('timed out'))
+    omc.state_times = {'WAIT': time.monotonic()}
+    ovs.metrics.start_switch()
+    with self.assertRaises(OpenVPNServiceException):
+      ovs.wait_until_connected(12)
+    self.assertNotIn('tunnel_up', ovs.metrics.timings)
+    self.assertEqual(ovs.metrics.phase_seconds.count(phase='handshake'), 2)
@@ -0,0 +1,129 @@
+import os
+import time
+import unittest
+
+from unittest.mock import call
+from unittest.mock import Mock
+
+from iplocationchanger.service.region_executor_service import RegionExecutorService
+from iplocationchanger.exception.region_executor_service_exception import RegionExecutorServiceException
+from iplocationchanger.exception.tunnel_pool_service_exception import TunnelPoolServiceException
+
+# jobs are unpickled in the worker processes, so they live at module level
+def whoami(country, delay=0):
+  time.sleep(delay)
+  return country, os.getpid()
+
+def fail(message):
+  raise ValueError(message)
+
+def die():
+  os._exit(1)
+
+
+def fake_pool(broken=()):
+  """Tunnel pool whose tunnels run the workers on the host."""
+  pool = Mock()
+  def open_tunnel(country, timeout):
+    if country in broken:
+      raise TunnelPoolServiceException(f'Could not connect to {country}')
+    tunnel = Mock()
+    tunnel.country = country
+    tunnel.namespace = f'ns-{country}'
+    tunnel.netns_cmd = lambda cmd: cmd
+    return tunnel
+  pool.open = Mock(side_effect=open_tunnel)
+  return pool
+
+
+class TestRegionExecutorService(unittest.TestCase):
+  def test_submit(self):
+    pool = fake_pool()
+    with RegionExecutorService(pool, max_workers=2, connect_timeout=7) as executor:
+      futures = [
+        executor.submit(country, whoami, country)
+        for country in ['TR', 'DE', 'TR', 'DE', 'TR']
+      ]
+      results = [future.result(timeout=10) for future in futures]
+
+    self.assertEqual([country for country, _ in results], ['TR', 'DE', 'TR', 'DE', 'TR'])
+    pids = {}
+    for country, pid in results:
+      pids.setdefault(country, set()).add(pid)
+    # consecutive jobs of a country reuse its worker
+    self.assertEqual(len(pids['TR']), 1)
+    self.assertEqual(len(pids['DE']), 1)
+    self.assertNotEqual(pids['TR'], pids['DE'])
+    self.assertNotIn(os.getpid(), pids['TR'])
+    self.assertEqual(sorted(pool.open.call_args_list), [call('DE', 7), call('TR', 7)])
+    self.assertEqual(sorted(c.args[0] for c in pool.close.call_args_list), ['DE', 'TR'])
+
+    with self.assertRaises(RegionExecutorServiceException):
+      executor.submit('TR', whoami, 'TR')
+
+  def test_scheduling(self):
+    test_cases = [
+      {
+        'case_name': 'country drained before switching',
+        'jobs': ['TR', 'DE', 'TR', 'TR'],
+        'batch': 16,
+        'expected_opens': ['TR', 'DE'],
+      },
+      {
+        'case_name': 'switching after a batch',
+        'jobs': ['TR', 'DE', 'TR', 'TR', 'TR'],
+        'batch': 2,
+        'expected_opens': ['TR', 'DE', 'TR'],
+      },
+      {
+        'case_name': 'most jobs first',
+        'jobs': ['TR', 'DE', 'AR', 'AR'],
+        'batch': 16,
+        'expected_opens': ['TR', 'AR', 'DE'],
+      },
+    ]
+
+    for tc in test_cases:
+      pool = fake_pool()
+      with RegionExecutorService(pool, max_workers=1, batch=tc['batch']) as executor:
+        # the first job holds the only worker until every job is queued
+        futures = [executor.submit(tc['jobs'][0], whoami, tc['jobs'][0], 0.5)]
+        futures += [executor.submit(country, whoami, country) for country in tc['jobs'][1:]]
+        for future in futures:
+          future.result(timeout=10)
+      self.assertEqual(
+        [c.args[0] for c in pool.open.call_args_list],
+        tc['expected_opens'],
+        msg=tc['case_name'],
+      )
+
+  def test_errors(self):
+    pool = fake_pool(broken=('AR',))
+    with RegionExecutorService(pool) as executor:
+      failed = executor.submit('TR', fail, 'bad response')
+      with self.assertRaises(ValueError):
+        failed.result(timeout=10)
+
+      died = executor.submit('TR', die)
+      with self.assertRaises(RegionExecutorServiceException):
+        died.result(timeout=10)
+      # a new worker takes over
+      self.assertEqual(executor.submit('TR', whoami, 'TR').result(timeout=10)[0], 'TR')
+
+      unreachable = executor.submit('AR', whoami, 'AR')
+      with self.assertRaises(RegionExecutorServiceException):
+        unreachable.result(timeout=10)
+      self.assertIsInstance(unreachable.exception().__cause__, TunnelPoolServiceException)
+
+  def test_shutdown_cancel(self):
+    pool = fake_pool()
+    executor = RegionExecutorService(pool, max_workers=1)
+    running = executor.submit('TR', whoami, 'TR', 0.5)
+    queued = executor.submit('DE', whoami, 'DE')
+    deadline = time.monotonic() + 5
+    while not running.running() and time.monotonic() < deadline:
+      time.sleep(0.01)
+    executor.shutdown(cancel_futures=True)
+    self.assertEqual(running.result()[0], 'TR')
+    self.assertTrue(queued.cancelled())
+    self.assertEqual([c.args[0] for c in pool.open.call_args_list], ['TR'])
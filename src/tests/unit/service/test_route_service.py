@@ -0,0 +1,76 @@
+import subprocess
+import unittest
+
+from unittest.mock import Mock
+from unittest.mock import call
+from unittest.mock import patch
+
+from iplocationchanger.service.route_service import RouteService
+from iplocationchanger.exception.route_service_exception import RouteServiceException
+
+class TestRouteService(unittest.TestCase):
+  @patch('iplocationchanger.service.route_service.Utils')
+  def test_default_gateway(self, UtilsMock):
+    test_cases_valid = [
+      {
+        'stdout': 'default via 192.168.1.1 dev eth0 proto dhcp metric 100\n',
+        'expected': ('192.168.1.1', 'eth0'),
+      },
+      {
+        'stdout': 'default via 10.0.2.2 dev enp0s3 \n',
+        'expected': ('10.0.2.2', 'enp0s3'),
+      },
+    ]
+
+    test_cases_invalid = [
+      {'stdout': ''},
+      {'stdout': 'default dev wg0 scope link\n'},
+    ]
+
+    for tc in test_cases_valid:
+      UtilsMock.run_proc = Mock(return_value=(True, tc['stdout'], ''))
+      rs = RouteService()
+      self.assertEqual(rs.default_gateway(), tc['expected'])
+      # looked up once
+      rs.default_gateway()
+      UtilsMock.run_proc.assert_called_once_with(['ip', 'route', 'show', 'default'])
+
+    for tc in test_cases_invalid:
+      UtilsMock.run_proc = Mock(return_value=(True, tc['stdout'], ''))
+      with self.assertRaises(RouteServiceException):
+        RouteService().default_gateway()
+
+  @patch('iplocationchanger.service.route_service.Utils')
+  def test_route_through(self, UtilsMock):
+    UtilsMock.run_proc = Mock(return_value=(True, 'default via 192.168.1.1 dev eth0\n', ''))
+    rs = RouteService()
+    rs.route_through('tun21', '203.0.113.7')
+
+    UtilsMock.run_proc.assert_has_calls([
+      call(['sudo', 'ip', 'route', 'replace', '203.0.113.7/32', 'via', '192.168.1.1', 'dev', 'eth0']),
+      call(['sudo', 'ip', 'route', 'replace', '0.0.0.0/1', 'dev', 'tun21']),
+      call(['sudo', 'ip', 'route', 'replace', '128.0.0.0/1', 'dev', 'tun21']),
+    ])
+
+    UtilsMock.run_proc = Mock(side_effect=subprocess.CalledProcessError(2, []))
+    with self.assertRaises(RouteServiceException):
+      rs.route_through('tun20', '203.0.113.8')
+
+  @patch('iplocationchanger.service.route_service.Utils')
+  def test_pin(self, UtilsMock):
+    UtilsMock.run_proc = Mock(return_value=(True, 'default via 192.168.1.1 dev eth0\n', ''))
+    RouteService().pin('203.0.113.9')
+    UtilsMock.run_proc.assert_called_with(
+      ['sudo', 'ip', 'route', 'replace', '203.0.113.9/32', 'via', '192.168.1.1', 'dev', 'eth0'],
+    )
+
+  @patch('iplocationchanger.service.route_service.Utils')
+  def test_clear_unpin(self, UtilsMock):
+    rs = RouteService()
+    rs.clear()
+    rs.unpin('203.0.113.7')
+    UtilsMock.run_proc.assert_has_calls([
+      call(['sudo', 'ip', 'route', 'del', '0.0.0.0/1'], expect_error=True),
+      call(['sudo', 'ip', 'route', 'del', '128.0.0.0/1'], expect_error=True),
+      call(['sudo', 'ip', 'route', 'del', '203.0.113.7/32'], expect_error=True),
+    ])
@@ -0,0 +1,186 @@
+import os
+import threading
+import unittest
+
+from tempfile import TemporaryDirectory
+from unittest.mock import call
+from unittest.mock import patch
+from unittest.mock import Mock
+
+from iplocationchanger.service.sweep_service import SweepService
+from iplocationchanger.service.config_catalogue_service import ConfigCatalogueService
+from iplocationchanger.exception.location_changer_service_exception import LocationChangerServiceException
+
+class TestSweepService(unittest.TestCase):
+  def setUp(self):
+    self.td = TemporaryDirectory()
+    self.configs = {
+      'TR': [
+        self.write('tr1.ovpn', 'client\nremote tr1.example.com 1194 udp\n'),
+        self.write('tr2.ovpn', 'client\nremote tr2.example.com 443 tcp\n'),
+      ],
+      'DE': [self.write('de.ovpn', 'client\nremote de.example.com 1194\n')],
+      'AR': [self.write('ar.ovpn', 'client\nremote ar.example.com 1194\n')],
+    }
+    self.lcs = Mock()
+    self.lcs.selector.config_to_country = self.configs
+    self.lcs.prober = None
+
+  def tearDown(self):
+    self.td.cleanup()
+
+  def write(self, name, content):
+    path = os.path.join(self.td.name, name)
+    with open(path, 'w') as f_ptr:
+      f_ptr.write(content)
+    return path
+
+  def test_run(self):
+    sweep = SweepService(self.lcs, connect_timeout=5)
+    report = sweep.run(['TR', 'DE', 'AR'], lambda country: country.lower())
+
+    self.assertEqual(list(report.results), ['TR', 'DE', 'AR'])
+    self.assertEqual(report.failed(), [])
+    self.assertEqual(report.results['DE'].result, 'de')
+    self.assertEqual(report.results['DE'].attempts, 1)
+    self.lcs.connect_region.assert_has_calls([
+      call('TR', 5, probe=True),
+      call('DE', 5, probe=True),
+      call('AR', 5, probe=True),
+    ])
+    self.lcs.disconnect_region.assert_called_once()
+
+  def test_retry(self):
+    test_cases = [
+      {
+        'case_name': 'connect fails once',
+        'connect_failures': {'DE': 1},
+        'task_failures': {},
+        'retries': 1,
+        'expected_failed': [],
+        'expected_order': ['TR', 'DE', 'AR', 'DE'],
+      },
+      {
+        'case_name': 'task fails once',
+        'connect_failures': {},
+        'task_failures': {'TR': 1},
+        'retries': 1,
+        'expected_failed': [],
+        'expected_order': ['TR', 'DE', 'AR', 'TR'],
+      },
+      {
+        'case_name': 'connect raises another error',
+        'connect_failures': {'DE': 1},
+        'connect_error': OSError(104, 'Connection reset by peer'),
+        'task_failures': {},
+        'retries': 1,
+        'expected_failed': [],
+        'expected_order': ['TR', 'DE', 'AR', 'DE'],
+      },
+      {
+        'case_name': 'no retries',
+        'connect_failures': {'DE': 1},
+        'task_failures': {},
+        'retries': 0,
+        'expected_failed': ['DE'],
+        'expected_order': ['TR', 'DE', 'AR'],
+      },
+      {
+        'case_name': 'retries exhausted',
+        'connect_failures': {'DE': 3},
+        'task_failures': {'AR': 3},
+        'retries': 2,
+        'expected_failed': ['DE', 'AR'],
+        'expected_order': ['TR', 'DE', 'AR', 'DE', 'AR', 'DE', 'AR'],
+      },
+    ]
+
+    for tc in test_cases:
+      self.lcs.reset_mock()
+      connect_failures = dict(tc['connect_failures'])
+      task_failures = dict(tc['task_failures'])
+      def connect_region(country, timeout, probe=True):
+        if connect_failures.get(country, 0) > 0:
+          connect_failures[country] -= 1
+          if tc.get('connect_error') is not None:
+            raise tc['connect_error']
+          try:
+            raise TimeoutError('no CONNECTED')
+          except TimeoutError as e:
+            raise LocationChangerServiceException(f'Could not connect to {country}') from e
+      def task(country):
+        if task_failures.get(country, 0) > 0:
+          task_failures[country] -= 1
+          raise ValueError('bad response')
+        return country
+      self.lcs.connect_region.side_effect = connect_region
+
+      report = SweepService(self.lcs, retries=tc['retries']).run(['TR', 'DE', 'AR'], task)
+      self.assertEqual(report.failed(), tc['expected_failed'], msg=tc['case_name'])
+      self.assertEqual(
+        [c.args[0] for c in self.lcs.connect_region.call_args_list],
+        tc['expected_order'],
+        msg=tc['case_name'],
+      )
+      self.assertEqual(list(report.results), ['TR', 'DE', 'AR'], msg=tc['case_name'])
+      self.lcs.disconnect_region.assert_called_once()
+
+    self.assertEqual(report.results['DE'].attempts, 3)
+    self.assertEqual(report.results['DE'].error, 'Could not connect to DE: no CONNECTED')
+    self.assertEqual(report.results['AR'].error, "ValueError('bad response')")
+    self.assertIsNone(report.results['AR'].result)
+
+  def test_prepare_overlaps_task(self):
+    self.configs['DE'].append(self.write('de2.ovpn', 'client\nremote de2.example.com 1194\n'))
+    self.configs['AR'].append(self.write('ar2.ovpn', 'client\nremote ar2.example.com 1194\n'))
+    prepared = {}
+    def probe(countries):
+      prepared.setdefault(countries[0], threading.Event()).set()
+    self.lcs.prober = Mock()
+    self.lcs.prober.probe = Mock(side_effect=probe)
+    seen = []
+    def task(country):
+      # the next country is probed while this task is still running
+      upcoming = {'TR': 'DE', 'DE': 'AR'}.get(country)
+      if upcoming is not None:
+        seen.append(prepared.setdefault(upcoming, threading.Event()).wait(5))
+
+    report = SweepService(self.lcs).run(['TR', 'DE', 'AR'], task)
+    self.assertEqual(report.failed(), [])
+    self.assertEqual(seen, [True, True])
+
+  def test_probe(self):
+    test_cases = [
+      {
+        'case_name': 'probed ahead',
+        'probe': None,
+        'expected_probe': False,
+      },
+      {
+        'case_name': 'probe fails, the switch probes again',
+        'probe': OSError('unreachable'),
+        'expected_probe': True,
+      },
+    ]
+
+    for tc in test_cases:
+      self.lcs.reset_mock()
+      self.lcs.prober = Mock()
+      self.lcs.prober.probe = Mock(side_effect=tc['probe'])
+      report = SweepService(self.lcs).run(['TR', 'DE'], lambda country: None)
+
+      self.assertEqual(report.failed(), [], msg=tc['case_name'])
+      # only countries with a choice of configs are probed
+      self.lcs.prober.probe.assert_called_once_with(['TR'])
+      self.lcs.connect_region.assert_has_calls([
+        call('TR', 30, probe=tc['expected_probe']),
+        call('DE', 30, probe=True),
+      ])
+
+  def test_catalogue(self):
+    catalogue = ConfigCatalogueService(self.configs)
+    self.lcs.selector.config_to_country = catalogue
+    self.lcs.prober = Mock()
+    report = SweepService(self.lcs).run(['TR', 'DE'], lambda country: None)
+    self.assertEqual(report.failed(), [])
+    self.lcs.prober.probe.assert_called_once_with(['TR'])
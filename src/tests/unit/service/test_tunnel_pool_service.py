@@ -0,0 +1,207 @@
+import subprocess
+import threading
+import time
+import unittest
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from iplocationchanger.service.tunnel_pool_service import TunnelPoolService
+from iplocationchanger.exception.tunnel_pool_service_exception import TunnelPoolServiceException
+from iplocationchanger.exception.openvpn_service_exception import OpenVPNServiceException
+
+CONFIG_TO_COUNTRY = {
+  'TR': '/path/to/tr.ovpn',
+  'AR': '/path/to/ar.ovpn',
+}
+
+def management_client_mock(OpenVPNManagementClientMock, wait_for_state=None):
+  omc = Mock()
+  omc.wait_for_state = Mock(side_effect=wait_for_state)
+  OpenVPNManagementClientMock.return_value.__enter__ = Mock(return_value=omc)
+  OpenVPNManagementClientMock.return_value.__exit__ = Mock(return_value=False)
+  return omc
+
+class TestTunnelPoolService(unittest.TestCase):
+  @patch('iplocationchanger.service.tunnel_pool_service.OpenVPNManagementClient')
+  @patch('iplocationchanger.service.tunnel_pool_service.Utils')
+  def test_open_close(self, UtilsMock, OpenVPNManagementClientMock):
+    UtilsMock.run_proc = Mock(return_value=(True, '', ''))
+    UtilsMock.wait_for_pid_file = Mock(side_effect=[4242, 4343])
+    UtilsMock.terminate_pid = Mock(return_value=0.1)
+    omc = management_client_mock(OpenVPNManagementClientMock)
+
+    tps = TunnelPoolService(CONFIG_TO_COUNTRY, '/usr/sbin/openvpn', 'path/to/credentials')
+    tr = tps.open('TR', timeout=7)
+    ar = tps.open('AR', timeout=7)
+
+    self.assertEqual((tr.namespace, tr.pid), ('ilc0', 4242))
+    self.assertEqual((ar.namespace, ar.pid), ('ilc1', 4343))
+    self.assertIs(tps.open('TR'), tr)
+    self.assertIs(tps.get('AR'), ar)
+    OpenVPNManagementClientMock.assert_any_call('10.200.0.2', 7505, None)
+    OpenVPNManagementClientMock.assert_any_call('10.200.1.2', 7505, None)
+    omc.wait_for_state.assert_called_with('CONNECTED', 7)
+
+    cmds = [c.args[0] for c in UtilsMock.run_proc.call_args_list]
+    self.assertIn(['sudo', 'ip', 'netns', 'add', 'ilc0'], cmds)
+    self.assertIn(
+      [
+        'sudo', 'ip', 'netns', 'exec', 'ilc0',
+        '/usr/sbin/openvpn',
+        '--auth-retry', 'nointeract',
+        '--config', '/path/to/tr.ovpn',
+        '--script-security', '2',
+        '--daemon', 'openvpn_iplocationchanger_ilc0',
+        '--writepid', tr.pid_path,
+        '--management', '10.200.0.2', '7505',
+        '--auth-user-pass', 'path/to/credentials',
+      ],
+      cmds,
+    )
+
+    UtilsMock.run_proc.reset_mock()
+    tps.close('TR')
+    UtilsMock.terminate_pid.assert_called_once_with(4242)
+    UtilsMock.run_proc.assert_any_call(['sudo', 'ip', 'netns', 'delete', 'ilc0'], expect_error=True)
+    with self.assertRaises(TunnelPoolServiceException):
+      tps.get('TR')
+
+    # the freed namespace index is reused
+    UtilsMock.wait_for_pid_file = Mock(return_value=4444)
+    self.assertEqual(tps.open('TR').namespace, 'ilc2')
+    tps.close_all()
+    self.assertEqual(tps.tunnels, {})
+
+  @patch('iplocationchanger.service.tunnel_pool_service.OpenVPNManagementClient')
+  @patch('iplocationchanger.service.tunnel_pool_service.Utils')
+  def test_open_failures(self, UtilsMock, OpenVPNManagementClientMock):
+    test_cases = [
+      {
+        'case_name': 'unknown country',
+        'country': 'DE',
+        'fail_cmd': None,
+        'wait_for_state': None,
+        'exception': TunnelPoolServiceException,
+        'namespace_deleted': False,
+      },
+      {
+        'case_name': 'namespace exists already',
+        'country': 'TR',
+        'fail_cmd': 'netns',
+        'wait_for_state': None,
+        'exception': TunnelPoolServiceException,
+        'namespace_deleted': False,
+      },
+      {
+        'case_name': 'veth setup fails',
+        'country': 'TR',
+        'fail_cmd': 'link',
+        'wait_for_state': None,
+        'exception': TunnelPoolServiceException,
+        'namespace_deleted': True,
+      },
+      {
+        'case_name': 'tunnel never connects',
+        'country': 'TR',
+        'fail_cmd': None,
+        'wait_for_state': OpenVPNServiceException('timed out'),
+        'exception': TunnelPoolServiceException,
+        'namespace_deleted': True,
+      },
+      {
+        'case_name': 'unexpected error',
+        'country': 'TR',
+        'fail_cmd': None,
+        'wait_for_state': RuntimeError('boom'),
+        'exception': RuntimeError,
+        'namespace_deleted': True,
+      },
+    ]
+
+    for tc in test_cases:
+      def run_proc(cmd, expect_error=False):
+        if not expect_error and cmd[:3] == ['sudo', 'ip', tc['fail_cmd']]:
+          raise subprocess.CalledProcessError(1, cmd)
+        return (True, '', '')
+      UtilsMock.run_proc = Mock(side_effect=run_proc)
+      UtilsMock.wait_for_pid_file = Mock(return_value=4242)
+      UtilsMock.terminate_pid = Mock(return_value=0.1)
+      management_client_mock(OpenVPNManagementClientMock, tc['wait_for_state'])
+
+      tps = TunnelPoolService(CONFIG_TO_COUNTRY, 'openvpn')
+      with self.assertRaises(tc['exception'], msg=tc['case_name']):
+        tps.open(tc['country'])
+      self.assertEqual(tps.tunnels, {}, msg=tc['case_name'])
+      self.assertEqual(tps.opening, {}, msg=tc['case_name'])
+      self.assertEqual(len(tps.free_indices), tps.MAX_TUNNELS, msg=tc['case_name'])
+      cmds = [c.args[0] for c in UtilsMock.run_proc.call_args_list]
+      self.assertEqual(
+        ['sudo', 'ip', 'netns', 'delete', 'ilc0'] in cmds,
+        tc['namespace_deleted'],
+        msg=tc['case_name'],
+      )
+
+      # a later open does not wait for the failed one
+      management_client_mock(OpenVPNManagementClientMock)
+      UtilsMock.run_proc = Mock(return_value=(True, '', ''))
+      if tc['country'] in CONFIG_TO_COUNTRY:
+        self.assertEqual(tps.open(tc['country'], timeout=1).namespace, 'ilc1', msg=tc['case_name'])
+
+  @patch('iplocationchanger.service.tunnel_pool_service.OpenVPNManagementClient')
+  @patch('iplocationchanger.service.tunnel_pool_service.Utils')
+  def test_open_concurrently(self, UtilsMock, OpenVPNManagementClientMock):
+    test_cases = [
+      {
+        'case_name': 'connected',
+        'wait_for_state': None,
+      },
+      {
+        'case_name': 'tunnel never connects',
+        'wait_for_state': OpenVPNServiceException('timed out'),
+      },
+    ]
+
+    for tc in test_cases:
+      UtilsMock.run_proc = Mock(return_value=(True, '', ''))
+      UtilsMock.wait_for_pid_file = Mock(return_value=4242)
+      UtilsMock.terminate_pid = Mock(return_value=0.1)
+      connected = threading.Event()
+      def wait_for_state(state, timeout):
+        # the second caller arrives while the first one waits for CONNECTED
+        time.sleep(0.2)
+        if tc['wait_for_state'] is not None:
+          raise tc['wait_for_state']
+        connected.set()
+      management_client_mock(OpenVPNManagementClientMock, wait_for_state)
+
+      tps = TunnelPoolService(CONFIG_TO_COUNTRY, 'openvpn')
+      results = []
+      def open_tr():
+        try:
+          tunnel = tps.open('TR', timeout=1)
+          # never handed out before it is up
+          self.assertTrue(connected.is_set(), msg=tc['case_name'])
+          results.append(tunnel)
+        except TunnelPoolServiceException as e:
+          results.append(e)
+      threads = [threading.Thread(target=open_tr) for _ in range(2)]
+      for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+      for thread in threads:
+        thread.join(5)
+
+      cmds = [c.args[0] for c in UtilsMock.run_proc.call_args_list]
+      self.assertEqual(cmds.count(['sudo', 'ip', 'netns', 'add', 'ilc0']), 1, msg=tc['case_name'])
+      self.assertEqual(len(results), 2, msg=tc['case_name'])
+      if tc['wait_for_state'] is None:
+        self.assertIs(results[0], results[1], msg=tc['case_name'])
+        self.assertIs(tps.get('TR'), results[0], msg=tc['case_name'])
+      else:
+        self.assertTrue(
+          all(isinstance(r, TunnelPoolServiceException) for r in results),
+          msg=tc['case_name'],
+        )
+        self.assertEqual(tps.tunnels, {}, msg=tc['case_name'])
+      self.assertEqual(tps.opening, {}, msg=tc['case_name'])
@@ -1,3 +1,4 @@
+import threading
 import unittest
 
 from unittest.mock import patch
@@ -5,7 +6,12 @@ from unittest.mock import Mock
 from unittest.mock import PropertyMock
 
 from iplocationchanger.service.whatismyip_service import WhatIsMyIPService
+from iplocationchanger.service.location_provider_registry import LocationProviderRegistry
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.exception.local_geoip_service_exception import LocalGeoIPServiceException
+from iplocationchanger.exception.location_provider_exception import LocationProviderException
 from iplocationchanger.exception.whatismyip_service_exception import WhatIsMyIPServiceException
+from tests.unit.service.fake_whatismyip_server import FakeWhatIsMyIPServer
 
 class TestWhatsIsMyIpService(unittest.TestCase):
   def test_check_request_error(self):
@@ -66,10 +72,11 @@ class TestWhatsIsMyIpService(unittest.TestCase):
         res = ws.check_request_error(tc['response'])
         self.assertEqual(res, None)
 
-  @patch('iplocationchanger.service.whatismyip_service.requests.get')
+  @patch('requests.Session')
   @patch('iplocationchanger.service.whatismyip_service.WhatIsMyIPService.check_request_error')
-  def test_request_valid(self, MockCheckRequestError, MockRequestsGet):
+  def test_request_valid(self, MockCheckRequestError, MockSession):
     self.maxDiff = None
+    MockRequestsGet = MockSession.return_value.get
     # MockCheckRequestError: Mock object for check_request_error
     test_cases = [
       {
@@ -118,13 +125,14 @@ class TestWhatsIsMyIpService(unittest.TestCase):
         'output': 'json',
         **tc['other_params'],
       }
-      MockRequestsGet.assert_called_with(url, params=params)
+      MockRequestsGet.assert_called_with(url, params=params, timeout=10)
       self.assertTrue(isinstance(res, dict))
       self.assertEqual(res, tc['expected_result'])
 
 
-  @patch('iplocationchanger.service.whatismyip_service.requests.get')
-  def test_request_with_exception(self, MockRequestsGet):
+  @patch('requests.Session')
+  def test_request_with_exception(self, MockSession):
+    MockRequestsGet = MockSession.return_value.get
     # MockCheckRequestError: Mock object for check_request_error
     tc1 = {
       'path': 'ip',
@@ -195,7 +203,7 @@ class TestWhatsIsMyIpService(unittest.TestCase):
 
     for tc in test_cases_valid:
       MockGetLocationFromIP.return_value = tc['returned_location']
-      ws = WhatIsMyIPService('apikeyisthisstring')
+      ws = WhatIsMyIPService('apikeyisthisstring', validation='two-step')
       # should not raise exception
 
     for tc in test_cases_invalid:
@@ -286,3 +294,178 @@ class TestWhatsIsMyIpService(unittest.TestCase):
       MockRequest.return_value = tc['returned_body']
       with self.assertRaises(WhatIsMyIPServiceException):
         ws.get_location_from_ip(tc['requested_ip'])
+
+  def test_session_keep_alive(self):
+    with FakeWhatIsMyIPServer(country='TR') as fws:
+      ws = WhatIsMyIPService('apikeyisthisstring', base_url=fws.base_url, validation='two-step')
+      ws.validate_connection('TR')
+      ws.validate_connection('TR')
+
+      self.assertEqual(len(fws.requests), 4)
+      self.assertEqual(fws.connections, 1)
+      self.assertEqual(ws.metrics.api_calls.get(endpoint='ip', outcome='ok'), 2)
+      self.assertEqual(ws.metrics.api_calls.get(endpoint='ip-address-lookup', outcome='ok'), 2)
+      self.assertEqual(ws.metrics.phase_seconds.count(phase='get_location_from_ip'), 2)
+
+      ws.reset_session()
+      ws.get_ip()
+      self.assertEqual(fws.connections, 2)
+
+  def test_request_retries(self):
+    test_cases = [
+      {
+        'case_name': 'retry on 503',
+        'queued': [(503, 'unavailable'), (502, 'bad gateway')],
+        'expects_exception': False,
+        'rate_limited': 0,
+      },
+      {
+        'case_name': 'retry on too many lookups',
+        'queued': [(200, '3'), (200, '3')],
+        'expects_exception': False,
+        'rate_limited': 2,
+      },
+      {
+        'case_name': 'retries exhausted',
+        'queued': [(200, '3'), (200, '3'), (200, '3')],
+        'expects_exception': True,
+        'rate_limited': 3,
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeWhatIsMyIPServer() as fws:
+        for status, body in tc['queued']:
+          fws.queue('/ip.php', status, body)
+        ws = WhatIsMyIPService(
+          'apikeyisthisstring',
+          base_url=fws.base_url,
+          max_retries=2,
+          backoff_factor=0.01,
+        )
+        if tc['expects_exception']:
+          with self.assertRaises(WhatIsMyIPServiceException, msg=tc['case_name']):
+            ws.get_ip()
+        else:
+          self.assertEqual(ws.get_ip(), fws.ip, msg=tc['case_name'])
+        self.assertEqual(
+          ws.metrics.api_calls.get(endpoint='ip', outcome='rate_limited'),
+          tc['rate_limited'],
+          msg=tc['case_name'],
+        )
+
+  @patch('iplocationchanger.service.whatismyip_service.WhatIsMyIPService.request')
+  def test_get_location_from_ip_cached(self, MockRequest):
+    MockRequest.return_value = {
+      'ip_address_lookup': [{'status': 'ok', 'ip': '95.223.119.45', 'country': 'DE'}],
+    }
+    cache = TTLCache(ttl=60)
+    ws = WhatIsMyIPService('apikeyisthisstring', location_cache=cache)
+
+    self.assertEqual(ws.get_location_from_ip('95.223.119.45'), 'DE')
+    self.assertEqual(ws.get_location_from_ip('95.223.119.45'), 'DE')
+
+    MockRequest.assert_called_once_with('ip-address-lookup', {'input': '95.223.119.45'})
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 1)
+
+  @patch('iplocationchanger.service.whatismyip_service.WhatIsMyIPService.request')
+  def test_get_location_from_ip_backend(self, MockRequest):
+    backend = Mock()
+    backend.get_location_from_ip = Mock(return_value='NL')
+    ws = WhatIsMyIPService('apikeyisthisstring', location_backend=backend)
+
+    self.assertEqual(ws.get_location_from_ip('2001:db8::1'), 'NL')
+    backend.get_location_from_ip.assert_called_once_with('2001:db8::1')
+    MockRequest.assert_not_called()
+
+    backend.get_location_from_ip = Mock(side_effect=LocalGeoIPServiceException(''))
+    with self.assertRaises(WhatIsMyIPServiceException):
+      ws.get_location_from_ip('2001:db8::1')
+
+  def test_locate(self):
+    test_cases = [
+      {
+        'case_name': 'single lookup',
+        'queued': [],
+        'expected_paths': ['/ip-address-lookup.php'],
+        'single_lookup': True,
+      },
+      {
+        'case_name': 'lookup without input rejected',
+        'queued': [(200, '4')],
+        'expected_paths': ['/ip-address-lookup.php', '/ip.php', '/ip-address-lookup.php'],
+        'single_lookup': False,
+      },
+      {
+        'case_name': 'lookup without the caller IP',
+        'queued': [(200, '{"ip_address_lookup": [{"status": "ok", "country": "TR"}]}')],
+        'expected_paths': ['/ip-address-lookup.php', '/ip.php', '/ip-address-lookup.php'],
+        'single_lookup': False,
+      },
+    ]
+
+    for tc in test_cases:
+      with FakeWhatIsMyIPServer(country='TR') as fws:
+        for status, body in tc['queued']:
+          fws.queue('/ip-address-lookup.php', status, body)
+        cache = TTLCache(ttl=60)
+        ws = WhatIsMyIPService('apikeyisthisstring', base_url=fws.base_url, location_cache=cache)
+        ws.validate_connection('TR')
+        self.assertEqual([path for path, _ in fws.requests], tc['expected_paths'], msg=tc['case_name'])
+        self.assertNotIn('input', fws.requests[0][1], msg=tc['case_name'])
+        self.assertEqual(ws.single_lookup, tc['single_lookup'], msg=tc['case_name'])
+        self.assertEqual(cache.get(fws.ip), 'TR', msg=tc['case_name'])
+        self.assertEqual(ws.metrics.phase_seconds.count(phase='locate'), 1, msg=tc['case_name'])
+
+  def test_locate_rate_limited(self):
+    # running out of quota must not disable the single lookup for good
+    with FakeWhatIsMyIPServer() as fws:
+      fws.queue('/ip-address-lookup.php', 200, '3')
+      ws = WhatIsMyIPService('apikeyisthisstring', base_url=fws.base_url, max_retries=0)
+      with self.assertRaises(WhatIsMyIPServiceException):
+        ws.locate()
+      self.assertTrue(ws.single_lookup)
+
+  def test_race(self):
+    release = threading.Event()
+    def slow_locate():
+      release.wait(5)
+      return '203.0.113.7', 'TR'
+    slow = Mock(locate=Mock(side_effect=slow_locate))
+    slow.name = 'slow'
+    failing = Mock(locate=Mock(side_effect=LocationProviderException('down')))
+    failing.name = 'failing'
+    fast = Mock(locate=Mock(return_value=('203.0.113.7', 'TR')))
+    fast.name = 'fast'
+
+    with FakeWhatIsMyIPServer() as fws:
+      # WhatIsMyIP is down, the fastest answering provider wins
+      fws.queue('/ip-address-lookup.php', 503, 'unavailable')
+      ws = WhatIsMyIPService(
+        'apikeyisthisstring',
+        base_url=fws.base_url,
+        max_retries=0,
+        validation='race',
+        providers=[slow, failing, fast],
+        registry=LocationProviderRegistry(min_cooldown=0),
+      )
+      ws.validate_connection('TR')
+      release.set()
+      fast.locate.assert_called_once()
+
+      failing.locate.side_effect = None
+      failing.locate.return_value = ('203.0.113.8', 'DE')
+      fast.locate.return_value = ('203.0.113.8', 'DE')
+      slow.locate.side_effect = None
+      slow.locate.return_value = ('203.0.113.8', 'DE')
+      fws.country = 'DE'
+      self.assertEqual(ws.registry.race()[1], 'DE')
+
+      for provider in (slow, failing, fast):
+        provider.locate.side_effect = LocationProviderException('down')
+      # the lookup of the previous race may still be in flight
+      for _ in range(3):
+        fws.queue('/ip-address-lookup.php', 503, 'unavailable')
+      with self.assertRaises(WhatIsMyIPServiceException):
+        ws.validate_connection('DE')
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class TestMain(unittest.TestCase):
+  def test_lazy_imports(self):
+    test_cases = [
+      {
+        'case_name': 'command line',
+        'module': 'iplocationchanger.__main__',
+      },
+      {
+        'case_name': 'location changer',
+        'module': 'iplocationchanger.service.location_changer_service',
+      },
+    ]
+
+    for tc in test_cases:
+      # a fresh interpreter, the test run has imported everything already
+      script = (
+        f'import sys, {tc["module"]}; '
+        "print(' '.join(m for m in ('requests', 'urllib3', 'asyncio', 'http.server') if m in sys.modules))"
+      )
+      completed = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+      )
+      self.assertEqual(completed.returncode, 0, msg=completed.stderr)
+      self.assertEqual(completed.stdout.strip(), '', msg=tc['case_name'])
+
+  def test_help(self):
+    completed = subprocess.run(
+      [sys.executable, '-m', 'iplocationchanger', '--help'],
+      cwd=SRC_DIR,
+      capture_output=True,
+      text=True,
+    )
+    self.assertEqual(completed.returncode, 0, msg=completed.stderr)
+    self.assertIn('usage: iplocationchanger', completed.stdout)
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import unittest
+
+from tempfile import TemporaryDirectory
+
+from iplocationchanger.utils.exit_history import ExitHistory
+from iplocationchanger.utils.exit_history import Validation
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+class TestExitHistory(unittest.TestCase):
+  def setUp(self):
+    self.td = TemporaryDirectory()
+    self.path = os.path.join(self.td.name, 'history.db')
+    self.clock = FakeClock()
+    self.history = ExitHistory(self.path, min_attempts=3, max_wrong_rate=0.2, clock=self.clock)
+
+  def tearDown(self):
+    self.history.close()
+    self.td.cleanup()
+
+  def fill(self):
+    # tr1 always right, tr2 wrong country half the time, tr3 lookups failing
+    for i in range(4):
+      self.clock.now += 1
+      self.history.record('/assets/tr1.ovpn', 'TR', f'203.0.113.{i % 2}', 'TR', True, latency=2.0)
+      self.history.record(
+        '/assets/tr2.ovpn', 'TR', '198.51.100.7',
+        'TR' if i % 2 == 0 else 'NL', i % 2 == 0, latency=4.0,
+      )
+      self.history.record('/assets/tr3.ovpn', 'TR', '', '', False)
+
+  def test_stats(self):
+    self.fill()
+    stats = self.history.stats()
+    self.assertEqual(sorted(stats), ['/assets/tr1.ovpn', '/assets/tr2.ovpn', '/assets/tr3.ovpn'])
+
+    test_cases = [
+      {'config': '/assets/tr1.ovpn', 'attempts': 4, 'successes': 4, 'wrong_country': 0, 'mean_latency': 2.0},
+      {'config': '/assets/tr2.ovpn', 'attempts': 4, 'successes': 2, 'wrong_country': 2, 'mean_latency': 4.0},
+      # failed lookups are failures, but not wrong countries
+      {'config': '/assets/tr3.ovpn', 'attempts': 4, 'successes': 0, 'wrong_country': 0, 'mean_latency': None},
+    ]
+    for tc in test_cases:
+      s = stats[tc['config']]
+      for field in ('attempts', 'successes', 'wrong_country', 'mean_latency'):
+        self.assertEqual(getattr(s, field), tc[field], msg=f'{tc["config"]}: {field}')
+    self.assertEqual(stats['/assets/tr2.ovpn'].success_rate, 0.5)
+    self.assertEqual(stats['/assets/tr2.ovpn'].wrong_rate, 0.5)
+
+    self.assertEqual(list(self.history.stats(['/assets/tr1.ovpn'])), ['/assets/tr1.ovpn'])
+    self.assertEqual(self.history.stats([]), {})
+    self.assertEqual(self.history.stats(since=1003)['/assets/tr1.ovpn'].attempts, 2)
+
+  def test_country_case(self):
+    for i in range(5):
+      self.clock.now += 1
+      self.history.record('/assets/tr1.ovpn', 'tr', '203.0.113.7', 'TR', True)
+      self.history.record('/assets/tr2.ovpn', ' TR', '198.51.100.7', 'nl', False)
+    stats = self.history.stats()
+    self.assertEqual(stats['/assets/tr1.ovpn'].wrong_country, 0)
+    self.assertEqual(stats['/assets/tr2.ovpn'].wrong_country, 5)
+    self.assertEqual(self.history.exit_ips('/assets/tr1.ovpn')[0].wrong_country, 0)
+    self.assertEqual(self.history.flagged(), ['/assets/tr2.ovpn'])
+
+  def test_config_id_rollback(self):
+    # a validation which cannot be stored must not leave a cached id behind
+    with self.assertRaises(sqlite3.Error):
+      self.history.record('/assets/tr1.ovpn', 'TR', '203.0.113.7', 'TR', True, latency=object())
+    self.assertEqual(self.history.config_ids, {})
+    self.assertEqual(self.history.conn.execute('SELECT COUNT(*) FROM configs').fetchone()[0], 0)
+    self.history.record('/assets/tr1.ovpn', 'TR', '203.0.113.7', 'TR', True)
+    self.assertEqual(self.history.stats()['/assets/tr1.ovpn'].attempts, 1)
+    self.assertEqual(list(self.history.config_ids), ['/assets/tr1.ovpn'])
+
+  def test_flagged_and_rank(self):
+    self.fill()
+    self.assertEqual(self.history.flagged(), ['/assets/tr2.ovpn'])
+    # too few validations to judge
+    self.assertEqual(self.history.flagged(since=1004), [])
+
+    ranked = self.history.rank(['/assets/tr2.ovpn', '/assets/tr3.ovpn', '/assets/new.ovpn', '/assets/tr1.ovpn'])
+    self.assertEqual(ranked, ['/assets/tr1.ovpn', '/assets/new.ovpn', '/assets/tr3.ovpn', '/assets/tr2.ovpn'])
+
+  def test_exit_ips(self):
+    self.fill()
+    self.assertEqual(
+      [(e.ip, e.seen, e.wrong_country) for e in self.history.exit_ips('/assets/tr1.ovpn')],
+      [('203.0.113.1', 2, 0), ('203.0.113.0', 2, 0)],
+    )
+    self.assertEqual(
+      [(e.ip, e.seen, e.wrong_country, e.last_seen) for e in self.history.exit_ips('/assets/tr2.ovpn')],
+      [('198.51.100.7', 4, 2, 1004.0)],
+    )
+    self.assertEqual(self.history.exit_ips('/assets/tr3.ovpn'), [])
+
+  def test_rows_and_prune(self):
+    self.fill()
+    rows = self.history.rows(config='/assets/tr2.ovpn')
+    self.assertEqual(
+      next(rows),
+      Validation(1001.0, '/assets/tr2.ovpn', 'TR', '198.51.100.7', 'TR', True, 4.0),
+    )
+    # streamed while writes go on
+    self.history.record('/assets/tr2.ovpn', 'TR', '198.51.100.8', 'TR', True)
+    self.assertEqual(len(list(rows)), 3)
+    self.assertEqual(len(list(self.history.rows())), 13)
+
+    self.assertEqual(self.history.prune(before=1003), 6)
+    self.assertEqual(self.history.stats()['/assets/tr1.ovpn'].attempts, 2)
+
+    # kept across restarts
+    reopened = ExitHistory(self.path)
+    self.assertEqual(reopened.stats()['/assets/tr2.ovpn'].attempts, 3)
+    reopened.record('/assets/tr2.ovpn', 'TR', '198.51.100.9', 'TR', True)
+    self.assertEqual(self.history.stats()['/assets/tr2.ovpn'].attempts, 4)
+    reopened.close()
+
+  def test_query_plan(self):
+    # per config queries must not scan the whole log
+    plan = self.history.conn.execute(
+      'EXPLAIN QUERY PLAN SELECT COUNT(*) FROM validations WHERE config_id = 1 AND ts >= 0'
+    ).fetchall()
+    self.assertIn('validations_config_ts', ' '.join(str(row) for row in plan))
@@ -0,0 +1,49 @@
+import os
+import queue
+import unittest
+
+from tempfile import TemporaryDirectory
+
+from iplocationchanger.utils.file_watcher import FileWatcher
+from iplocationchanger.utils.file_watcher import load_inotify
+
+class TestFileWatcher(unittest.TestCase):
+  def check_watcher(self, use_inotify):
+    with TemporaryDirectory() as td:
+      watched = os.path.join(td, 'configmap.json')
+      other = os.path.join(td, 'other.json')
+      with open(watched, 'w') as f_ptr:
+        f_ptr.write('{}')
+      changes = queue.Queue()
+      watcher = FileWatcher([watched], changes.put, interval=0.05, debounce=0.05, use_inotify=use_inotify)
+      watcher.start()
+      try:
+        # files next to the watched one are ignored
+        with open(other, 'w') as f_ptr:
+          f_ptr.write('{}')
+        with self.assertRaises(queue.Empty):
+          changes.get(timeout=0.3)
+
+        # replaced by rename, as editors do
+        with open(f'{watched}.tmp', 'w') as f_ptr:
+          f_ptr.write('{"TR": "tr.ovpn"}')
+        os.replace(f'{watched}.tmp', watched)
+        self.assertEqual(changes.get(timeout=5), {watched})
+
+        os.remove(watched)
+        self.assertEqual(changes.get(timeout=5), {watched})
+      finally:
+        watcher.stop()
+      return watcher
+
+  def test_polling(self):
+    self.check_watcher(use_inotify=False)
+
+  @unittest.skipIf(load_inotify() is None, 'inotify is not available')
+  def test_inotify(self):
+    with TemporaryDirectory() as td:
+      watcher = FileWatcher([os.path.join(td, 'f')], lambda changed: None)
+      mode = watcher.mode
+      watcher.stop()
+    self.assertEqual(mode, 'inotify')
+    self.check_watcher(use_inotify=True)
@@ -0,0 +1,86 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from iplocationchanger.utils.metrics import Counter
+from iplocationchanger.utils.metrics import Histogram
+from iplocationchanger.utils.metrics import Metrics
+from iplocationchanger.utils.metrics import MetricsServer
+from iplocationchanger.utils.ttl_cache import TTLCache
+
+class TestMetrics(unittest.TestCase):
+  def test_counter(self):
+    counter = Counter('calls_total', 'Calls.', ('endpoint',))
+    counter.inc(endpoint='ip')
+    counter.inc(2, endpoint='ip')
+    counter.inc(endpoint='say "hi"\n')
+    self.assertEqual(counter.get(endpoint='ip'), 3)
+    self.assertEqual(counter.render(), [
+      '# HELP calls_total Calls.',
+      '# TYPE calls_total counter',
+      'calls_total{endpoint="ip"} 3',
+      'calls_total{endpoint="say \\"hi\\"\\n"} 1',
+    ])
+
+  def test_histogram(self):
+    histogram = Histogram('latency_seconds', 'Latency.', ('phase',), (0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+      histogram.observe(value, phase='spawn')
+    self.assertEqual(histogram.count(phase='spawn'), 4)
+    self.assertEqual(histogram.count(phase='disconnect'), 0)
+    self.assertEqual(histogram.render(), [
+      '# HELP latency_seconds Latency.',
+      '# TYPE latency_seconds histogram',
+      'latency_seconds_bucket{phase="spawn",le="0.1"} 1',
+      'latency_seconds_bucket{phase="spawn",le="1"} 3',
+      'latency_seconds_bucket{phase="spawn",le="+Inf"} 4',
+      'latency_seconds_sum{phase="spawn"} 4.25',
+      'latency_seconds_count{phase="spawn"} 4',
+    ])
+
+  def test_phase(self):
+    metrics = Metrics()
+    with metrics.phase('spawn'):
+      pass
+    with self.assertRaises(ValueError):
+      with metrics.phase('spawn'):
+        raise ValueError()
+    metrics.observe_phase('disconnect', 1.5)
+    self.assertEqual(metrics.phase_seconds.count(phase='spawn'), 2)
+    self.assertEqual(set(metrics.timings), {'spawn', 'disconnect'})
+    self.assertEqual(metrics.timings['disconnect'], 1.5)
+
+    metrics.start_switch()
+    self.assertEqual(metrics.timings, {})
+    self.assertEqual(metrics.phase_seconds.count(phase='disconnect'), 1)
+
+  def test_render(self):
+    metrics = Metrics()
+    cache = TTLCache()
+    metrics.watch_cache(cache)
+    cache.set('198.51.100.1', 'DE')
+    cache.get('198.51.100.1')
+    cache.get('198.51.100.2')
+    metrics.switches.inc(country='DE')
+    metrics.switch_failures.inc(exception='OpenVPNServiceException')
+
+    text = metrics.render()
+    self.assertIn('iplocationchanger_switches_total{country="DE"} 1\n', text)
+    self.assertIn('iplocationchanger_switch_failures_total{exception="OpenVPNServiceException"} 1\n', text)
+    self.assertIn('iplocationchanger_location_cache_hits_total 1\n', text)
+    self.assertIn('iplocationchanger_location_cache_misses_total 1\n', text)
+    self.assertTrue(text.endswith('\n'))
+
+  def test_server(self):
+    metrics = Metrics()
+    metrics.switches.inc(country='TR')
+    server = MetricsServer(metrics, 0)
+    server.start()
+    try:
+      with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as res:
+        self.assertTrue(res.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('iplocationchanger_switches_total{country="TR"} 1', res.read().decode('utf-8'))
+      with self.assertRaises(urllib.error.HTTPError):
+        urllib.request.urlopen(f'http://127.0.0.1:{server.port}/other')
+    finally:
+      server.close()
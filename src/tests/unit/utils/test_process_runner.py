@@ -0,0 +1,99 @@
+import signal
+import sys
+import threading
+import time
+import unittest
+
+from subprocess import CalledProcessError
+from subprocess import TimeoutExpired
+
+from iplocationchanger.utils.process_runner import ProcessRunner
+from iplocationchanger.utils.process_runner import run
+
+def python(script):
+  return [sys.executable, '-c', script]
+
+
+class TestProcessRunner(unittest.TestCase):
+  def test_run(self):
+    test_cases = [
+      {
+        'case_name': 'success',
+        'script': 'import sys; print("a"); print("b"); print("c", file=sys.stderr)',
+        'timeout': None,
+        'expected': {'returncode': 0, 'signal': None, 'ok': True, 'timed_out': False, 'stdout': 'a\nb\n', 'stderr': 'c\n'},
+      },
+      {
+        'case_name': 'exit status',
+        'script': 'import sys; print("failing", file=sys.stderr); sys.exit(3)',
+        'timeout': None,
+        'expected': {'returncode': 3, 'signal': None, 'ok': False, 'timed_out': False, 'stdout': '', 'stderr': 'failing\n'},
+      },
+      {
+        'case_name': 'killed by a signal',
+        'script': 'import os, signal; os.kill(os.getpid(), signal.SIGKILL)',
+        'timeout': None,
+        'expected': {'returncode': -9, 'signal': signal.SIGKILL, 'ok': False, 'timed_out': False, 'stdout': '', 'stderr': ''},
+      },
+      {
+        'case_name': 'timeout',
+        'script': 'import time; print("started", flush=True); time.sleep(10)',
+        'timeout': 0.3,
+        'expected': {'returncode': -15, 'signal': signal.SIGTERM, 'ok': False, 'timed_out': True, 'stdout': 'started\n', 'stderr': ''},
+      },
+    ]
+
+    for tc in test_cases:
+      result = run(python(tc['script']), timeout=tc['timeout'])
+      for field, expected in tc['expected'].items():
+        self.assertEqual(getattr(result, field), expected, msg=f'{tc["case_name"]}: {field}')
+      self.assertLess(result.duration, 5, msg=tc['case_name'])
+
+    with self.assertRaises(TimeoutExpired):
+      run(python('import time; time.sleep(10)'), timeout=0.1).check()
+    with self.assertRaises(CalledProcessError):
+      run(python('import sys; sys.exit(1)')).check()
+    self.assertTrue(run(python('pass')).check().ok)
+
+  def test_streaming(self):
+    lines = []
+    both_lines = threading.Event()
+    def on_line(stream, line):
+      lines.append((stream, line))
+      if len(lines) == 2:
+        both_lines.set()
+
+    # lines arrive while the process is still running
+    runner = ProcessRunner(
+      python('import sys, time; print("up", flush=True); print("warn", file=sys.stderr, flush=True); time.sleep(10)'),
+      on_line=on_line,
+    ).start()
+    self.assertTrue(both_lines.wait(5))
+    self.assertTrue(runner.running())
+
+    result = runner.cancel(grace=1)
+    self.assertTrue(result.cancelled)
+    self.assertEqual(result.signal, signal.SIGTERM)
+    self.assertFalse(runner.running())
+    self.assertEqual(sorted(lines), [('stderr', 'warn'), ('stdout', 'up')])
+    self.assertIn('cancelled', result.describe())
+
+  def test_keep_lines(self):
+    runner = ProcessRunner(python('for i in range(100): print(i)'), keep_lines=3).start()
+    result = runner.wait(5)
+    self.assertEqual(result.stdout, '97\n98\n99\n')
+
+  def test_kill_after_grace(self):
+    runner = ProcessRunner(python(
+      'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print("ready", flush=True); time.sleep(10)'
+    ), on_line=lambda stream, line: None).start()
+    deadline = time.monotonic() + 5
+    while 'ready' not in runner.lines['stdout'] and time.monotonic() < deadline:
+      time.sleep(0.01)
+    result = runner.cancel(grace=0.2)
+    self.assertEqual(result.signal, signal.SIGKILL)
+    self.assertEqual(result.describe()[:len('cancelled')], 'cancelled')
+
+  def test_start_error(self):
+    with self.assertRaises(OSError):
+      ProcessRunner(['/nonexistent/command_to_run']).start()
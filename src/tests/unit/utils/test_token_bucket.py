@@ -0,0 +1,42 @@
+import unittest
+
+from iplocationchanger.utils.token_bucket import TokenBucket
+from iplocationchanger.utils.token_bucket import parse_rate
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+class TestTokenBucket(unittest.TestCase):
+  def test_try_acquire(self):
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.5, burst=2, clock=clock)
+
+    self.assertTrue(bucket.try_acquire())
+    self.assertTrue(bucket.try_acquire())
+    self.assertFalse(bucket.try_acquire())
+
+    clock.now += 1
+    self.assertFalse(bucket.try_acquire())
+    clock.now += 1
+    self.assertTrue(bucket.try_acquire())
+
+    # refills up to the burst only
+    clock.now += 100
+    self.assertEqual(bucket.available(), 2)
+
+  def test_parse_rate(self):
+    test_cases = [
+      {'case_name': 'per day', 'rate': '1000/d', 'expected': (1000 / 86400, 1000)},
+      {'case_name': 'per minute', 'rate': '45/min', 'expected': (0.75, 45)},
+      {'case_name': 'per second', 'rate': '2/s', 'expected': (2, 2)},
+    ]
+    for tc in test_cases:
+      self.assertEqual(parse_rate(tc['rate']), tc['expected'], msg=tc['case_name'])
+
+    for rate in ('1000', '1000/week', 'many/d', '0/d'):
+      with self.assertRaises(ValueError, msg=rate):
+        parse_rate(rate)
@@ -0,0 +1,95 @@
+import os
+import unittest
+
+from tempfile import TemporaryDirectory
+
+from iplocationchanger.utils.ttl_cache import TTLCache
+from iplocationchanger.utils.ttl_cache import SQLiteCacheStore
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+class TestTTLCache(unittest.TestCase):
+  def test_get_set(self):
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+
+    self.assertIsNone(cache.get('1.1.1.1'))
+    cache.set('1.1.1.1', 'AU')
+    self.assertEqual(cache.get('1.1.1.1'), 'AU')
+
+    clock.now += 11
+    self.assertIsNone(cache.get('1.1.1.1'))
+
+    self.assertEqual(
+      cache.stats(),
+      {'hits': 1, 'misses': 2, 'evictions': 0, 'expirations': 1, 'size': 0},
+    )
+
+  def test_lru_eviction(self):
+    cache = TTLCache(maxsize=2, ttl=10, clock=FakeClock())
+    cache.set('a', 'DE')
+    cache.set('b', 'TR')
+    # touch 'a' so 'b' is the least recently used
+    cache.get('a')
+    cache.set('c', 'US')
+
+    self.assertEqual(cache.get('a'), 'DE')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('c'), 'US')
+    self.assertEqual(cache.evictions, 1)
+    self.assertEqual(len(cache), 2)
+
+  def test_invalid_maxsize(self):
+    with self.assertRaises(ValueError):
+      TTLCache(maxsize=0)
+
+  def test_sqlite_store(self):
+    clock = FakeClock()
+    with TemporaryDirectory() as td:
+      path = os.path.join(td, 'cache.sqlite')
+      writer = TTLCache(ttl=10, store=SQLiteCacheStore(path), clock=clock)
+      writer.set('8.8.8.8', 'US')
+
+      # a second cache (e.g. another process) sees the entry through the store
+      reader = TTLCache(ttl=10, store=SQLiteCacheStore(path), clock=clock)
+      self.assertEqual(reader.get('8.8.8.8'), 'US')
+      self.assertEqual(reader.hits, 1)
+      self.assertEqual(len(reader), 1)
+
+      clock.now += 11
+      fresh = TTLCache(ttl=10, store=SQLiteCacheStore(path), clock=clock)
+      self.assertIsNone(fresh.get('8.8.8.8'))
+      # purged when the cache was created
+      self.assertEqual(fresh.store.purge(clock.now), 0)
+
+      for c in (writer, reader, fresh):
+        c.store.close()
+
+  def test_sqlite_store_purge(self):
+    clock = FakeClock()
+    with TemporaryDirectory() as td:
+      path = os.path.join(td, 'cache.sqlite')
+      store = SQLiteCacheStore(path)
+      cache = TTLCache(ttl=10, store=store, clock=clock, purge_every=3)
+      def rows():
+        return store.conn.execute('SELECT key FROM cache ORDER BY key').fetchall()
+
+      cache.set('a', 'DE')
+      cache.set('b', 'TR')
+      clock.now += 11
+      cache.set('c', 'US')
+      # the third set purged the two expired rows
+      self.assertEqual(rows(), [('c',)])
+
+      clock.now += 11
+      cache.set('d', 'AR')
+      self.assertEqual(rows(), [('c',), ('d',)])
+      # a new cache purges on open
+      TTLCache(ttl=10, store=SQLiteCacheStore(path), clock=clock).store.close()
+      self.assertEqual(rows(), [('d',)])
+      store.close()
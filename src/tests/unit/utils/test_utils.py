@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 import unittest
 
 from unittest.mock import patch
@@ -7,138 +10,146 @@ from subprocess import CalledProcessError
 from iplocationchanger.utils.utils import Utils
 
 class TestUtils(unittest.TestCase):
-  @patch('iplocationchanger.utils.utils.subprocess')
-  def test_run_proc(self, subprocess_mock):
+  def test_run_proc(self):
     test_cases = [
       {
-        'cmd': ['command_to_run', 'arg1', '--arg2'],
+        'case_name': 'success',
+        'script': 'import sys; print("normal output"); print("error output", file=sys.stderr)',
         'expect_error': False,
-        'returncode': 0,
-        'expected': {
-          'success': True,
-          'stdout': b'normal output',
-          'stderr': b'error output',
-        },
+        'expected': (True, 'normal output\n', 'error output\n'),
       },
       {
-        'cmd': ['command_to_run', 'arg1', '--arg2'],
-        'expect_error': False,
-        'returncode': 1,
-        'expected': {
-          'success': False,
-          'stdout': b'',
-          'stderr': b'error output',
-        },
+        'case_name': 'failure expected',
+        'script': 'import sys; print("partial"); print("error output", file=sys.stderr); sys.exit(2)',
+        'expect_error': True,
+        'expected': (False, 'partial\n', 'error output\n'),
+      },
+      {
+        'case_name': 'timeout expected',
+        'script': 'import time; time.sleep(10)',
+        'expect_error': True,
+        'timeout': 0.2,
+        'expected': (False, '', ''),
       },
     ]
 
     for tc in test_cases:
-      proc = Mock()
-      proc.returncode = tc['returncode']
-      proc.stdout = tc['expected']['stdout']
-      proc.stderr = tc['expected']['stderr']
-      subprocess_mock.run = Mock(return_value=proc)
-
       success, stdout, stderr = Utils.run_proc(
-        tc['cmd'],
+        [sys.executable, '-c', tc['script']],
         tc['expect_error'],
+        timeout=tc.get('timeout'),
       )
+      self.assertEqual(tc['expected'][0], success, msg=tc['case_name'])
+      self.assertEqual(tc['expected'][1], stdout, msg=tc['case_name'])
+      if len(tc['expected'][2]) > 0:
+        self.assertEqual(tc['expected'][2], stderr, msg=tc['case_name'])
 
-      subprocess_mock.run.assert_called_once_with(
-        tc['cmd'],
-        capture_output=True,
-        check=True,
-      )
-
-      self.assertEqual(
-        tc['expected']['success'],
-        success,
-      )
-      self.assertEqual(
-        tc['expected']['stdout'].decode('utf-8'),
-        stdout,
-      )
-      self.assertEqual(
-        tc['expected']['stderr'].decode('utf-8'),
-        stderr,
-      )
-
-  @patch('iplocationchanger.utils.utils.subprocess')
-  def test_run_proc_expect_error(self, subprocess_mock):
+  def test_run_proc_error(self):
     test_cases = [
       {
-        'cmd': ['command_to_run', 'arg1', '--arg2'],
-        'expect_error': True,
-        'returncode': 0,
-        'expected': {
-          'success': True,
-          'stdout': 'execution failed',
-          'stderr': 'called process error',
-        },
+        'case_name': 'non-zero exit',
+        'cmd': [sys.executable, '-c', 'import sys; sys.exit(1)'],
+        'timeout': None,
+        'expected': CalledProcessError,
+      },
+      {
+        'case_name': 'timeout',
+        'cmd': [sys.executable, '-c', 'import time; time.sleep(10)'],
+        'timeout': 0.2,
+        'expected': subprocess.TimeoutExpired,
+      },
+      {
+        'case_name': 'no such executable',
+        'cmd': ['/nonexistent/command_to_run', 'arg1'],
+        'timeout': None,
+        'expected': FileNotFoundError,
       },
     ]
 
     for tc in test_cases:
-      subprocess_mock.run = Mock(
-        side_effect=CalledProcessError(
-          tc['returncode'],
-          tc['cmd'],
-        )
-      )
+      with self.assertRaises(tc['expected'], msg=tc['case_name']):
+        Utils.run_proc(tc['cmd'], timeout=tc['timeout'])
 
-      success, stdout, stderr = Utils.run_proc(
-        tc['cmd'],
-        tc['expect_error'],
-      )
+    success, _, stderr = Utils.run_proc(['/nonexistent/command_to_run'], expect_error=True)
+    self.assertFalse(success)
+    self.assertIn('No such file', stderr)
 
-      self.assertEqual(
-        tc['expected']['success'],
-        success,
-      )
-      self.assertEqual(
-        tc['expected']['stdout'].decode('utf-8'),
-        stdout,
-      )
-      self.assertEqual(
-        tc['expected']['stderr'].decode('utf-8'),
-        stderr,
-      )
-
-  @patch('iplocationchanger.utils.utils.subprocess')
-  def test_run_proc_expect_error(self, subprocess_mock):
+  @patch('iplocationchanger.utils.utils.Utils.run_proc')
+  @patch('iplocationchanger.utils.utils.Utils.pid_alive')
+  def test_terminate_pid(self, pid_alive_mock, run_proc_mock):
     test_cases = [
       {
-        'cmd': ['command_to_run', 'arg1', '--arg2'],
-        'expect_error': False,
-        'returncode': 1,
-        'expected': {
-          'success': False,
-          'stdout': b'',
-          'stderr': b'error output',
-        },
+        'case_name': 'exits on SIGTERM',
+        'alive': True,
+        'dies_on': '-TERM',
+        'expected_signals': ['-TERM'],
       },
       {
-        'cmd': ['command_to_run', 'arg1', '--arg2'],
-        'expect_error': False,
-        'returncode': 0,
-        'expeted': {
-          'success': False,
-          'stdout': b'',
-          'stderr': b'error output',
-        },
+        'case_name': 'needs SIGKILL',
+        'alive': True,
+        'dies_on': '-KILL',
+        'expected_signals': ['-TERM', '-KILL'],
+      },
+      {
+        'case_name': 'already gone',
+        'alive': False,
+        'dies_on': None,
+        'expected_signals': [],
       },
     ]
 
     for tc in test_cases:
-      subprocess_mock.run = Mock(
-        side_effect=CalledProcessError(
-          tc['returncode'],
-          tc['cmd'],
-        )
+      state = {'alive': tc['alive']}
+      def run_proc(cmd, expect_error=False):
+        if cmd[2] == tc['dies_on']:
+          state['alive'] = False
+        return (True, '', '')
+      pid_alive_mock.side_effect = lambda pid: state['alive']
+      run_proc_mock.reset_mock()
+      run_proc_mock.side_effect = run_proc
+
+      elapsed = Utils.terminate_pid(4242, timeout=0.01, poll_interval=0.001)
+      self.assertGreaterEqual(elapsed, 0, msg=tc['case_name'])
+      self.assertEqual(
+        [c.args[0][2] for c in run_proc_mock.call_args_list],
+        tc['expected_signals'],
+        msg=tc['case_name'],
       )
 
-      with self.assertRaises(CalledProcessError):
-        Utils.run_proc(
-          tc['cmd'],
-          tc['expect_error'],
-        )
+  def test_pid_alive(self):
+    self.assertTrue(Utils.pid_alive(os.getpid()))
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    self.assertFalse(Utils.pid_alive(proc.pid))
+
+    # exited, but not reaped yet
+    if os.path.exists('/proc'):
+      proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+      os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+      self.assertFalse(Utils.pid_alive(proc.pid))
+      proc.wait()
+
+  def test_interface_up(self):
+    if not os.path.isdir('/sys/class/net'):
+      self.assertIsNone(Utils.interface_up('lo'))
+      return
+    self.assertTrue(Utils.interface_up('lo'))
+    self.assertFalse(Utils.interface_up('nonexistent0'))
+
+
+class TestUtilsAsync(unittest.IsolatedAsyncioTestCase):
+  async def test_run_proc_async(self):
+    success, stdout, stderr = await Utils.run_proc_async(
+      [sys.executable, '-c', 'import sys; print("out"); print("err", file=sys.stderr)'],
+    )
+    self.assertTrue(success)
+    self.assertEqual(stdout, 'out\n')
+    self.assertEqual(stderr, 'err\n')
+
+    failing = [sys.executable, '-c', 'import sys; sys.exit(3)']
+    with self.assertRaises(CalledProcessError):
+      await Utils.run_proc_async(failing)
+
+    success, stdout, _ = await Utils.run_proc_async(failing, expect_error=True)
+    self.assertFalse(success)
+    self.assertEqual(stdout, '')